@@ -0,0 +1,206 @@
+from __future__ import print_function
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from lc_functions import (nan_delete, normalize_qtr_med, lineup_qtr_gaps, long_detrend, phasecalc,
+	elc_chunks, write_elc_chunks)
+from synthlc import synthetic_eb
+'''
+Benchmarks for the light curve functions, on synthetic EB light curves (synthlc.py)
+from one quarter of long cadence up to the whole mission in short cadence.
+
+For every function and size it reports the best time of a few runs, the throughput
+(million points per second), and the peak memory the call allocated (from tracemalloc,
+which sees NumPy arrays), and compares them with benchmark_baseline.json:
+    python benchmark.py                            # everything, compared to the baseline
+    python benchmark.py --sizes quarter mission    # just the long cadence sizes
+    python benchmark.py --only lineup_qtr_gaps long_detrend
+    python benchmark.py --save                     # (re)write the baseline
+It exits with 1 if anything got more than 'tolerance' slower (plus a little slack,
+because timing is noisy) or needs more than 'tolerance' more memory than the baseline.
+The baseline is only meaningful on the machine it was saved on, so save your own.
+'''
+
+# the light curves to try: synthlc.synthetic_eb settings
+SIZES = [
+	('quarter', dict(quarters=[5], cadence='long')),
+	('mission', dict(quarters=range(1, 18), cadence='long')),
+	('sc-quarter', dict(quarters=[5], cadence='short')),
+	('sc-mission', dict(quarters=range(1, 18), cadence='short')),
+]
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# The inputs each function gets: per-quarter lists as read, without NaNs, normalized,
+# and everything stitched together (like the stages of 'makelc.py')
+def make_inputs(lc):
+	clean = [nan_delete(t, f, e) for t, f, e in zip(lc['time'], lc['flux'], lc['ferr'])]
+	time_q = [c[0] for c in clean]
+	flux_q = normalize_qtr_med([c[1].copy() for c in clean])
+	time_all = np.concatenate(time_q)
+	flux_all = np.concatenate(flux_q)
+	mag_all = -2.5*np.log10(flux_all / np.median(flux_all)) + 12
+	return dict(raw=lc, time_q=time_q, clean_flux_q=[c[1] for c in clean], flux_q=flux_q,
+		time_all=time_all, flux_all=flux_all, mag_all=mag_all, merr_all=np.zeros(len(mag_all)) + 3e-4)
+
+# Each benchmark: setup(inputs) gives the arguments for one run (copies, where the
+# function changes its inputs, made outside the timing), run(args) is timed, and
+# teardown(args) (if there is one) cleans up after it, also outside the timing
+# setup gives None if the function has nothing to do at that size
+def setup_nan_delete(d):
+	return d['raw']
+def run_nan_delete(lc):
+	return [nan_delete(t, f, e) for t, f, e in zip(lc['time'], lc['flux'], lc['ferr'])]
+
+def setup_normalize(d):
+	return [f.copy() for f in d['clean_flux_q']]
+def run_normalize(flux_q):
+	return normalize_qtr_med(flux_q)
+
+def setup_lineup(d):
+	if len(d['time_q']) < 2: # one quarter has no gaps to line up, so it returns right away
+		return None
+	return d['time_q'], list(d['flux_q']), d['raw']['mstart'], d['raw']['mend']
+def run_lineup(args):
+	return lineup_qtr_gaps(*args)
+
+def setup_detrend(d):
+	return d['time_all'], d['flux_all'], d['raw']['mstart'], d['raw']['mend']
+def run_detrend(args):
+	t, flux, mstart, mend = args
+	return long_detrend(t, flux, 3, mstart, mend)
+
+def setup_phasecalc(d):
+	return d['time_all'], d['raw']['period'], d['raw']['BJD0'] - 2454833.
+def run_phasecalc(args):
+	return phasecalc(*args)
+
+def setup_elc_chunks(d):
+	return d['time_all'], d['raw']['period'], d['raw']['BJD0'] - 2454833.
+def run_elc_chunks(args):
+	return elc_chunks(*args)
+
+def setup_write_elc(d):
+	outdir = tempfile.mkdtemp(prefix='benchmark_elc_')
+	return outdir, d['time_all'], d['mag_all'], d['merr_all'], d['raw']['period'], d['raw']['BJD0'] - 2454833.
+def run_write_elc(args):
+	outdir, t, mags, merrs, period, BJD0 = args
+	return write_elc_chunks(os.path.join(outdir, 'lcchunk'), t, mags, merrs, period, BJD0)
+def teardown_write_elc(args):
+	shutil.rmtree(args[0])
+
+# name, setup, run, teardown, and which input's length counts as 'points'
+BENCHMARKS = [
+	('nan_delete', setup_nan_delete, run_nan_delete, None, 'raw'),
+	('normalize_qtr_med', setup_normalize, run_normalize, None, 'time_all'),
+	('lineup_qtr_gaps', setup_lineup, run_lineup, None, 'time_all'),
+	('long_detrend', setup_detrend, run_detrend, None, 'time_all'),
+	('phasecalc', setup_phasecalc, run_phasecalc, None, 'time_all'),
+	('elc_chunks', setup_elc_chunks, run_elc_chunks, None, 'time_all'),
+	('write_elc_chunks', setup_write_elc, run_write_elc, teardown_write_elc, 'time_all'),
+]
+
+# Best time (seconds) of 'repeat' runs, and the peak memory (bytes) of one more run
+def measure(setup, run, inputs, repeat=3, teardown=None):
+	best = None
+	for i in range(0, repeat):
+		args = setup(inputs)
+		start = time.time()
+		run(args)
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+		if teardown is not None:
+			teardown(args)
+	peak = None
+	try:
+		import tracemalloc
+	except ImportError: # Python 2
+		return best, peak
+	args = setup(inputs)
+	tracemalloc.start()
+	try:
+		run(args)
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+		if teardown is not None:
+			teardown(args)
+	return best, peak
+
+# Run the benchmarks; returns a dictionary 'function/size' -> dict(time, peak, points)
+def run_bench(sizes=None, only=None, repeat=3, seed=0):
+	results = {}
+	for size, settings in SIZES:
+		if sizes and size not in sizes:
+			continue
+		inputs = make_inputs(synthetic_eb(seed=seed, **settings))
+		for name, setup, run, teardown, count in BENCHMARKS:
+			if only and name not in only:
+				continue
+			args = setup(inputs)
+			if args is None:
+				continue
+			if teardown is not None:
+				teardown(args)
+			points = sum(len(t) for t in inputs['raw']['time']) if count == 'raw' else len(inputs[count])
+			elapsed, peak = measure(setup, run, inputs, repeat, teardown)
+			results[name + '/' + size] = dict(time=elapsed, peak=peak, points=points)
+			print('{0:18s} {1:11s} {2:9d} pts {3:9.2f} ms {4:8.1f} Mpts/s {5}'.format(name, size, points,
+				1e3*elapsed, 1e-6*points / max(elapsed, 1e-9),
+				'' if peak is None else '{0:8.1f} MB peak'.format(peak / 2.**20)))
+			sys.stdout.flush()
+	return results
+
+# Compare with a baseline; returns a list of problems (empty = fine)
+def check(results, baseline, tolerance=0.5, slack=0.005):
+	problems = []
+	for key in sorted(results):
+		if key not in baseline:
+			continue
+		new, old = results[key], baseline[key]
+		if new['time'] > old['time'] * (1 + tolerance) + slack:
+			problems.append('{0} takes {1:.2f} ms (baseline {2:.2f} ms)'.format(key,
+				1e3*new['time'], 1e3*old['time']))
+		if new['peak'] is not None and old.get('peak') and new['peak'] > old['peak'] * (1 + tolerance) + 2**20:
+			problems.append('{0} needs {1:.1f} MB (baseline {2:.1f} MB)'.format(key,
+				new['peak'] / 2.**20, old['peak'] / 2.**20))
+	return problems
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmarks for the kepler-makelc light curve functions.')
+	parser.add_argument('--sizes', nargs='*', choices=[size for size, settings in SIZES],
+		help='light curve sizes to try (default: all)')
+	parser.add_argument('--only', nargs='*', choices=[b[0] for b in BENCHMARKS],
+		help='functions to time (default: all)')
+	parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark (the best counts)')
+	parser.add_argument('--baseline', default=BASELINE, help='baseline file')
+	parser.add_argument('--save', action='store_true', help='save these results as the baseline')
+	parser.add_argument('--tolerance', type=float, default=0.5, help='allowed fractional slowdown')
+	parser.add_argument('--slack', type=float, default=5.0, help='allowed extra milliseconds')
+	args = parser.parse_args(argv)
+
+	results = run_bench(args.sizes, args.only, args.repeat)
+	baseline = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+	if args.save:
+		baseline.update((key, dict(time=round(value['time'], 6), peak=value['peak'],
+			points=value['points'])) for key, value in results.items())
+		with open(args.baseline, 'w') as f:
+			json.dump(baseline, f, indent=1, sort_keys=True)
+		print('Saved the baseline to ' + args.baseline)
+		return 0
+	problems = check(results, baseline, args.tolerance, 1e-3*args.slack)
+	for problem in problems:
+		print('PROBLEM:', problem)
+	print('{0} benchmarks, {1} compared with the baseline, {2} problems'.format(len(results),
+		len([key for key in results if key in baseline]), len(problems)))
+	return 1 if problems else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
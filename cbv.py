@@ -0,0 +1,260 @@
+import os
+import re
+from collections import OrderedDict
+import numpy as np
+from lc_functions import in_mask
+'''
+Cotrending with Kepler cotrending basis vectors (CBVs), in plain NumPy.
+Use this with the program 'makelc.py' (it replaces the PyRAF/PyKE kepcotrend task).
+
+This does the same job as kepcotrend: fit the first few basis vectors to the
+(normalized) SAP flux, iteratively sigma-clipping outliers and ignoring any masked
+times (e.g., eclipses), then subtract the fit. Everything happens in memory, so no
+intermediate cbv_*.fits files are written and there is no IRAF startup to wait for.
+
+The outputs are equivalent to the CBVSAP_FLUX and CBVSAP_MODL columns that PyKE adds:
+    cbvsap_modl = best-fit combination of the basis vectors, in flux units
+    cbvsap_flux = sap_flux - cbvsap_modl
+cotrend's fit is least squares by default. PyKE's 'simplex' method with fitpower=1
+(what 'makelc.py' always ran) is a least-absolute-deviation fit; use fitpower=1 here
+for that (done by iteratively reweighted least squares), as 'makelc.py' does. Use
+check_cotrend to compare against an existing PyKE file; test_cbv.py does that for every
+cbv_kplr*.fits file it can find.
+
+astropy is only imported once a FITS file actually has to be read.
+
+CBVManager (get one with get_cbv_manager) indexes all the CBV files in a directory
+once, picks the right file for each light curve from its FITS header (quarter, data
+release, CCD module/output), and keeps recently used basis vectors in memory, so many
+targets on the same CCD channel only read the CBV file once. Short cadence light
+curves (one file per month) use the short cadence _scbv.fits files, per month if
+there is one (the month whose CADENCENO range covers the light curve's cadences).
+
+The CBV files are here: https://archive.stsci.edu/kepler/cbv.html
+'''
+
+# Read basis vectors for one CCD module/output from a CBV FITS file
+# returns an array of shape (nvec, ncadences)
+# if cadenceno is given, the vectors are lined up with those cadence numbers
+# (cadences missing from the CBV file get NaN)
+def read_cbv(cbvfile, module, output, nvec=16, cadenceno=None):
+	from astropy.io import fits
+	with fits.open(cbvfile) as f:
+		data = f['MODOUT_{0}_{1}'.format(int(module), int(output))].data
+		cbvcad = np.array(data['CADENCENO'])
+		vectors = np.array([data['VECTOR_{0}'.format(i)] for i in range(1, nvec+1)], dtype=np.float64)
+	if cadenceno is None:
+		return vectors
+	return align_cbv(vectors, cbvcad, cadenceno)
+
+# Line up basis vectors (nvec, ncbv) with the cadence numbers of a light curve
+def align_cbv(vectors, cbvcad, cadenceno):
+	cadenceno = np.asarray(cadenceno)
+	idx = np.clip(np.searchsorted(cbvcad, cadenceno), 0, len(cbvcad) - 1)
+	found = cbvcad[idx] == cadenceno
+	aligned = np.empty((len(vectors), len(cadenceno)))
+	aligned.fill(np.nan)
+	aligned[:, found] = vectors[:, idx[found]]
+	return aligned
+
+# CBV filenames look like kplr2009131105131-q00-d21_lcbv.fits
+# (short cadence files end in _scbv.fits, and may have a month, e.g. -q03-m2-d25)
+CBVNAME = re.compile(r'kplr(\d{13})-q(\d\d)(?:-?m(\d))?-d(\d\d)_([ls])cbv\.fits$')
+
+# Finds and caches basis vectors from all the CBV files in one directory
+# maxcache is how many (file, module, output) sets of vectors to keep in memory
+# (the default, 84, is one full quarter of the focal plane)
+class CBVManager(object):
+
+	def __init__(self, cbvdir, maxcache=84):
+		self.cbvdir = cbvdir
+		self.maxcache = maxcache
+		self.cache = OrderedDict()
+		self.ranges = {}
+		self.files = self.scan()
+
+	# index the directory: {(quarter, 'long' or 'short'): {data release: filename}}
+	# short cadence files for one month of a quarter go under (quarter, 'short', month)
+	# names that don't follow the MAST convention are identified from their headers
+	def scan(self):
+		files = {}
+		for name in sorted(os.listdir(self.cbvdir)):
+			if not name.endswith('cbv.fits'):
+				continue
+			match = CBVNAME.search(name)
+			if match:
+				quarter, release = int(match.group(2)), int(match.group(4))
+				month = match.group(3)
+				cadence = 'long' if match.group(5) == 'l' else 'short'
+			else:
+				from astropy.io import fits # only for files that don't have the usual name
+				header = fits.getheader(os.path.join(self.cbvdir, name))
+				quarter, release = int(header['quarter']), int(header['data_rel'])
+				month = header.get('month')
+				cadence = 'short' if name.endswith('_scbv.fits') else 'long'
+			key = (quarter, cadence) if month is None else (quarter, cadence, int(month))
+			files.setdefault(key, {})[release] = os.path.join(self.cbvdir, name)
+		return files
+
+	# CBV filename for a quarter (and month, for short cadence); uses the same data
+	# release as the light curve if we have it, otherwise the newest release
+	# a short cadence month without its own file uses the file for the whole quarter
+	def find(self, quarter, release=None, cadence='long', month=None):
+		keys = [(int(quarter), cadence)]
+		if month is not None:
+			keys.insert(0, (int(quarter), cadence, int(month)))
+		releases = None
+		for key in keys:
+			if key in self.files:
+				releases = self.files[key]
+				break
+		if releases is None:
+			raise IOError('No {0} cadence CBV file for quarter {1}{2} in {3}'.format(
+				cadence, quarter, '' if month is None else ' month {0}'.format(month), self.cbvdir))
+		if release is not None and int(release) in releases:
+			return releases[int(release)]
+		return releases[max(releases)]
+
+	# which month of a quarter some short cadence data is: the monthly _scbv.fits file
+	# whose cadence numbers cover the most of them (None if there are no monthly files,
+	# or none of them overlap)
+	def month(self, quarter, cadenceno, release=None):
+		cadenceno = np.asarray(cadenceno)
+		best, bestcount = None, 0
+		for key in sorted(self.files):
+			if len(key) < 3 or key[:2] != (int(quarter), 'short'):
+				continue
+			releases = self.files[key]
+			cbvfile = releases[int(release)] if release is not None and int(release) in releases \
+				else releases[max(releases)]
+			first, last = self.cadence_range(cbvfile)
+			count = np.sum((cadenceno >= first) & (cadenceno <= last))
+			if count > bestcount:
+				best, bestcount = key[2], count
+		return best
+
+	# (first, last) cadence number in a CBV file (every MODOUT extension has the same ones)
+	def cadence_range(self, cbvfile):
+		if cbvfile not in self.ranges:
+			from astropy.io import fits
+			with fits.open(cbvfile) as f:
+				cbvcad = np.array(f[1].data['CADENCENO'])
+			self.ranges[cbvfile] = cbvcad.min(), cbvcad.max()
+		return self.ranges[cbvfile]
+
+	# (cadence numbers, basis vectors) for one CCD module/output, read at most once
+	def vectors(self, cbvfile, module, output, nvec=16):
+		key = (cbvfile, int(module), int(output))
+		if key in self.cache:
+			cbvcad, vectors = self.cache.pop(key)
+			self.cache[key] = cbvcad, vectors # most recently used goes last
+		else:
+			from astropy.io import fits
+			with fits.open(cbvfile) as f:
+				data = f['MODOUT_{0}_{1}'.format(int(module), int(output))].data
+				cbvcad = np.array(data['CADENCENO'])
+				vectors = np.array([data['VECTOR_{0}'.format(i)] for i in range(1, 17)
+					if 'VECTOR_{0}'.format(i) in data.columns.names], dtype=np.float64)
+			self.cache[key] = cbvcad, vectors
+			while len(self.cache) > self.maxcache:
+				self.cache.popitem(last=False) # least recently used goes first
+		return cbvcad, vectors[:nvec]
+
+	# basis vectors lined up with an open light curve FITS file, using its header
+	# (short cadence files: the month comes from the cadence numbers, unless it's given)
+	def lc_vectors(self, lcfits, nvec=16, month=None):
+		header = lcfits[0].header
+		cadence = 'short' if header.get('obsmode', '').startswith('short') else 'long'
+		if month is None and cadence == 'short':
+			month = self.month(header['quarter'], lcfits[1].data['cadenceno'], header.get('data_rel'))
+		cbvfile = self.find(header['quarter'], header.get('data_rel'), cadence, month)
+		cbvcad, vectors = self.vectors(cbvfile, header['module'], header['output'], nvec)
+		return align_cbv(vectors, cbvcad, lcfits[1].data['cadenceno'])
+
+# one CBVManager per directory, shared by every target processed in this process
+managers = {}
+def get_cbv_manager(cbvdir):
+	if cbvdir not in managers:
+		managers[cbvdir] = CBVManager(cbvdir)
+	return managers[cbvdir]
+
+# Fit and remove the basis vectors from one quarter of flux
+# time, flux: one quarter of Kepler time and SAP flux
+# vectors: basis vectors lined up with time, shape (nvec or more, len(time))
+# mstart, mend: masked time intervals (same units as time) left out of the fit
+# nvec: how many basis vectors to use (the first nvec)
+# sigmaclip: with iterate=True, points more than sigmaclip*std from the fit are
+# dropped and the fit is repeated until nothing else gets clipped
+# fitpower: 2 = least squares, 1 = least absolute deviation (like PyKE's simplex)
+# returns cbvsap_flux, cbvsap_modl, and the fit coefficients
+def cotrend(time, flux, vectors, mstart=[], mend=[], nvec=2, sigmaclip=2.0, iterate=True,
+	fitpower=2, maxiter=100):
+	time = np.asarray(time, dtype=np.float64)
+	flux = np.asarray(flux, dtype=np.float64)
+	design = np.asarray(vectors, dtype=np.float64)[:nvec].T
+	good = np.isfinite(time) & np.isfinite(flux) & np.isfinite(design).all(axis=1)
+	medflux = np.median(flux[good])
+	normflux = flux / medflux - 1.0
+	use = good & ~in_mask(time, mstart, mend)
+	for i in range(0, maxiter):
+		coeffs = fit_vectors(design[use], normflux[use], fitpower)
+		fit = np.dot(design, coeffs)
+		if not iterate:
+			break
+		resid = normflux - fit
+		keep = use & (np.abs(resid) <= sigmaclip * np.std(resid[use]))
+		if keep.sum() == use.sum() or keep.sum() <= nvec:
+			break
+		use = keep
+	cbvsap_modl = fit * medflux
+	return flux - cbvsap_modl, cbvsap_modl, coeffs
+
+# Solve design * coeffs = y, minimizing sum(|resid|**fitpower)
+# fitpower=2 is ordinary least squares; anything else uses iteratively reweighted
+# least squares, starting from the least squares answer (fitpower=1 can take a
+# hundred or so iterations to settle down to the answer kepcotrend's simplex finds)
+def fit_vectors(design, y, fitpower=2, niter=200, tol=1e-10):
+	coeffs = np.linalg.lstsq(design, y, rcond=None)[0]
+	if fitpower == 2:
+		return coeffs
+	for i in range(0, niter):
+		resid = np.abs(y - np.dot(design, coeffs))
+		weights = np.sqrt(np.maximum(resid, 1e-12) ** (fitpower - 2))
+		newcoeffs = np.linalg.lstsq(design * weights[:, np.newaxis], y * weights, rcond=None)[0]
+		if np.all(np.abs(newcoeffs - coeffs) <= tol * (1 + np.abs(coeffs))):
+			return newcoeffs
+		coeffs = newcoeffs
+	return coeffs
+
+# Cotrend an open Kepler light curve FITS file (from kplr / MAST)
+# cbv is either a CBV filename or a CBVManager (which picks the file itself)
+# The CCD module/output comes from the light curve header
+# month: which month of the quarter a short cadence file is (for picking the CBVs)
+# returns cbvsap_flux, cbvsap_modl, and the fit coefficients
+def cotrend_lc(lcfits, cbv, mstart=[], mend=[], nvec=2, month=None, **kwargs):
+	data = lcfits[1].data
+	if isinstance(cbv, CBVManager):
+		vectors = cbv.lc_vectors(lcfits, nvec=nvec, month=month)
+	else:
+		vectors = read_cbv(cbv, lcfits[0].header['module'], lcfits[0].header['output'],
+			nvec=nvec, cadenceno=data['cadenceno'])
+	return cotrend(data['time'], data['sap_flux'], vectors, mstart, mend, nvec=nvec, **kwargs)
+
+# Compare against a light curve that PyKE's kepcotrend already processed
+# (one of the cbv_kplr*.fits files that older versions of 'makelc.py' left behind)
+# returns the largest differences in cbvsap_flux and cbvsap_modl, as a fraction of
+# the median SAP flux, for the points where both versions have numbers
+# (the settings default to the ones 'makelc.py' gave kepcotrend)
+def check_cotrend(pykefile, cbv, mstart=[], mend=[], nvec=2, fitpower=1, **kwargs):
+	from astropy.io import fits
+	with fits.open(pykefile) as f:
+		cbvflux, cbvmodl, coeffs = cotrend_lc(f, cbv, mstart, mend, nvec=nvec, fitpower=fitpower,
+			**kwargs)
+		data = f[1].data
+		pykeflux = np.array(data['cbvsap_flux'], dtype=np.float64)
+		pykemodl = np.array(data['cbvsap_modl'], dtype=np.float64)
+		medflux = np.nanmedian(data['sap_flux'])
+	both = np.isfinite(cbvflux) & np.isfinite(pykeflux)
+	fluxdiff = np.max(np.abs(cbvflux[both] - pykeflux[both])) / medflux
+	modldiff = np.max(np.abs(cbvmodl[both] - pykemodl[both])) / medflux
+	return fluxdiff, modldiff
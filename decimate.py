@@ -0,0 +1,105 @@
+import numpy as np
+'''
+Plot long light curves without handing millions of points to matplotlib.
+Use this with 'makelc.py' and 'lcplotter.py'.
+
+The time (or phase) axis is cut into about as many bins as there are pixels across
+the plot, and only a few REAL points are kept from each bin:
+    'minmax': the brightest and faintest point in each bin (good for lines)
+    'median': the median point in each bin, PLUS the brightest and faintest ones
+    'pixels': one point for every pixel (in x AND y) that has any points in it, PLUS
+              the brightest and faintest ones (good for markers: eclipse ingress and
+              egress still look filled in)
+Every mode keeps the deepest point of every eclipse (and every other extreme point)
+exactly, so nothing that would have been visible disappears; you just stop drawing
+hundreds of points on top of each other.
+
+plot_decimated(ax, x, y, ...) plots the decimated points and, in an interactive
+window, decimates again every time you zoom or pan, so zooming in shows more detail.
+'''
+
+# index of the first minimum of y within each segment y[starts[i]:starts[i+1]]
+def segment_argmin(y, starts):
+	segmin = np.minimum.reduceat(y, starts)
+	lengths = np.diff(np.append(starts, len(y)))
+	hits = np.nonzero(y == np.repeat(segmin, lengths))[0]
+	segs = np.searchsorted(starts, hits, side='right') - 1
+	return hits[np.unique(segs, return_index=True)[1]]
+
+# index of the median of y within each segment (the lower one for an even count)
+def segment_argmedian(y, starts):
+	lengths = np.diff(np.append(starts, len(y)))
+	segs = np.repeat(np.arange(len(starts)), lengths)
+	order = np.lexsort((y, segs)) # sorted by y within each segment
+	return order[starts + (lengths - 1)//2]
+
+# Decimate x, y down to roughly nbins bins across [xmin, xmax] (default: all the data)
+# x must be sorted (use sort=True if it isn't); NaNs are dropped
+# mode='pixels' also needs ybins bins across ylim = (ymin, ymax)
+# returns the kept x, y (still in x order)
+def decimate(x, y, nbins=2000, mode='minmax', xmin=None, xmax=None, sort=False, ybins=None,
+	ylim=None):
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	good = np.isfinite(x) & np.isfinite(y)
+	if not good.all():
+		x, y = x[good], y[good]
+	if sort:
+		order = np.argsort(x, kind='mergesort')
+		x, y = x[order], y[order]
+	npoints = 3 if mode == 'median' else 2
+	if len(x) <= npoints * nbins:
+		return x, y
+	lo = x[0] if xmin is None else xmin
+	hi = x[-1] if xmax is None else xmax
+	edges = np.linspace(lo, hi, nbins + 1)
+	starts = np.unique(np.searchsorted(x, edges[:-1], side='left'))
+	starts = starts[starts < len(x)]
+	if starts[0] != 0: # points before xmin get their own bin
+		starts = np.append(0, starts)
+	keep = np.union1d(segment_argmin(y, starts), segment_argmin(-y, starts))
+	if mode == 'median':
+		keep = np.union1d(keep, segment_argmedian(y, starts))
+	elif mode == 'pixels':
+		ylo, yhi = sorted(ylim) if ylim is not None else (y.min(), y.max())
+		xcell = np.searchsorted(starts, np.arange(len(x)), side='right') - 1
+		ycell = np.clip(((y - ylo) / max(yhi - ylo, 1e-300) * ybins).astype(np.int64), 0, ybins - 1)
+		keep = np.union1d(keep, np.unique(xcell * ybins + ycell, return_index=True)[1])
+	elif mode != 'minmax':
+		raise ValueError("mode must be 'minmax', 'median', or 'pixels'")
+	return x[keep], y[keep]
+
+# Plot y vs. x on the axes ax (like ax.plot), decimated to the size of the axes
+# in pixels times 'oversample'. Extra keywords go to ax.plot. Returns the Line2D.
+# mode='auto' uses 'pixels' for markers only (linestyle 'None') and 'minmax' for lines
+# In an interactive window the points are decimated again after every zoom/pan.
+def plot_decimated(ax, x, y, mode='auto', oversample=2, **kwargs):
+	if mode == 'auto':
+		linestyle = kwargs.get('linestyle', kwargs.get('ls', '-'))
+		mode = 'pixels' if linestyle in ('None', 'none', '', ' ', None) else 'minmax'
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	good = np.isfinite(x) & np.isfinite(y)
+	order = np.argsort(x[good], kind='mergesort') # sort just once
+	x, y = x[good][order], y[good][order]
+
+	def nbins():
+		return max(int(ax.bbox.width * oversample), 10)
+
+	def ybins():
+		return max(int(ax.bbox.height * oversample), 10)
+
+	line, = ax.plot(*decimate(x, y, nbins(), mode, ybins=ybins()), **kwargs)
+
+	def redecimate(ax):
+		lo, hi = sorted(ax.get_xlim())
+		# include one point on either side so lines run off the edges properly
+		i0 = max(np.searchsorted(x, lo, side='left') - 1, 0)
+		i1 = np.searchsorted(x, hi, side='right') + 1
+		line.set_data(*decimate(x[i0:i1], y[i0:i1], nbins(), mode, xmin=lo, xmax=hi,
+			ybins=ybins(), ylim=ax.get_ylim()))
+
+	ax.callbacks.connect('xlim_changed', redecimate)
+	ax.callbacks.connect('ylim_changed', redecimate)
+	redecimate(ax) # in case the x limits were already set to something narrower
+	return line
@@ -0,0 +1,239 @@
+import heapq
+import numpy as np
+from lc_functions import in_mask
+'''
+Long-term detrending ('leveling out') for stitched Kepler light curves.
+Use this with 'makelc.py' (it replaces the single global polynomial of long_detrend).
+
+Three ways to find the trend, all of which skip masked times (e.g., eclipses), so deep
+eclipses can't drag the trend down with them:
+    'poly':   one polynomial for the whole light curve (order 3 by default)
+    'spline': a least-squares cubic spline for each quarter, with knots every
+              'window' days (needs scipy)
+    'median': a sliding median, 'window' days wide, for each quarter; the window
+              is kept in two heaps, so this is O(n log w) for a window of w points
+Every function takes ONE flux array or a LIST of them on the same time stamps (e.g.,
+[flux_cbv, flux_sap]) and gives back the same thing, detrended. The flux is divided
+by the trend and scaled back up to its median, just like long_detrend did.
+
+times must be sorted. breaks are the times where a new quarter (or month) starts;
+the spline and median trends never reach across them.
+'''
+
+# turn one flux array or a list of them into an (n, ncolumns) array
+# also returns a function that turns an (n, ncolumns) array back into the same shape
+def as_columns(fluxes):
+	if isinstance(fluxes, (list, tuple)):
+		columns = np.column_stack([np.asarray(flux, dtype=np.float64) for flux in fluxes])
+		return columns, lambda cols: [cols[:, i] for i in range(cols.shape[1])]
+	columns = np.asarray(fluxes, dtype=np.float64)[:, np.newaxis]
+	return columns, lambda cols: cols[:, 0]
+
+# index ranges [(start, stop), ...] of the segments of sorted times, split at breaks
+def segment_ranges(t, breaks=None):
+	if breaks is None or len(breaks) == 0:
+		return [(0, len(t))]
+	edges = np.unique(np.concatenate(([0], np.searchsorted(t, breaks), [len(t)])))
+	return [(start, stop) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+# divide out the trend, keeping each flux column at its median level
+def remove_trend(columns, trend):
+	return columns / trend * np.median(columns, axis=0)
+
+# Fit ONE polynomial to the whole light curve, leaving out masked times
+# the times are centered and scaled to [-1, 1] first (four years of days to the 3rd
+# power is not a well-conditioned fit), every column is fit in one np.polyfit call,
+# and the fit is evaluated with np.polyval (Horner's rule)
+# with sigmaclip, points more than sigmaclip*std from the fit are dropped and the fit
+# is repeated until nothing else gets clipped
+def poly_detrend(t, fluxes, order=3, mstart=[], mend=[], sigmaclip=None, maxiter=10):
+	t = np.asarray(t, dtype=np.float64)
+	columns, unpack = as_columns(fluxes)
+	x = (t - 0.5*(t[0] + t[-1])) / max(0.5*(t[-1] - t[0]), 1e-10)
+	use = ~in_mask(t, mstart, mend)
+	if use.sum() <= order: # (nearly) everything is masked, just fit it all
+		use[:] = True
+	for i in range(0, maxiter):
+		coeffs = np.polyfit(x[use], columns[use], order)
+		trend = np.polyval(coeffs, x[:, np.newaxis])
+		if sigmaclip is None:
+			break
+		resid = columns - trend
+		keep = use & np.all(np.abs(resid) <= sigmaclip * np.std(resid[use], axis=0), axis=1)
+		if keep.sum() == use.sum() or keep.sum() <= order:
+			break
+		use = keep
+	return unpack(remove_trend(columns, trend))
+
+# interior knots every 'spacing' days, dropping any knot that would leave fewer than
+# minpoints unmasked points in a knot interval (so masked eclipses and data gaps
+# can't leave a piece of the spline with nothing to fit)
+def spline_knots(tfit, spacing, minpoints=8):
+	candidates = np.arange(tfit[0] + spacing, tfit[-1], spacing)
+	counts = np.searchsorted(tfit, candidates)
+	knots, last = [], 0
+	for knot, count in zip(candidates, counts):
+		if count - last >= minpoints and len(tfit) - count >= minpoints:
+			knots.append(knot)
+			last = count
+	return np.array(knots)
+
+# Fit a least-squares cubic spline to each segment (quarter), leaving out masked times
+# knots are placed every 'window' days; all the columns are fit at once
+def spline_detrend(t, fluxes, window=1.5, breaks=None, mstart=[], mend=[], degree=3):
+	from scipy.interpolate import BSpline # only needed for this method
+	t = np.asarray(t, dtype=np.float64)
+	columns, unpack = as_columns(fluxes)
+	masked = in_mask(t, mstart, mend)
+	trend = np.empty(columns.shape)
+	for start, stop in segment_ranges(t, breaks):
+		tseg = t[start:stop]
+		if stop - start <= 2*(degree + 1): # too short for a spline, just use the median
+			trend[start:stop] = np.median(columns[start:stop], axis=0)
+			continue
+		use = ~masked[start:stop]
+		if use.sum() <= 2*(degree + 1): # not enough to fit, use everything
+			use[:] = True
+		knots = spline_knots(tseg[use], window, minpoints=2*(degree + 1))
+		# full knot vector: the ends of the segment are repeated degree+1 times
+		allknots = np.concatenate(([tseg[0]]*(degree + 1), knots, [tseg[-1]]*(degree + 1)))
+		design = BSpline.design_matrix(tseg, allknots, degree).toarray()
+		coeffs = np.linalg.lstsq(design[use], columns[start:stop][use], rcond=None)[0]
+		trend[start:stop] = np.dot(design, coeffs)
+	return unpack(remove_trend(columns, trend))
+
+# A multiset of numbers that can give its median at any time: the smaller half is in
+# a max-heap ('low', stored negated) and the larger half in a min-heap ('high'), so
+# adding or removing a point and getting the median are all O(log w) for w points.
+# Points are known by an id (e.g., their index); removing one only marks it as gone,
+# and it's thrown away once it gets to the top of its heap. A heap that gets more than
+# half stale is rebuilt, so the heaps stay O(w) long however many points went through.
+class MedianWindow(object):
+
+	def __init__(self):
+		self.low, self.high = [], []
+		self.nlow, self.nhigh = 0, 0
+		self.side = {} # id -> 'low' or 'high', for the points that are in the window
+
+	def __len__(self):
+		return self.nlow + self.nhigh
+
+	def add(self, ident, value):
+		if self.nlow == 0 or value <= -self.low[0][0]:
+			heapq.heappush(self.low, (-value, ident))
+			self.side[ident] = 'low'
+			self.nlow += 1
+		else:
+			heapq.heappush(self.high, (value, ident))
+			self.side[ident] = 'high'
+			self.nhigh += 1
+		self.balance()
+
+	def remove(self, ident):
+		if self.side.pop(ident) == 'low':
+			self.nlow -= 1
+		else:
+			self.nhigh -= 1
+		self.balance()
+
+	def median(self):
+		if self.nlow == 0:
+			return np.nan
+		if self.nlow > self.nhigh:
+			return -self.low[0][0]
+		return 0.5*(-self.low[0][0] + self.high[0][0])
+
+	# low gets the extra point when there's an odd number, and the tops are never stale
+	def balance(self):
+		self.prune()
+		while self.nlow > self.nhigh + 1:
+			value, ident = heapq.heappop(self.low)
+			heapq.heappush(self.high, (-value, ident))
+			self.side[ident] = 'high'
+			self.nlow, self.nhigh = self.nlow - 1, self.nhigh + 1
+			self.prune()
+		while self.nlow < self.nhigh:
+			value, ident = heapq.heappop(self.high)
+			heapq.heappush(self.low, (-value, ident))
+			self.side[ident] = 'low'
+			self.nlow, self.nhigh = self.nlow + 1, self.nhigh - 1
+			self.prune()
+
+	# drop removed points from the tops of the heaps (and rebuild a heap that's mostly
+	# removed points); a point counts as removed if it isn't on that heap's side anymore
+	def prune(self):
+		for heap, name, count in ((self.low, 'low', self.nlow), (self.high, 'high', self.nhigh)):
+			if len(heap) > 2*count + 16:
+				heap[:] = [item for item in heap if self.side.get(item[1]) == name]
+				heapq.heapify(heap)
+			while heap and self.side.get(heap[0][1]) != name:
+				heapq.heappop(heap)
+
+# Running median of y over a window of 'width' points (made odd), centered on each point
+# points where mask is True are left out of every window (but still get a median from
+# their neighbors); windows are cut short at the ends
+# the window is a MedianWindow, so each step is O(log w) instead of a full sort
+# Points with nothing unmasked in their window get NaN.
+def sliding_median(y, width, mask=None):
+	y = np.asarray(y, dtype=np.float64)
+	n = len(y)
+	half = max(int(width), 1) // 2
+	values = y.tolist()
+	use = [True]*n if mask is None else (~np.asarray(mask, dtype=bool)).tolist()
+	window = MedianWindow()
+	for i in range(0, min(half, n)):
+		if use[i]:
+			window.add(i, values[i])
+	medians = np.empty(n)
+	for i in range(0, n):
+		new = i + half # point coming into the window
+		if new < n and use[new]:
+			window.add(new, values[new])
+		old = i - half - 1 # point leaving the window
+		if old >= 0 and use[old]:
+			window.remove(old)
+		medians[i] = window.median()
+	return medians
+
+# number of points in 'window' days, from the typical cadence of the times t
+def window_points(t, window):
+	if len(t) < 2:
+		return 1
+	cadence = np.median(np.diff(t))
+	return int(round(window / cadence)) | 1 if cadence > 0 else 1
+
+# Divide out a sliding median 'window' days wide, separately in each segment (quarter)
+# masked times are left out of the medians; stretches that are entirely masked for
+# longer than the window get their trend interpolated from either side
+def median_detrend(t, fluxes, window=2.0, breaks=None, mstart=[], mend=[]):
+	t = np.asarray(t, dtype=np.float64)
+	columns, unpack = as_columns(fluxes)
+	masked = in_mask(t, mstart, mend)
+	trend = np.empty(columns.shape)
+	for start, stop in segment_ranges(t, breaks):
+		tseg = t[start:stop]
+		width = window_points(tseg, window)
+		segmask = masked[start:stop]
+		if segmask.all():
+			segmask = None
+		for j in range(0, columns.shape[1]):
+			med = sliding_median(columns[start:stop, j], width, segmask)
+			bad = np.isnan(med)
+			if bad.any():
+				med[bad] = np.interp(tseg[bad], tseg[~bad], med[~bad])
+			trend[start:stop, j] = med
+	return unpack(remove_trend(columns, trend))
+
+DETREND_METHODS = ('poly', 'spline', 'median')
+
+# Detrend with any of the methods above: method is 'poly', 'spline', or 'median'
+# order is used by 'poly', window (days) by 'spline' and 'median' (None = their default)
+def detrend(t, fluxes, method='poly', order=3, window=None, breaks=None, mstart=[], mend=[]):
+	if method == 'poly':
+		return poly_detrend(t, fluxes, order=order, mstart=mstart, mend=mend)
+	kwargs = {} if window is None else dict(window=window)
+	if method == 'spline':
+		return spline_detrend(t, fluxes, breaks=breaks, mstart=mstart, mend=mend, **kwargs)
+	if method == 'median':
+		return median_detrend(t, fluxes, breaks=breaks, mstart=mstart, mend=mend, **kwargs)
+	raise ValueError('detrend method must be one of ' + ', '.join(DETREND_METHODS))
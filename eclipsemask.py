@@ -0,0 +1,97 @@
+from __future__ import print_function
+import os
+import sys
+import argparse
+import numpy as np
+from lc_functions import merge_mask
+'''
+Eclipse masks, made automatically from an ephemeris.
+Use this with 'makelc.py', which leaves masked times out of the cotrending, the gap
+alignment, the detrending, and the outlier removal.
+
+Instead of typing eclipse start/end times into mask_kepcotrend.txt by hand, give the
+period, BJD0 (the middle of the primary eclipse), and the phase range of each eclipse,
+the same numbers that are in 'lcplotter.py' (primary_phasemin/max, secondary_phasemin/max):
+    mstart, mend = eclipse_mask(171.277967, 2455170.514777 - 2454833,
+        [(0.97, 1.03), (0.685, 0.745)])
+Every eclipse in the time range is masked, as sorted, non-overlapping intervals, so
+in_mask (in 'lc_functions.py') can check a whole array of times at once with
+searchsorted. Phase ranges can be written either way around phase 1 (0.97-1.03 is
+the same as -0.03-0.03).
+
+write_mask saves a mask in the format PyKE's kepcotrend (and 'makelc.py') reads: one
+'start,end' line per interval in full BJD. read_mask reads one back in Kepler time.
+From the command line:
+    python eclipsemask.py --period 171.277967 --bjd0 2455170.514777 \\
+        --primary 0.97 1.03 --secondary 0.685 0.745 -o mask_kepcotrend.txt
+'''
+
+# Kepler time = BJD - 2454833
+KEPLER_BJD = 2454833.
+# all of the Kepler data (in Kepler time), with a little room on either side
+KEPLER_SPAN = (100., 1650.)
+
+# Mask every eclipse between tmin and tmax
+# period, BJD0, tmin, tmax: all in the same units (e.g., Kepler time)
+# windows: a list of (phasemin, phasemax) pairs, one per eclipse (e.g., primary and
+# secondary), with BJD0 at phase 0 (or 1)
+# returns the sorted, merged interval starts and ends
+def eclipse_mask(period, BJD0, windows, tmin=KEPLER_SPAN[0], tmax=KEPLER_SPAN[1]):
+	windows = np.atleast_2d(np.asarray(windows, dtype=np.float64))
+	phasemin, phasemax = windows[:, 0], windows[:, 1]
+	# every cycle that could have an eclipse in [tmin, tmax]
+	first = np.floor((tmin - BJD0) / period - phasemax.max())
+	last = np.ceil((tmax - BJD0) / period - phasemin.min())
+	cycles = np.arange(first, last + 1)[:, np.newaxis]
+	mstart = (BJD0 + (cycles + phasemin) * period).ravel()
+	mend = (BJD0 + (cycles + phasemax) * period).ravel()
+	keep = (mend > tmin) & (mstart < tmax)
+	return merge_mask(mstart[keep], mend[keep])
+
+# (phasemin, phasemax) for an eclipse centered on 'phase', 'width' in phase wide
+def eclipse_window(phase, width):
+	return (phase - 0.5*width, phase + 0.5*width)
+
+# The eclipse windows of a target from the settings 'lcplotter.py' uses
+# (a dictionary with primary_phasemin, primary_phasemax, and maybe the secondary ones)
+def target_windows(target):
+	windows = [(target['primary_phasemin'], target['primary_phasemax'])]
+	if 'secondary_phasemin' in target:
+		windows.append((target['secondary_phasemin'], target['secondary_phasemax']))
+	return windows
+
+# Write a mask in the PyKE/kepcotrend format: 'start,end' in BJD, one interval per line
+# mstart, mend are in Kepler time unless offset=0
+def write_mask(filename, mstart, mend, offset=KEPLER_BJD):
+	mstart, mend = merge_mask(mstart, mend)
+	np.savetxt(filename, np.column_stack((mstart + offset, mend + offset)), delimiter=',',
+		fmt='%.6f')
+
+# Read a PyKE-format mask file; returns sorted, merged (mstart, mend) in Kepler time
+# (unless offset=0). A missing or empty file is an empty mask.
+def read_mask(filename, offset=KEPLER_BJD):
+	if not filename or not os.path.exists(filename) or os.path.getsize(filename) == 0:
+		return np.zeros(0), np.zeros(0)
+	bounds = np.loadtxt(filename, delimiter=',', ndmin=2)
+	return merge_mask(bounds[:, 0] - offset, bounds[:, 1] - offset)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Write an eclipse mask file from an ephemeris.')
+	parser.add_argument('--period', type=float, required=True, help='orbital period (days)')
+	parser.add_argument('--bjd0', type=float, required=True, help='BJD of a primary eclipse')
+	parser.add_argument('--primary', type=float, nargs=2, required=True, metavar=('PHASEMIN', 'PHASEMAX'),
+		help='phase range of the primary eclipse, e.g. 0.97 1.03')
+	parser.add_argument('--secondary', type=float, nargs=2, metavar=('PHASEMIN', 'PHASEMAX'),
+		help='phase range of the secondary eclipse, e.g. 0.685 0.745')
+	parser.add_argument('--tmin', type=float, default=KEPLER_SPAN[0], help='start (Kepler time)')
+	parser.add_argument('--tmax', type=float, default=KEPLER_SPAN[1], help='end (Kepler time)')
+	parser.add_argument('-o', '--outfile', default='mask_kepcotrend.txt', help='mask file to write')
+	args = parser.parse_args(argv)
+	windows = [args.primary] + ([args.secondary] if args.secondary else [])
+	mstart, mend = eclipse_mask(args.period, args.bjd0 - KEPLER_BJD, windows, args.tmin, args.tmax)
+	write_mask(args.outfile, mstart, mend)
+	print('Wrote {0} masked intervals to {1}'.format(len(mstart), args.outfile))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
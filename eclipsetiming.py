@@ -0,0 +1,367 @@
+from __future__ import print_function
+import sys
+import argparse
+import multiprocessing
+import numpy as np
+from lc_functions import read_lc
+from eclipsemask import KEPLER_BJD
+from periodsearch import prepare
+'''
+Measure the time of every individual eclipse and its O-C (observed minus calculated)
+from a period and BJD0, e.g. to look for eclipse timing variations.
+
+Give it a light curve ('makelc.py' output, or the full ELC file from 'ELClcprep.py' in
+magnitudes) and the phase range of each eclipse, the same numbers that are in
+'lcplotter.py' and 'eclipsemask.py':
+    timing = eclipse_times(t, flux, 171.277967, 2455170.514777,
+        [(0.97, 1.03), (0.685, 0.745)], ferr)
+Two ways to time an eclipse:
+- 'template' (the default): all the eclipses are folded into one average eclipse
+  shape, and each eclipse is slid along it (with its own flux offset) to find the
+  best time. Every eclipse is fit at once: one grid of trial shifts, with the fit
+  quality for all the eclipses from a few bincounts per trial shift, then a finer
+  grid around each eclipse's best shift. The template is remade from the aligned
+  eclipses and everything is done again.
+- 'poly': a parabola fit to the bottom of each eclipse (all the eclipses at once,
+  from stacked 3x3 least-squares problems), recentered on the bottom a few times.
+  Only the part of the eclipse more than half as deep as the bottom is used.
+Eclipses are split between 'processes' worker processes, but a thousand eclipses only
+take a fraction of a second on one core anyway.
+
+From the command line:
+    python eclipsetiming.py makelc_out.txt --period 171.277967 --bjd0 2455170.514777 \\
+        --primary 0.97 1.03 --secondary 0.685 0.745 -o eclipse_times.txt
+Times go in and come out as full BJDs. Errors come from the curvature of the fit, scaled
+by its scatter, so they don't depend on having good flux errors; then the errors of
+each eclipse (primary, secondary) are scaled together to match how much the O-C jumps
+from one eclipse to the next (calibrate_errors), which also covers how well the
+template matches each eclipse.
+'''
+
+# The middle of an eclipse window (a phase from 0 to 1), and its half width in phase
+# phasemin/max are written like in 'lcplotter.py' (0.97 to 1.03 has its middle at 0)
+def window_center(phasemin, phasemax):
+	return (0.5*(phasemin + phasemax)) % 1, 0.5*(phasemax - phasemin)
+
+# The points within 'halfwidth' days of every predicted eclipse T0 + (n + center)*period
+# returns the cycle number n and offset from the predicted middle (days) of each of
+# those points, and which points they are
+def eclipse_points(t, period, T0, center, halfwidth):
+	x = (t - T0) / period - center
+	cycles = np.round(x)
+	offset = (x - cycles) * period
+	near = np.abs(offset) < halfwidth
+	return cycles[near].astype(np.int64), offset[near], near
+
+# The eclipses (cycle numbers) with at least minpoints points, and at least minpoints/4
+# on each side of the middle; returns those cycles, the eclipse (0 to neclipses-1) of
+# every point that is kept, the points in each eclipse, and which points are kept
+def select_eclipses(cycles, offset, minpoints=10):
+	ecl, ids = np.unique(cycles, return_inverse=True)
+	ids = ids.ravel()
+	npts = np.bincount(ids, minlength=len(ecl))
+	before = np.bincount(ids, offset < 0, minlength=len(ecl))
+	good = (npts >= minpoints) & (np.minimum(before, npts - before) >= minpoints / 4.)
+	keep = good[ids]
+	newid = np.cumsum(good) - 1
+	return ecl[good], newid[ids[keep]], npts[good], keep
+
+# The average eclipse: folded points binned in offset (days from the middle), with the
+# depth-weighted centroid of the eclipse put at offset 0
+# every bin is placed at the mean offset of its points, not at its middle, so the steep
+# sides of the eclipse don't get smeared by the binning
+def fold_template(offset, y, w, halfwidth, nbins=100):
+	bins = np.clip(((offset / halfwidth + 1) * 0.5 * nbins).astype(np.int64), 0, nbins - 1)
+	sumw = np.bincount(bins, w, minlength=nbins)
+	sumwx = np.bincount(bins, w*offset, minlength=nbins)
+	sumwy = np.bincount(bins, w*y, minlength=nbins)
+	full = sumw > 0
+	tx = sumwx[full] / sumw[full]
+	ty = sumwy[full] / sumw[full]
+	# (the centroid is taken on an even grid, since the bins aren't evenly spaced)
+	xs = np.linspace(-halfwidth, halfwidth, 4*nbins)
+	ys = np.interp(xs, tx, ty)
+	depth = np.maximum(np.median(ys) - ys, 0)
+	if depth.sum() > 0:
+		tx = tx - np.dot(depth, xs) / depth.sum()
+	return tx, ty
+
+# Half of the width of an eclipse template, where it is more than half as deep as at
+# the bottom (the part of the eclipse a parabola can fit)
+def half_depth_width(tx, ty):
+	depth = np.median(ty) - ty
+	return np.max(np.abs(tx[depth >= 0.5*depth.max()]))
+
+# The bottom of a parabola through three points at x = -1, 0, 1 (and its curvature)
+def parabola_min(cm, c0, cp):
+	curve = cm - 2*c0 + cp
+	with np.errstate(divide='ignore', invalid='ignore'):
+		xmin = np.where(curve > 0, 0.5*(cm - cp) / curve, 0.0)
+	return np.clip(xmin, -1, 1), curve
+
+# Best shift of every eclipse along the template, from a grid of trial shifts
+# ids: which eclipse (0 to neclipses-1) each point belongs to
+# shifts: one grid for every eclipse (nshift,) or one per eclipse (neclipses, nshift)
+# returns the shift, its error, and the rms (relative flux) of the fit to each eclipse
+def fit_shifts(ids, neclipses, offset, y, w, tx, ty, shifts):
+	sumw = np.bincount(ids, w, minlength=neclipses)
+	npts = np.bincount(ids, minlength=neclipses)
+	nshift = shifts.shape[-1]
+	chi2 = shift_chi2(ids, neclipses, offset, y, w, tx, ty, shifts)
+	rows = np.arange(neclipses)
+	k = np.clip(np.argmin(chi2, axis=1), 1, nshift - 2)
+	xmin, curve = parabola_min(chi2[rows, k-1], chi2[rows, k], chi2[rows, k+1])
+	grid = shifts if shifts.ndim == 2 else np.tile(shifts, (neclipses, 1))
+	step = grid[rows, k+1] - grid[rows, k]
+	shift = grid[rows, k] + xmin*step
+	with np.errstate(divide='ignore', invalid='ignore'):
+		# chi2 ~ chi2min + 0.5*curve*((shift - best)/step)^2, and 1 sigma away from the
+		# best shift it is bigger by chi2min/(npoints - 2)
+		redchi2 = chi2[rows, k] / np.maximum(npts - 2, 1)
+		err = np.where(curve > 0, step * np.sqrt(2*redchi2 / curve), np.nan)
+		rms = np.sqrt(redchi2 / sumw)
+	return shift, err, rms
+
+# chi-square of every eclipse against the template at every trial shift, shape
+# (neclipses, nshift); each eclipse gets its own flux offset
+def shift_chi2(ids, neclipses, offset, y, w, tx, ty, shifts):
+	sumw = np.bincount(ids, w, minlength=neclipses)
+	nshift = shifts.shape[-1]
+	chi2 = np.empty((neclipses, nshift))
+	for k in range(0, nshift):
+		s = shifts[ids, k] if shifts.ndim == 2 else shifts[k]
+		r = y - np.interp(offset - s, tx, ty)
+		sumwr = np.bincount(ids, w*r, minlength=neclipses)
+		sumwrr = np.bincount(ids, w*r*r, minlength=neclipses)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			chi2[:, k] = sumwrr - sumwr**2 / sumw
+	return chi2
+
+# Template timing: a coarse grid of shifts out to +/- maxshift days, then 'nrefine'
+# finer ones, each 5x finer than the last (a fit over too coarse a grid is pulled
+# around by the kinks in the chi-square where points cross the template's bins)
+def template_shifts(ids, neclipses, offset, y, w, tx, ty, maxshift, nshift=41, nrefine=3):
+	coarse = np.linspace(-maxshift, maxshift, nshift)
+	shift, err, rms = fit_shifts(ids, neclipses, offset, y, w, tx, ty, coarse)
+	step = coarse[1] - coarse[0]
+	for i in range(0, nrefine):
+		fine = shift[:, np.newaxis] + np.linspace(-2*step, 2*step, 21)
+		shift, err, rms = fit_shifts(ids, neclipses, offset, y, w, tx, ty, fine)
+		step /= 5.
+	return shift, err, rms
+
+# The out-of-eclipse flux level next to every eclipse (cycle numbers ecl): the mean
+# flux of the points between 1 and 2 'halfwidth's from its middle (NaN if none)
+def baseline_levels(t, y, w, period, T0, center, halfwidth, ecl):
+	cycles, offset, near = eclipse_points(t, period, T0, center, 2*halfwidth)
+	out = np.abs(offset) >= halfwidth
+	cycles, yo, wo = cycles[out], y[near][out], w[near][out]
+	ids = np.clip(np.searchsorted(ecl, cycles), 0, len(ecl) - 1)
+	match = ecl[ids] == cycles
+	sumw = np.bincount(ids[match], wo[match], minlength=len(ecl))
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.bincount(ids[match], (wo*yo)[match], minlength=len(ecl)) / sumw
+
+# The flux level of every eclipse compared to the template, at its best shift (quarters
+# that aren't normalized quite the same would otherwise blur the template)
+def eclipse_levels(ids, neclipses, offset, y, w, tx, ty, shift):
+	r = y - np.interp(offset - shift[ids], tx, ty)
+	return np.bincount(ids, w*r, minlength=neclipses) / np.bincount(ids, w, minlength=neclipses)
+
+# Polynomial timing: fit y = a + b*x + c*x^2 to the points within 'halfwidth' days of
+# each eclipse's middle, and move the middle to the bottom of the parabola (niter times)
+def poly_shifts(ids, neclipses, offset, y, w, halfwidth, niter=3):
+	shift = np.zeros(neclipses)
+	for i in range(0, niter):
+		x = offset - shift[ids]
+		use = np.abs(x) < halfwidth
+		xi, yi, wi, idi = x[use], y[use], w[use], ids[use]
+		moments = np.array([np.bincount(idi, wi * xi**p, minlength=neclipses) for p in range(0, 5)])
+		rhs = np.array([np.bincount(idi, wi * yi * xi**p, minlength=neclipses) for p in range(0, 3)])
+		A = np.stack([moments[p:p+3] for p in range(0, 3)]).transpose(2, 0, 1)
+		npts = np.bincount(idi, minlength=neclipses)
+		ok = (npts >= 4) & (np.abs(np.linalg.det(A)) > 0)
+		coef = np.full((neclipses, 3), np.nan)
+		coef[ok] = np.linalg.solve(A[ok], rhs.T[ok][..., np.newaxis])[..., 0]
+		a, b, c = coef.T
+		with np.errstate(divide='ignore', invalid='ignore'):
+			vertex = np.where(c > 0, -b / (2*c), np.nan)
+		shift += np.clip(vertex, -halfwidth, halfwidth)
+	# error of the vertex from the covariance of b and c, scaled by the scatter
+	model = a[idi] + b[idi]*xi + c[idi]*xi**2
+	sumw = np.bincount(idi, wi, minlength=neclipses)
+	chi2 = np.bincount(idi, wi * (yi - model)**2, minlength=neclipses)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		redchi2 = chi2 / np.maximum(npts - 3, 1)
+		cov = np.full((neclipses, 3, 3), np.nan)
+		cov[ok] = np.linalg.inv(A[ok]) * redchi2[ok, np.newaxis, np.newaxis]
+		grad = np.column_stack((np.zeros(neclipses), -1 / (2*c), b / (2*c**2)))
+		err = np.sqrt(np.einsum('ni,nij,nj->n', grad, cov, grad))
+		rms = np.sqrt(redchi2 / sumw)
+	return shift, err, rms
+
+def timing_worker(args):
+	method = args[0]
+	if method == 'template':
+		return template_shifts(*args[1:])
+	return poly_shifts(*args[1:])
+
+# Split the eclipses into 'processes' groups and time each group in its own process
+# extra: the arguments that come after the point data (e.g., the template)
+def run_shifts(method, ids, neclipses, offset, y, w, extra, processes=1):
+	if processes == 1 or neclipses < 2:
+		return timing_worker((method, ids, neclipses, offset, y, w) + extra)
+	groups = np.array_split(np.arange(neclipses), min(processes, neclipses))
+	jobs = []
+	for group in groups:
+		use = (ids >= group[0]) & (ids <= group[-1])
+		jobs.append((method, ids[use] - group[0], len(group), offset[use], y[use], w[use]) + extra)
+	pool = multiprocessing.Pool(processes)
+	try:
+		results = pool.map(timing_worker, jobs)
+	finally:
+		pool.close()
+		pool.join()
+	return tuple(np.concatenate(columns) for columns in zip(*results))
+
+# Time the eclipses of one window: fold them into a template, time every eclipse, and
+# (template method) line them up, level them, and do it again, niter times in all
+# ids: which eclipse (0 to neclipses-1) each point belongs to
+# nbins: bins in the template (None = about 3 folded points per bin)
+# level: the flux level of every eclipse to start with (e.g., from baseline_levels;
+# NaN or None = the typical level)
+# returns the shift (days from the predicted time), error, and rms of every eclipse
+def time_eclipses(ids, neclipses, offset, y, w, halfwidth, method='template', nbins=None,
+		niter=3, level=None, processes=1):
+	if nbins is None: # a sharp template
+		nbins = min(max(len(offset) // 3, 50), 2000)
+	shift = np.zeros(neclipses)
+	level = np.zeros(neclipses) if level is None else np.array(level, dtype=np.float64)
+	known = np.isfinite(level)
+	level[~known] = np.median(level[known]) if known.any() else 0.0
+	for i in range(0, niter if method == 'template' else 1):
+		# line the eclipses up (after the first pass) and remake the template
+		tx, ty = fold_template(offset - shift[ids], y - level[ids], w, halfwidth, nbins)
+		if method == 'template':
+			extra = (tx, ty, 0.5*halfwidth)
+		else:
+			extra = (half_depth_width(tx, ty),)
+		shift, err, rms = run_shifts(method, ids, neclipses, offset, y, w, extra, processes)
+		if method == 'template':
+			level = eclipse_levels(ids, neclipses, offset, y, w, tx, ty, shift)
+	# an eclipse whose points are most of their template bins fits the template far
+	# better than the noise allows (and gets an error of almost nothing), so no eclipse
+	# is allowed less than half the scatter that is typical for the window
+	typical = np.nanmedian(rms) if np.isfinite(rms).any() else np.nan
+	with np.errstate(divide='ignore', invalid='ignore'):
+		err = err * np.where(rms < 0.5*typical, 0.5*typical / rms, 1.0)
+	return shift, err, rms
+
+# Scale the errors of one window's eclipse times (in time order) to match how much the
+# O-C of each eclipse differs from the next one. The errors from the fits only know
+# about the noise in the points, not about how well the template matches each eclipse
+# (which depends on where the cadences happen to fall), so the fit errors alone can be
+# off by a few times in either direction. Differences between neighbors aren't bothered
+# by eclipse timing variations slower than a few orbits, so real ETVs are left alone.
+# returns the scaled errors, and the scale (1 if there are too few eclipses to tell)
+def calibrate_errors(oc, err, mineclipses=8):
+	good = np.isfinite(oc) & np.isfinite(err) & (err > 0)
+	if good.sum() < mineclipses:
+		return err, 1.0
+	diff = np.diff(oc[good]) / np.hypot(err[good][1:], err[good][:-1])
+	scale = 1.4826 * np.median(np.abs(diff - np.median(diff))) # robust rms
+	if not scale > 0:
+		return err, 1.0
+	return err * scale, scale
+
+# Time every eclipse of every window
+# t, flux, ferr: the light curve (Kepler time); flux can be magnitudes (mags=True)
+# period (days), BJD0 (full BJD of the middle of a primary eclipse)
+# windows: a list of (phasemin, phasemax), one per eclipse (e.g., primary and secondary)
+# method: 'template' or 'poly'; minpoints: skip eclipses with fewer points than this,
+# or without at least minpoints/4 points on each side of the middle
+# nbins: bins in the template (None = about 3 folded points per bin)
+# calibrate: scale the errors of each window to the eclipse-to-eclipse scatter of the
+# O-C (see calibrate_errors); False = the errors straight from the fits
+# processes: worker processes (None = one per core)
+# returns a dictionary of arrays, one entry per eclipse in time order:
+#   cycle (n), eclipse (which window), time (BJD), err (days), oc (days), npoints, and
+#   rms (the scatter of the points around the fit, in relative flux)
+def eclipse_times(t, flux, period, BJD0, windows, ferr=None, mags=False, method='template',
+		minpoints=10, nbins=None, niter=3, calibrate=True, processes=1):
+	if method not in ('template', 'poly'):
+		raise ValueError("method must be 'template' or 'poly', not " + repr(method))
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	t, y, w, tref = prepare(t, flux, ferr, mags)
+	T0 = BJD0 - KEPLER_BJD - tref
+	columns = dict((name, []) for name in ('cycle', 'eclipse', 'time', 'err', 'oc', 'npoints', 'rms'))
+	for j, (phasemin, phasemax) in enumerate(windows):
+		center, halfphase = window_center(phasemin, phasemax)
+		halfwidth = halfphase * period
+		cycles, offset, near = eclipse_points(t, period, T0, center, halfwidth)
+		ecl, ids, npts, keep = select_eclipses(cycles, offset, minpoints)
+		if not len(ecl):
+			continue
+		offset, yn, wn = offset[keep], y[near][keep], w[near][keep]
+		level = baseline_levels(t, y, w, period, T0, center, halfwidth, ecl)
+		shift, err, rms = time_eclipses(ids, len(ecl), offset, yn, wn, halfwidth, method, nbins,
+			niter, level, processes)
+		found = np.isfinite(shift) # (a parabola can miss)
+		if calibrate:
+			err[found] = calibrate_errors(shift[found], err[found])[0]
+		calc = T0 + (ecl + center) * period
+		columns['cycle'].append(ecl[found])
+		columns['eclipse'].append(np.full(found.sum(), j))
+		columns['time'].append((calc + shift + tref + KEPLER_BJD)[found])
+		columns['err'].append(err[found])
+		columns['oc'].append(shift[found])
+		columns['npoints'].append(npts[found])
+		columns['rms'].append(rms[found])
+	if not columns['time']:
+		return dict((name, np.zeros(0)) for name in columns)
+	order = np.argsort(np.concatenate(columns['time']))
+	return dict((name, np.concatenate(values)[order]) for name, values in columns.items())
+
+# Save an eclipse timing table (from eclipse_times) as text
+def write_times(filename, timing):
+	np.savetxt(filename, np.column_stack((timing['cycle'], timing['eclipse'], timing['time'],
+		timing['err'], timing['oc'], timing['npoints'])),
+		fmt=['%d', '%d', '%.6f', '%.6f', '%.6f', '%d'],
+		header='cycle eclipse BJD err O-C npoints  (eclipse 0 = primary; err, O-C in days)')
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Measure eclipse times and O-C for an EB.')
+	parser.add_argument('infile', help="light curve file (or store directory) from 'makelc.py'")
+	parser.add_argument('--kic', help='KIC number (needed for a light curve store)')
+	parser.add_argument('--columns', type=int, nargs=3, default=[0, 5, 2], metavar=('TIME', 'FLUX', 'ERR'),
+		help="columns to use (default: time, CBV flux, flux err from 'makelc.py')")
+	parser.add_argument('--mags', action='store_true', help='the flux column is in magnitudes')
+	parser.add_argument('--period', type=float, required=True, help='orbital period (days)')
+	parser.add_argument('--bjd0', type=float, required=True, help='BJD of a primary eclipse')
+	parser.add_argument('--primary', type=float, nargs=2, required=True, metavar=('PHASEMIN', 'PHASEMAX'),
+		help='phase range of the primary eclipse, e.g. 0.97 1.03')
+	parser.add_argument('--secondary', type=float, nargs=2, metavar=('PHASEMIN', 'PHASEMAX'),
+		help='phase range of the secondary eclipse, e.g. 0.685 0.745')
+	parser.add_argument('--method', choices=('template', 'poly'), default='template',
+		help='how to time each eclipse')
+	parser.add_argument('--processes', type=int, default=1,
+		help='number of worker processes (0 = one per core)')
+	parser.add_argument('-o', '--outfile', default='eclipse_times.txt', help='table to write')
+	args = parser.parse_args(argv)
+
+	t, flux, ferr = read_lc(args.infile, usecols=tuple(args.columns), kic=args.kic)
+	windows = [args.primary] + ([args.secondary] if args.secondary else [])
+	timing = eclipse_times(t, flux, args.period, args.bjd0, windows, ferr, mags=args.mags,
+		method=args.method, processes=args.processes or None)
+	write_times(args.outfile, timing)
+	for j in range(0, len(windows)):
+		oc = timing['oc'][timing['eclipse'] == j]
+		if len(oc):
+			print('{0}: {1} eclipses, O-C rms {2:.2f} min'.format(('primary', 'secondary')[j],
+				len(oc), 1440*np.sqrt(np.mean(oc**2))))
+	print('Wrote ' + args.outfile)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
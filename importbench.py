@@ -0,0 +1,102 @@
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import subprocess
+'''
+How long does it take to import each of our modules? Every batch worker and every
+'python ELClcprep.py' pays this before doing any work, so it should stay small.
+
+Each module is imported in a fresh Python process (a few times, keeping the fastest),
+and the time of 'import numpy' by itself is subtracted, so what's left is the cost of
+the module. It also checks that importing a module does NOT import any of the slow
+backends (PyRAF, kplr, astropy, matplotlib, scipy, h5py); those should only be
+imported inside the functions that need them.
+    python importbench.py             # compare against importbench_baseline.json
+    python importbench.py --save      # (re)write the baseline
+It exits with 1 if a module pulls in a slow backend, or got more than 'tolerance'
+slower than the baseline (plus 'slack' milliseconds, because timing is noisy).
+'''
+
+MODULES = ['lc_functions', 'cbv', 'lcstore', 'lcsource', 'stagecache', 'decimate', 'detrend',
+	'outliers', 'quality', 'eclipsemask', 'targets', 'periodsearch', 'eclipsetiming',
+	'powerspec', 'stageprofile', 'makelc', 'ELClcprep', 'lcplotter']
+HEAVY = ['pyraf', 'kplr', 'astropy', 'matplotlib', 'scipy', 'h5py']
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'importbench_baseline.json')
+
+# what runs in the fresh process: time the import, and list the slow backends it loaded
+PROBE = '''
+import sys, time, json
+sys.path.insert(0, {path!r})
+import numpy
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print(json.dumps([elapsed, sorted(set(m.split('.')[0] for m in sys.modules) & set({heavy!r}))]))
+'''
+
+# Import time (seconds, numpy already loaded) and slow backends loaded, for one module
+# the fastest of 'repeat' fresh processes
+def time_import(module, repeat=5):
+	path = os.path.dirname(os.path.abspath(__file__))
+	code = PROBE.format(path=path, module=module, heavy=HEAVY)
+	best, heavy = None, []
+	for i in range(0, repeat):
+		out = subprocess.check_output([sys.executable, '-c', code])
+		elapsed, heavy = json.loads(out.decode().strip().splitlines()[-1])
+		best = elapsed if best is None else min(best, elapsed)
+	return best, heavy
+
+# Time every module; returns a dictionary: module -> (seconds, slow backends loaded)
+def run_bench(modules=MODULES, repeat=5):
+	results = {}
+	for module in modules:
+		results[module] = time_import(module, repeat)
+	return results
+
+# Compare with a baseline (module -> seconds); returns a list of problems (empty = fine)
+def check(results, baseline, tolerance=0.5, slack=0.02):
+	problems = []
+	for module in sorted(results):
+		elapsed, heavy = results[module]
+		if heavy:
+			problems.append('{0} imports {1} at import time'.format(module, ', '.join(heavy)))
+		if module in baseline and elapsed > baseline[module] * (1 + tolerance) + slack:
+			problems.append('{0} takes {1:.1f} ms to import (baseline {2:.1f} ms)'.format(module,
+				1e3*elapsed, 1e3*baseline[module]))
+	return problems
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Import-time benchmark for the kepler-makelc modules.')
+	parser.add_argument('modules', nargs='*', default=MODULES, help='modules to time (default: all)')
+	parser.add_argument('--repeat', type=int, default=5, help='fresh processes per module')
+	parser.add_argument('--baseline', default=BASELINE, help='baseline file')
+	parser.add_argument('--save', action='store_true', help='save these times as the baseline')
+	parser.add_argument('--tolerance', type=float, default=0.5, help='allowed fractional slowdown')
+	parser.add_argument('--slack', type=float, default=20.0, help='allowed extra milliseconds')
+	args = parser.parse_args(argv)
+
+	results = run_bench(args.modules, args.repeat)
+	baseline = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+	for module in args.modules:
+		elapsed, heavy = results[module]
+		print('{0:14s} {1:7.1f} ms  (baseline {2})  {3}'.format(module, 1e3*elapsed,
+			'{0:.1f} ms'.format(1e3*baseline[module]) if module in baseline else '-',
+			'loads ' + ', '.join(heavy) if heavy else ''))
+	if args.save:
+		baseline.update((module, round(results[module][0], 5)) for module in args.modules)
+		with open(args.baseline, 'w') as f:
+			json.dump(baseline, f, indent=1, sort_keys=True)
+		print('Saved the baseline to ' + args.baseline)
+		return 0
+	problems = check(results, baseline, args.tolerance, 1e-3*args.slack)
+	for problem in problems:
+		print('PROBLEM:', problem)
+	return 1 if problems else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
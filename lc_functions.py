@@ -1,66 +1,172 @@
+import os
 import numpy as np
-from pyraf import iraf
-from pyraf.iraf import kepler
 '''
 Useful functions for Kepler light curve processing
 Use this with the program 'makelc.py'
 Originally by Jean McKeever
 Edited and improved by Meredith Rawls
+
+Importing this only imports NumPy. The slow packages (PyRAF, astropy, h5py, ...) are
+imported inside the few functions that need them, the first time they are called, so
+'ELClcprep.py', 'lcplotter.py', and short-lived batch workers start up fast
+(check with 'python importbench.py').
 '''
 
 # calculate orbital phase
 # times must be a list of observation times in the same units as BJD0
 # it returns 'phases': orbital phases from 0 to 1
-# it also returns 'phasedoubles': twice as long as 'phases' and now from 0 to 2
+# (use phasefold if you also want 'phase2s' from 1 to 2 and cycle numbers)
 def phasecalc(times, period=100, BJD0=2454833):
-	phases = []
-	cycles = []
-	for i in range(0, len(times)):
-		fracP = (times[i] - BJD0) / period
-		if fracP < 0:
-			phases.append(fracP % 1)
-			cycles.append(int(fracP))
-		else:
-			phases.append(fracP % 1)
-			cycles.append(int(fracP) + 1)
-		#print(fracP, phases[i])
+	phases, phase2s, cycles = phasefold(times, period, BJD0)
 	return phases
 
+# fold observation times on one OR many trial periods, all at once
+# times must be in the same units as BJD0
+# it returns three arrays:
+#   'phases': orbital phases from 0 to 1
+#   'phase2s': the same phases shifted to run from 1 to 2 (phases + 1)
+#   'cycles': integer cycle number, floor((time - BJD0)/period) + 1
+# if period (and/or BJD0) is an array of length nP, every output has shape
+# (nP, len(times)), so a whole period grid can be folded in one call
+# the epoch is subtracted in float64 BEFORE dividing by the period, so BJDs
+# (~2.45e6 days) don't eat up the precision of the phases
+def phasefold(times, period=100, BJD0=2454833):
+	times = np.asarray(times, dtype=np.float64)
+	period = np.asarray(period, dtype=np.float64)
+	BJD0 = np.asarray(BJD0, dtype=np.float64)
+	if period.ndim > 0 or BJD0.ndim > 0: # many trial periods -> 2-D output
+		period = np.atleast_1d(period)[:, np.newaxis]
+		BJD0 = np.atleast_1d(BJD0)[:, np.newaxis]
+	fracP = (times - BJD0) / period
+	cycfloor = np.floor(fracP)
+	phases = fracP - cycfloor
+	# guard against round-off giving a phase of exactly 1
+	wrap = phases >= 1.0
+	phases = np.where(wrap, 0.0, phases)
+	cycles = (cycfloor + wrap).astype(np.int64) + 1
+	return phases, phases + 1, cycles
+
+# Split a light curve into ELC 'chunks', each covering one window in orbital phase
+# from phasemin to phasemax (e.g., 0.6 to 1.6, so one primary AND one secondary
+# eclipse land in every chunk). Window n runs from BJD0 + (n + phasemin)*period
+# to BJD0 + (n + phasemax)*period. times must be sorted.
+# Returns a list of (window number n, index array) for every window that has data,
+# in time order. Nothing is empty. If phasemax - phasemin > 1 the windows overlap
+# and some points land in two chunks.
+def elc_chunks(times, period, BJD0, phasemin=0.6, phasemax=1.6):
+	if not phasemax > phasemin:
+		raise ValueError('phasemax ({0}) must be larger than phasemin ({1})'.format(phasemax, phasemin))
+	fracP = (np.asarray(times, dtype=np.float64) - BJD0) / period
+	width = phasemax - phasemin
+	windows, rows = [], []
+	for j in range(0, int(np.ceil(width))): # more than one pass only for overlapping windows
+		window = np.floor(fracP - phasemin).astype(np.int64) - j
+		inside = np.nonzero(fracP - phasemin - window < width)[0]
+		windows.append(window[inside])
+		rows.append(inside)
+	windows = np.concatenate(windows)
+	rows = np.concatenate(rows)
+	order = np.lexsort((rows, windows))
+	windows, rows = windows[order], rows[order]
+	edges = np.nonzero(np.diff(windows))[0] + 1
+	return [(int(w[0]), r) for w, r in zip(np.split(windows, edges), np.split(rows, edges)) if len(r)]
+
+# Write ELC chunk files outstub0.txt, outstub1.txt, ... (columns time, mag, err) in one
+# pass, one bulk write per chunk, plus outstub + 'manifest.txt' listing them all.
+# Returns the manifest: a list with one dictionary per chunk (chunk number, window
+# number 'cycle', filename, number of rows, and first/last time), and the chunk data
+# itself as a list of (times, mags, merrs), so you don't have to read it back in.
+# Chunk files from an older manifest with the same outstub are deleted first, so a
+# run with fewer chunks doesn't leave stale ones behind.
+def write_elc_chunks(outstub, times, mags, merrs, period, BJD0, phasemin=0.6, phasemax=1.6):
+	times, mags, merrs = np.asarray(times), np.asarray(mags), np.asarray(merrs)
+	chunks = elc_chunks(times, period, BJD0, phasemin, phasemax)
+	if os.path.exists(outstub + 'manifest.txt'):
+		for entry in read_elc_manifest(outstub):
+			if os.path.exists(entry['file']):
+				os.remove(entry['file'])
+	manifest, chunkdata = [], []
+	for chunk, (cycle, rows) in enumerate(chunks):
+		filename = outstub + str(chunk) + '.txt'
+		np.savetxt(filename, np.column_stack((times[rows], mags[rows], merrs[rows])), fmt='%.17g')
+		manifest.append(dict(chunk=chunk, cycle=cycle, file=filename, nrows=len(rows),
+			tstart=float(times[rows[0]]), tend=float(times[rows[-1]])))
+		chunkdata.append((times[rows], mags[rows], merrs[rows]))
+	with open(outstub + 'manifest.txt', 'w') as f:
+		f.write('# chunk cycle nrows tstart tend\n')
+		for entry in manifest:
+			f.write('{chunk} {cycle} {nrows} {tstart!r} {tend!r}\n'.format(**entry))
+	return manifest, chunkdata
+
+# Read the list of chunks written by write_elc_chunks (without opening every chunk)
+def read_elc_manifest(outstub):
+	manifest = []
+	with open(outstub + 'manifest.txt') as f:
+		for line in f:
+			if line.startswith('#') or not line.strip():
+				continue
+			chunk, cycle, nrows, tstart, tend = line.split()
+			manifest.append(dict(chunk=int(chunk), cycle=int(cycle), file=outstub + chunk + '.txt',
+				nrows=int(nrows), tstart=float(tstart), tend=float(tend)))
+	return manifest
+
 # remove long-term trends
-# uses a simple 3rd-order polynomial by default
+# uses a simple 3rd-order polynomial by default, leaving masked times (e.g., eclipses)
+# out of the fit; see detrend.py for splines, sliding medians, and several arrays at once
 # operates on one array at a time (e.g., after all quarters have been combined)
-def long_detrend(t, flux, order=3):
-    model = np.polyfit(t, flux, order)
-    fit = np.zeros(len(t))
-    # apply the model coefficients to create the fit
-    for i in range(0, order+1):
-        fit += model[i]*np.power(t, (order-i))
-    #flux = flux/fit*1e6 - 1e6 # put it in ppm >:(
-    flux = flux/fit*np.median(flux) # don't put it in ppm, because ppm is annoying
-    return t, flux
+def long_detrend(t, flux, order=3, maskstart=[], maskend=[]):
+	from detrend import poly_detrend
+	#flux = flux/fit*1e6 - 1e6 # put it in ppm >:(
+	flux = poly_detrend(t, flux, order, maskstart, maskend) # don't put it in ppm, because ppm is annoying
+	return t, flux
 
 # Delete any observation that has one or more NaN values.
-# Assumes there are six parallel arrays... use dummy arrays if you don't have 6
-# columns of interest to operate on (sorry).
+# Takes any number of parallel columns (all the same length), e.g.
+#   time, flux, ferr = nan_delete(time, flux, ferr)
+# OR a single structured / FITS record array, in which case the filtered
+# record array is returned. Integer columns (like sap_quality) can't hold NaNs
+# and are only filtered along with everything else. Dtypes are preserved.
+# Set return_mask=True to also get the boolean 'keep' mask, so you can apply
+# the same cut to other arrays later without recomputing it.
 # Operates on one quarter at a time
-def nan_delete(time, flux, ferr, other1, other2, other3):
-	a = []
-	a = [time, flux, ferr, other1, other2, other3]
-	atrans = np.transpose(a)
-	newatrans = []
-	newa = []
-	for row in atrans:
-		# only save rows that DON'T contain a NaN value
-		if np.isnan(row).any() != True:
-			newatrans.append(row)
-	newa = np.transpose(newatrans)
-	newtime = newa[0]
-	newflux = newa[1]
-	newferr = newa[2]
-	newother1 = newa[3]
-	newother2 = newa[4]
-	newother3 = newa[5]
-	return newtime, newflux, newferr, newother1, newother2, newother3
+def nan_delete(*columns, **kwargs):
+	return_mask = kwargs.pop('return_mask', False)
+	if kwargs:
+		raise TypeError('unexpected keyword argument(s): ' + ', '.join(kwargs))
+	if len(columns) == 0:
+		raise TypeError('nan_delete needs at least one column')
+	# a single structured array (e.g., hdu.data from astropy) is filtered by row
+	if len(columns) == 1 and getattr(columns[0], 'dtype', None) is not None \
+			and columns[0].dtype.names is not None:
+		table = columns[0]
+		keep = np.ones(len(table), dtype=bool)
+		for name in table.dtype.names:
+			col = np.asarray(table[name])
+			if np.issubdtype(col.dtype, np.inexact):
+				bad = np.isnan(col)
+				if bad.ndim > 1: # vector-valued column
+					bad = bad.reshape(len(table), -1).any(axis=1)
+				keep &= ~bad
+		if return_mask:
+			return table[keep], keep
+		return table[keep]
+	columns = [np.asarray(col) for col in columns]
+	npts = len(columns[0])
+	for col in columns:
+		if len(col) != npts:
+			raise ValueError('nan_delete columns must all be the same length')
+	keep = np.ones(npts, dtype=bool)
+	for col in columns:
+		# only floats (and complex) can actually be NaN
+		if np.issubdtype(col.dtype, np.inexact):
+			bad = np.isnan(col)
+			if bad.ndim > 1: # 2-D columns: drop the row if any entry is NaN
+				bad = bad.reshape(npts, -1).any(axis=1)
+			keep &= ~bad
+	newcolumns = tuple(col[keep] for col in columns)
+	if return_mask:
+		return newcolumns + (keep,)
+	return newcolumns
 		
 # Put data from different quarters on the same AVERAGE level
 # operates on a list of arrays (multiple quarters) all at once
@@ -91,55 +197,212 @@ def normalize_qtr_med(flux):
 		arr += avgflux - med_arr
 	return flux
 
+# Sort and merge mask intervals so they can be searched with searchsorted
+# maskstart and maskend are parallel lists of interval edges (any order)
+# returns two sorted arrays of non-overlapping (open) intervals
+def merge_mask(maskstart, maskend):
+	maskstart = np.asarray(maskstart, dtype=np.float64).ravel()
+	maskend = np.asarray(maskend, dtype=np.float64).ravel()
+	if len(maskstart) == 0:
+		return maskstart, maskend
+	order = np.argsort(maskstart, kind='mergesort')
+	maskstart = maskstart[order]
+	maskend = maskend[order]
+	# running max of the ends tells us which intervals overlap the ones before them
+	runend = np.maximum.accumulate(maskend)
+	newgroup = np.ones(len(maskstart), dtype=bool)
+	newgroup[1:] = maskstart[1:] >= runend[:-1]
+	groupstart = np.nonzero(newgroup)[0]
+	groupend = np.append(groupstart[1:], len(maskstart)) - 1
+	return maskstart[groupstart], runend[groupend]
+
+# Check which timestamps fall inside a mask (strictly between start and end)
+# works on a whole array of times at once, O(n log m) for n times and m masks
+# returns a boolean array, True = masked
+def in_mask(times, maskstart, maskend):
+	times = np.asarray(times, dtype=np.float64)
+	mstart, mend = merge_mask(maskstart, maskend)
+	if len(mstart) == 0:
+		return np.zeros(times.shape, dtype=bool)
+	# index of the last mask that starts before each time
+	k = np.searchsorted(mstart, times, side='left') - 1
+	return (k >= 0) & (times < mend[np.maximum(k, 0)])
+
 # Line up the gaps within each quarter
 # operates on a list of arrays (multiple quarters) all at once
-def lineup_qtr_gaps(time, flux, maskstart, maskend):
-	diffs = np.zeros(len(time) - 1)
-	for i in range(0,len(time) - 1): # loop through quarters
-	# calculate differences between flux points at quarter start/end
-		start = 0
-		end = -1
-		for idx, mask in enumerate(maskstart):
-			while (time[i][end] > maskstart[idx] and time[i][end] < maskend[idx]):
-				#print('end', end, time[i][end], maskstart[idx], maskend[idx])
-				end -= 1
-			while (time[i+1][start] > maskstart[idx] and time[i+1][start] < maskend[idx]):
-				#print('start', start, time[i+1][start], maskstart[idx], maskend[idx])
-				start += 1
-		diffs[i] = (flux[i][end] - flux[i+1][start])
-	# maxi will find the point with the largest change in flux
-	maxi = lambda z: np.where(max(abs(z)) == abs(z))[0][0]
+# quarters are shifted up/down as a whole until no quarter boundary has a
+# flux jump bigger than 'threshold', or until 'maxiter' shifts have been made
+# masked points (e.g., eclipses) are skipped when measuring the jumps
+# set return_iterations=True to also get how many shifts were made
+def lineup_qtr_gaps(time, flux, maskstart, maskend, threshold=100, maxiter=10000,
+	return_iterations=False):
+	nqtr = len(time)
+	if nqtr < 2:
+		return (time, flux, 0) if return_iterations else (time, flux)
+	mstart, mend = merge_mask(maskstart, maskend)
+	# first and last unmasked flux value in each quarter, found just once
+	firstflux = np.zeros(nqtr)
+	lastflux = np.zeros(nqtr)
+	for i in range(0, nqtr):
+		good = np.nonzero(~in_mask(time[i], mstart, mend))[0]
+		if len(good) == 0: # the whole quarter is masked, use its edges
+			start, end = 0, -1
+		else:
+			start, end = good[0], good[-1]
+		firstflux[i] = flux[i][start]
+		lastflux[i] = flux[i][end]
+	# differences between flux points at quarter end/start
+	diffs = lastflux[:-1] - firstflux[1:]
+	offsets = np.zeros(nqtr)
 	cntr = 0 # counter
-	max_val = max(abs(diffs))
-	while max_val > 100: #original value here was 100
+	absdiffs = np.abs(diffs)
+	while absdiffs.max() > threshold and cntr < maxiter:
 		# this is the index of the largest change in flux, so it needs adjusting
-		ind = maxi(diffs)
+		ind = np.argmax(absdiffs)
 		# this is the actual change in flux associated with that index
 		diff = diffs[ind]
 		# adjust the flux at this spot and its neighbor so they meet
-		flux[ind] = flux[ind] - diff/2.0
-		flux[ind+1] = flux[ind+1] + diff/2.0
-		diffs = np.zeros(len(time) - 1)
-		for i in range(0, len(time) - 1):
-		# calculate differences between flux points at quarter start/end, again
-			start = 0
-			end = -1
-			for idx, mask in enumerate(maskstart):
-				while time[i][end] > maskstart[idx] and time[i][end] < maskend[idx]:
-					#print('end', end, time[i][end], maskstart[idx], maskend[idx])
-					end -= 1
-				while time[i+1][start] > maskstart[idx] and time[i+1][start] < maskend[idx]:
-					#print('start', start, time[i+1][start], maskstart[idx], maskend[idx])
-					start += 1
-			diffs[i] = (flux[i][end] - flux[i+1][start])
+		offsets[ind] -= diff/2.0
+		offsets[ind+1] += diff/2.0
+		# only the boundaries touching quarters ind and ind+1 change
+		diffs[ind] = 0.0
+		if ind > 0: diffs[ind-1] += diff/2.0
+		if ind < nqtr - 2: diffs[ind+1] += diff/2.0
+		lo = max(ind - 1, 0)
+		absdiffs[lo:ind+2] = np.abs(diffs[lo:ind+2])
 		cntr += 1 # count how many times this while-loop happens
-		max_val = max(abs(diffs))
-#		print(max_val, cntr)
+	for i in range(0, nqtr):
+		if offsets[i] != 0:
+			flux[i] = flux[i] + offsets[i]
+	if return_iterations:
+		return time, flux, cntr
 	return time, flux
 
+# Bin short cadence data (1 minute) down to long cadence (30 minutes), or any other
+# number of cadences per bin. The bins come from the cadence numbers themselves
+# (bin = cadenceno // binsize), so every month is binned on the same grid and a gap
+# in the data never shifts the bins that come after it.
+# cadenceno: sorted cadence numbers; columns: dictionary of parallel arrays
+# columns named in 'errors' are combined as sqrt(sum(err**2))/n, the ones named in
+# 'flags' (integer quality flags) are OR'd together, and everything else is averaged.
+# Anything in columns that isn't an array (e.g., kepmag) is passed along as is.
+# Rows with a NaN in any column are left out first, and bins with fewer than
+# minpoints good rows are dropped.
+# returns the first cadence number in each bin, the binned columns (a new dictionary),
+# and the number of rows that went into each bin
+def bin_cadences(cadenceno, columns, binsize=30, errors=('ferr',), flags=('quality',), minpoints=1):
+	cadenceno = np.asarray(cadenceno)
+	arrays = dict((name, np.asarray(col)) for name, col in columns.items() if np.ndim(col) > 0)
+	good = np.ones(len(cadenceno), dtype=bool)
+	for col in arrays.values():
+		if np.issubdtype(col.dtype, np.inexact):
+			good &= ~np.isnan(col)
+	cad = cadenceno[good]
+	if len(cad) == 0:
+		starts = np.zeros(0, dtype=np.intp)
+	else:
+		starts = np.concatenate(([0], np.nonzero(np.diff(cad // binsize))[0] + 1))
+	npoints = np.diff(np.append(starts, len(cad)))
+	full = npoints >= minpoints
+	binned = dict((name, col) for name, col in columns.items() if name not in arrays)
+	for name, col in arrays.items():
+		col = col[good]
+		if len(starts) == 0:
+			binned[name] = col
+		elif name in flags:
+			binned[name] = np.bitwise_or.reduceat(col, starts)[full]
+		elif name in errors:
+			binned[name] = (np.sqrt(np.add.reduceat(col.astype(np.float64)**2, starts)) / npoints)[full]
+		else:
+			binned[name] = (np.add.reduceat(col.astype(np.float64), starts) / npoints)[full]
+	return cad[starts][full], binned, npoints[full]
+
+# Column names for the light curve file written by 'makelc.py'
+LC_COLUMNS = ['time', 'sap_flux', 'ferr', 'sap_mag', 'merr', 'cbv_flux', 'cbv_mag', 'cbv_model']
+LC_HEADER = 'Kepler time, SAP flux, flux err, SAP mag, mag err, CBV flux, CBV mag, CBV model'
+
+# figure out the light curve file format from the filename extension
+# '.npz' = compressed numpy, '.h5'/'.hdf5' = HDF5, '.fits'/'.fit' = FITS binary table
+# anything else is treated as a plain text file
+def lc_format(filename):
+	lower = str(filename).lower()
+	if lower.endswith('.npz'): return 'npz'
+	if lower.endswith('.h5') or lower.endswith('.hdf5'): return 'hdf5'
+	if lower.endswith('.fits') or lower.endswith('.fit'): return 'fits'
+	return 'text'
+
+# Write parallel light curve columns to a file in one go (no per-row loop)
+# columns is a list of equal-length arrays, names is a matching list of labels
+# binary formats keep full float64 precision; text is written with np.savetxt
+def write_lc(outfile, columns, names=LC_COLUMNS, header=LC_HEADER):
+	columns = [np.asarray(col) for col in columns]
+	names = list(names)[:len(columns)]
+	fmt = lc_format(outfile)
+	if fmt == 'npz':
+		np.savez_compressed(outfile, _columns=np.array(names), **dict(zip(names, columns)))
+	elif fmt == 'hdf5':
+		import h5py
+		with h5py.File(outfile, 'w') as f:
+			grp = f.create_group('lightcurve')
+			for name, col in zip(names, columns):
+				grp.create_dataset(name, data=col, compression='gzip')
+			grp.attrs['columns'] = ','.join(names)
+	elif fmt == 'fits':
+		from astropy.io import fits
+		cols = [fits.Column(name=name, format=fits_format(col), array=col)
+			for name, col in zip(names, columns)]
+		fits.BinTableHDU.from_columns(cols).writeto(outfile, overwrite=True)
+	else:
+		np.savetxt(outfile, np.column_stack(columns), fmt='%.17g', header=header)
+	return outfile
+
+# FITS table format code for a 1-D numpy column
+def fits_format(col):
+	if np.issubdtype(col.dtype, np.integer): return 'K'
+	if col.dtype == np.float32: return 'E'
+	return 'D'
+
+# Read a light curve file written by write_lc (or any whitespace-delimited text file)
+# usecols works like np.loadtxt: a list of column indices (or names, for binary
+# formats). Returns a tuple of arrays, one per column, like loadtxt(unpack=True)
+# If infile is a light curve store directory (see lcstore.py), also give the kic;
+# the columns then come back as memory-mapped (zero-copy) slices of the store
+def read_lc(infile, usecols=None, kic=None):
+	if os.path.isdir(infile):
+		from lcstore import LCStore
+		if kic is None:
+			raise ValueError('Reading from a light curve store needs a kic')
+		return LCStore(infile).get(kic, usecols)
+	fmt = lc_format(infile)
+	if fmt == 'text':
+		# ndmin=2 keeps one column (or one row) from coming back as a single 1-D array
+		return tuple(np.loadtxt(infile, comments='#', dtype=np.float64, usecols=usecols, unpack=True,
+			ndmin=2))
+	if fmt == 'npz':
+		with np.load(infile) as f:
+			names = [str(name) for name in f['_columns']]
+			data = dict((name, f[name]) for name in names)
+	elif fmt == 'hdf5':
+		import h5py
+		with h5py.File(infile, 'r') as f:
+			grp = f['lightcurve']
+			names = grp.attrs['columns'].split(',')
+			data = dict((name, grp[name][()]) for name in names)
+	else:
+		from astropy.io import fits
+		with fits.open(infile) as f:
+			names = list(f[1].columns.names)
+			data = dict((name, np.array(f[1].data[name])) for name in names)
+	if usecols is None:
+		usecols = range(0, len(names))
+	return tuple(data[col] if isinstance(col, str) else data[names[col]] for col in usecols)
+
 # performs detrending with cotrending basis vectors (cbvs)
 # lcin and lcout must both be FITS filenames
+# (this is the old PyRAF/PyKE way; see cbv.py for a faster in-memory version)
 def kepcotrend(lcin, lcout, cbvfile, maskfile=''):
+	from pyraf import iraf # slow to start up, so only import it if we need it
+	from pyraf.iraf import kepler
 	iraf.kepcotrend(infile=lcin, outfile=lcout, cbvfile=cbvfile, 
 		vectors='1 2', method='simplex', fitpower=1, iterate='yes', sigmaclip=2.0, 
 		maskfile=maskfile, scinterp='None', plot='no', clobber='yes', verbose='no')	
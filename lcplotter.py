@@ -1,11 +1,23 @@
 from __future__ import print_function
+import os
+import sys
+import argparse
+import multiprocessing
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import IndexLocator, FormatStrFormatter, ScalarFormatter
-from lc_functions import phasecalc
+from lc_functions import phasefold, read_lc, read_elc_manifest
+from decimate import plot_decimated
+from targets import catalog_kics, get_target
 '''
 Makes a nice plot of an RGEB Kepler light curve for a paper.
 You will want to run 'ELClcprep.py' first.
+
+Type 'python lcplotter.py' to plot the KIC chosen below, or, to make the figures for
+lots of targets at once without any windows popping up:
+    python lcplotter.py 9246715 8702921 --outdir figures --format pdf --processes 4
+    python lcplotter.py --all --outdir figures
+Each figure is saved as outdir/KIC_<KIC>_lc.<format>. The period, eclipse windows, plot
+limits, and file names of every target are in the target catalog (targets.csv, or use
+--catalog), so adding a star means adding a row there.
 '''
 
 # Important starting info
@@ -14,230 +26,218 @@ You will want to run 'ELClcprep.py' first.
 pristarcirclesize = 4000; secstarcirclesize = 500
 red = '#e34a33' # red, star 1
 yel = '#fdbb84' # yellow, star 2
-
-# 946715
-#KIC = '9246715'; period = 171.277967; BJD0 = 2455170.514777
-#infile = '../../RG_light_curves/9246715/KIC_9246715_201408_Patrick.txt'
-#instub = '../../RG_light_curves/9246715/ELC_Patrick_lc'
-#primary_phasemin = 0.97; primary_phasemax = 1.03
-#secondary_phasemin = 0.685; secondary_phasemax = 0.745
-#phasemin = 0.5; phasemax = 1.5
-#magdim = 9.54; magbright = 9.21
-#magdimzoom = 9.79; magbrightzoom = 9.21
-#timemin = 100; timemax = 1600
-#pristarcirclesize = 4000; secstarcirclesize = 4000
-#zoommagspace = 0.03
-
-# 8702921
-KIC = '8702921'; period = 19.38446; BJD0 = 2454970.2139
-infile = '../../RG_light_curves/8702921/KIC_8702921_LC_mag_Q017.txt'
-instub = '../../RG_light_curves/8702921/lcchunk'
-primary_phasemin = 0.935; primary_phasemax = 1.075
-secondary_phasemin = 0.37; secondary_phasemax = 0.51
-phasemin = 0.2; phasemax = 1.2
-magdim = 11.986; magbright = 11.979
-magdimzoom = 12.06; magbrightzoom = 11.979
-timemin = 100; timemax = 1600
-zoommagspace = 0.001
-
-# 9291629
-#KIC = '9291629'; period = 20.68639; BJD0 = 2454966.882
-#infile = '../../RG_light_curves/9291629/KIC_9291629_LC_mag_Q017.txt'
-#instub = '../../RG_light_curves/9291629/lcchunk'
-#primary_phasemin = 0.91; primary_phasemax = 1.09
-#secondary_phasemin = 0.41; secondary_phasemax = 0.59
-#phasemin = 0.2; phasemax = 1.2
-#magdim = 14.17; magbright = 13.93
-#magdimzoom = 14.85; magbrightzoom = 13.93
-#timemin = 100; timemax = 1600
-#zoommagspace = 0.01
-
-# 3955867
-#KIC = '3955867'; period = 33.65685; BJD0 = 2454960.8989
-#infile = '../../RG_light_curves/3955867/KIC_3955867-phot_transit_only.txt'
-#instub = '../../RG_light_curves/3955867/lcchunk'
-#primary_phasemin = 0.94; primary_phasemax = 1.06
-#secondary_phasemin = 0.435; secondary_phasemax = 0.575
-#phasemin = 0.2; phasemax = 1.2
-#magdim = 13.605; magbright = 13.541
-#magdimzoom = 14.05; magbrightzoom = 13.541
-#timemin = 100; timemax = 1600
-#zoommagspace = 0.01
-
-# 10001167
-#KIC = '10001167'; period = 120.3903; BJD0 = 2454957.682
-#infile = '../../RG_light_curves/10001167/KIC_10001167-phot_transit_only.txt'
-#instub = '../../RG_light_curves/10001167/lcchunk'
-#primary_phasemin = 0.95; primary_phasemax = 1.05
-#secondary_phasemin = 0.535; secondary_phasemax = 0.635
-#phasemin = 0.2; phasemax = 1.2
-#magdim = 10.080; magbright = 10.045
-#magdimzoom = 10.5; magbrightzoom = 10.045
-#timemin = 100; timemax = 1600
-#zoommagspace = 0.03
-
-# 5786154
-#KIC = '5786154'; period = 197.9182; BJD0 = 2455162.6140
-#infile = '../../RG_light_curves/5786154/KIC_5786154_LC_mag_Q017.txt'
-#instub = '../../RG_light_curves/5786154/lcchunk'
-#primary_phasemin = 0.97; primary_phasemax = 1.03
-#secondary_phasemin = 0.255; secondary_phasemax = 0.315
-#phasemin = 0.2; phasemax = 1.2
-#magdim = 13.635; magbright = 13.52
-#magdimzoom = 13.9; magbrightzoom = 13.52
-#timemin = 100; timemax = 1600
-#zoommagspace = 0.03
-
-# 7037405
-#KIC = '7037405'; period = 207.1082; BJD0 = 2455112.7655
-#infile = '../../RG_light_curves/7037405/KIC_7037405-phot_transit_only.txt'
-#instub = '../../RG_light_curves/7037405/ELC_Patrick_lc'
-#primary_phasemin = 0.97; primary_phasemax = 1.03
-#secondary_phasemin = 0.368; secondary_phasemax = 0.428
-#phasemin = 0.2; phasemax = 1.2
-#magdim = 11.967; magbright = 11.862
-#magdimzoom = 12.19; magbrightzoom = 11.85
-#timemin = 100; timemax = 1600
-#zoommagspace = 0.03
-
-# 9970396
-#KIC = '9970396'; period = 235.300; BJD0 = 2455190.539
-#infile = '../../RG_light_curves/9970396/KIC_9970396_LC_mag_Q017.txt'
-#instub = '../../RG_light_curves/9970396/lcchunk'
-#primary_phasemin = 0.97; primary_phasemax = 1.03
-#secondary_phasemin = 0.385; secondary_phasemax = 0.445
-#phasemin = 0.2; phasemax = 1.2
-#magdim = 11.53; magbright = 11.43
-#magdimzoom = 11.75; magbrightzoom = 11.43
-#timemin = 100; timemax = 1600
-#zoommagspace = 0.03
-
-
-# Read in full light curve
-# The columns in 'infile' are as follows, from 'makelc.py':
-# Kepler time, SAP flux, flux err, SAP mag, mag err, CBV flux, CBV mag, CBV model
-f = open(infile)
-#times, mags, merrs = np.loadtxt(f, comments='#', dtype=np.float64, usecols=(0,3,4), unpack=True)
-times, mags, merrs = np.loadtxt(f, comments='#', dtype=np.float64, usecols=(0,1,2), unpack=True)
-f.close()
-
-# Read in light curve chunks
-# This assumes you have chunk0 - chunkN with no gaps  
-try:
-    test = open(instub+'0.txt')
-    test.close()
-    for i in range(0,100):
-        try: test = open(instub+str(i)+'.txt'); test.close()
-        except: cyclecount = i; break
-except:
-    print('Skipping chunk files, no chunk0 file found.')
-    cyclecount = 0
-
-# Calculate orbital phases (0-1), and make a 'phase2s' list (1-2).
-BJD0_kep = BJD0 - 2454833 
-phases = phasecalc(times, period, BJD0_kep)
-phase2s = []
-for phase in phases: phase2s.append(phase + 1)
-
-# Folded full light curve
-ax2 = plt.subplot2grid((14,2),(5,0), colspan=2, rowspan=4)
-plt.axis([phasemin, phasemax, magdim, magbright])
-plt.plot(phases, mags, color=red, marker='.', ls='None', ms=5, mew=0)
-plt.plot(phase2s, mags, color=red, marker='.', ls='None', ms=5, mew=0)
-#ax2.axvline(x=0.5, color='k', ls=':') #dotted vertical lines
-#ax2.axvline(x=1.5, color='k', ls=':')
-ax2.spines['top'].set_visible(False)
-ax2.spines['right'].set_visible(False)
-ax2.xaxis.set_ticks_position('bottom')
-ax2.yaxis.set_ticks_position('left')
-ax2.axvline(x=primary_phasemin, color='k', ls=':') # vertical lines showing zoom extent
-ax2.axvline(x=primary_phasemax, color='k', ls=':')
-ax2.axvline(x=secondary_phasemin, color='k', ls=':')
-ax2.axvline(x=secondary_phasemax, color='k', ls=':')
-ax2.ticklabel_format(useOffset=False)
-# plot phases of RV observations on top? #NOPE, not now, would look too busy
-#ax2.set_ylabel('Kepler Magnitude')
-#ax2.set_xlabel('Orbital Phase')
-
-# Full light curve
-ax1 = plt.subplot2grid((14,2),(0,0), colspan=2, rowspan=4)
-plt.axis([timemin, timemax, magdim, magbright])
-plt.tick_params(axis='both', which='major')
-plt.plot(times, mags, color='#e34a33', marker='.', ls='None', ms=5, mew=0)
-#ax1.set_ylabel('Kepler Magnitude')#, size=18)
-ax1.set_xlabel('Time (BJD $-$ 2454833)', size=24)
-ax1.spines['top'].set_visible(False)
-ax1.spines['right'].set_visible(False)
-ax1.xaxis.set_ticks_position('bottom')
-ax1.yaxis.set_ticks_position('left')
-ax1.ticklabel_format(useOffset=False)
-#ax1.set_xticklabels([])
-
-# Option to plot vertical lines at certain timestamps
-# (to visually isolate one spacecraft orientation, for instance)
-#plt.axvline(169)
-#plt.axvline(257)
-#plt.axvline(538)
-#plt.axvline(628)
-#plt.axvline(906)
-#plt.axvline(999)
-#plt.axvline(1273)
-#plt.axvline(1370)
-
-# Secondary eclipse zoom & offset
-ax3 = plt.subplot2grid((14,2),(10,0), rowspan=5)
-plt.subplots_adjust(wspace = 0.0001, hspace=0.0001)
-plt.axis([secondary_phasemin, secondary_phasemax, magdimzoom, magbrightzoom])
-#ax3.xaxis.set_major_locator(IndexLocator(0.01, 0.37))
-ax3.xaxis.set_major_formatter(FormatStrFormatter('%.2f'))
-ax3.spines['top'].set_visible(False)
-ax3.xaxis.set_ticks_position('bottom')
-#ax3.yaxis.set_major_locator(IndexLocator(0.1, 9.8))
-offset = 0
-for i in range(0, cyclecount):
-    f = open(instub+str(i)+'.txt')
-    times, mags, merrs = np.loadtxt(f, comments='#', usecols=(0,1,2), unpack=True)
-    f.close()
-    phases = phasecalc(times, period, BJD0_kep)
-    phase2s = []
-    for phase in phases: phase2s.append(phase + 1)
-    plt.plot(phases, mags+offset, color=yel, marker='.', ls='None', ms=5, mew=0) ###
-    offset += zoommagspace
-plt.gca().get_yaxis().get_major_formatter().set_useOffset(False)
-# Little circles
-#plt.scatter(secondary_phasemax-0.01, magdimzoom-0.17, s=pristarcirclesize, facecolors=red, edgecolors=red)
-#plt.scatter(secondary_phasemax-0.01, magdimzoom-0.11, s=secstarcirclesize, facecolors=yel, edgecolors=yel)
-
-# Primary eclipse zoom & offset
-ax4 = plt.subplot2grid((14,2),(10,1), rowspan=5)
-plt.axis([primary_phasemin, primary_phasemax, magdimzoom, magbrightzoom])
-#ax4.xaxis.set_major_locator(IndexLocator(0.01, 0.98))
-ax4.xaxis.set_major_formatter(FormatStrFormatter('%.2f'))
-ax4.spines['top'].set_visible(False)
-ax4.xaxis.set_ticks_position('bottom')
-#ax4.yaxis.set_major_locator(IndexLocator(0.1, 9.8))
-offset = 0
-for i in range(0, cyclecount):
-    f = open(instub+str(i)+'.txt')
-    times, mags, merrs = np.loadtxt(f, comments='#', usecols=(0,1,2), unpack=True)
-    f.close()
-    phases = phasecalc(times, period, BJD0_kep)
-    phase2s = []
-    for phase in phases: phase2s.append(phase + 1)
-    plt.plot(phases, mags+offset, color=red, marker='.', ls='None', ms=5, mew=0) ###
-    plt.plot(phase2s, mags+offset, color=red, marker='.', ls='None', ms=5, mew=0) ###
-    offset += zoommagspace
-ax4.set_yticklabels([])
-# Little circles
-#plt.scatter(primary_phasemax-0.01, magdimzoom-0.17, s=secstarcirclesize, facecolors=yel, edgecolors=yel)
-#plt.scatter(primary_phasemax-0.01, magdimzoom-0.11, s=pristarcirclesize, facecolors=red, edgecolors=red)
-
-
-plt.figtext(0.5, 0.05, 'Orbital Phase', ha='center', va='center', size=28)
-plt.figtext(0.04, 0.5, 'Kepler Magnitude', ha='center', va='center', rotation='vertical', size=28)
-plt.figtext(0.135, 0.12, 'Secondary \n (offset)', size=24)
-plt.figtext(0.525, 0.12, 'Primary \n (offset)', size=24)
-plt.figtext(0.135, 0.40, 'Folded', size=24)
-plt.figtext(0.135, 0.685, 'Unfolded', size=24)
-
-plt.show()
\ No newline at end of file
+figsize = (20, 14) # only used when saving figures to files
+decimation = 'auto' # thin out the full & folded panels to screen resolution (see decimate.py),
+                    # or None to plot every single point
+
+# Settings for each target come from the target catalog (see targets.py)
+catalog = None # None = targets.csv, or the name of another catalog file
+
+# Choose the target to plot (when you just type 'python lcplotter.py')
+KIC = '8702921'
+
+# Read in ALL the light curve chunks at once
+# Uses the list that 'ELClcprep.py' writes (instub + 'manifest.txt') if there is one;
+# otherwise this assumes you have chunk0 - chunkN with no gaps
+# Returns times, mags, merrs, and the chunk number of every point, all concatenated
+def load_chunks(instub):
+    if os.path.exists(instub + 'manifest.txt'):
+        files = [entry['file'] for entry in read_elc_manifest(instub)]
+    else:
+        files = []
+        while os.path.exists(instub + str(len(files)) + '.txt'):
+            files.append(instub + str(len(files)) + '.txt')
+    if not files:
+        print('Skipping chunk files, no chunk0 file found.')
+    times, mags, merrs, chunknums = [], [], [], []
+    for i, filename in enumerate(files):
+        data = np.loadtxt(filename, comments='#', usecols=(0,1,2), ndmin=2)
+        times.append(data[:,0]); mags.append(data[:,1]); merrs.append(data[:,2])
+        chunknums.append(np.zeros(len(data), dtype=int) + i)
+    if not files:
+        return np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0, dtype=int)
+    return np.concatenate(times), np.concatenate(mags), np.concatenate(merrs), np.concatenate(chunknums)
+
+# Plot lots of points, decimated (or not) according to the 'decimation' setting
+def plot_points(ax, x, y, **kwargs):
+    if decimation is None:
+        return ax.plot(x, y, **kwargs)[0]
+    return plot_decimated(ax, x, y, mode=decimation, **kwargs)
+
+# Make the four-panel figure for one target
+# If savefile is given, the figure is saved there (any format matplotlib knows, from
+# the extension) instead of being shown on the screen
+def plot_target(kic, savefile=None, catalog=catalog):
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import IndexLocator, FormatStrFormatter, ScalarFormatter
+    settings = dict(pristarcirclesize=pristarcirclesize, secstarcirclesize=secstarcirclesize)
+    settings.update(get_target(kic, catalog))
+    period = settings['period']; BJD0 = settings['BJD0']
+    primary_phasemin = settings['primary_phasemin']; primary_phasemax = settings['primary_phasemax']
+    secondary_phasemin = settings['secondary_phasemin']; secondary_phasemax = settings['secondary_phasemax']
+    phasemin = settings['phasemin']; phasemax = settings['phasemax']
+    magdim = settings['magdim']; magbright = settings['magbright']
+    magdimzoom = settings['magdimzoom']; magbrightzoom = settings['magbrightzoom']
+    timemin = settings['timemin']; timemax = settings['timemax']
+    zoommagspace = settings['zoommagspace']
+
+    # Read in full light curve
+    # The columns in 'infile' are as follows, from 'makelc.py':
+    # Kepler time, SAP flux, flux err, SAP mag, mag err, CBV flux, CBV mag, CBV model
+    #times, mags, merrs = read_lc(settings['infile'], usecols=(0,3,4), kic=kic)
+    times, mags, merrs = read_lc(settings['infile'], usecols=(0,1,2), kic=kic)
+
+    # Read in light curve chunks (just once) and offset each one in magnitude
+    chunktimes, chunkmags, chunkmerrs, chunknums = load_chunks(settings['instub'])
+    chunkmags = chunkmags + chunknums*zoommagspace
+
+    # Calculate orbital phases (0-1), 'phase2s' (1-2), and cycle numbers in one go.
+    BJD0_kep = BJD0 - 2454833
+    phases, phase2s, cycles = phasefold(times, period, BJD0_kep)
+    chunkphases, chunkphase2s, chunkcycles = phasefold(chunktimes, period, BJD0_kep)
+
+    if savefile is not None:
+        fig = plt.figure(figsize=figsize)
+    else:
+        fig = plt.figure()
+
+    # Folded full light curve
+    ax2 = plt.subplot2grid((14,2),(5,0), colspan=2, rowspan=4)
+    plt.axis([phasemin, phasemax, magdim, magbright])
+    plot_points(ax2, np.concatenate((phases, phase2s)), np.concatenate((mags, mags)), color=red, marker='.', ls='None', ms=5, mew=0)
+    #ax2.axvline(x=0.5, color='k', ls=':') #dotted vertical lines
+    #ax2.axvline(x=1.5, color='k', ls=':')
+    ax2.spines['top'].set_visible(False)
+    ax2.spines['right'].set_visible(False)
+    ax2.xaxis.set_ticks_position('bottom')
+    ax2.yaxis.set_ticks_position('left')
+    ax2.axvline(x=primary_phasemin, color='k', ls=':') # vertical lines showing zoom extent
+    ax2.axvline(x=primary_phasemax, color='k', ls=':')
+    ax2.axvline(x=secondary_phasemin, color='k', ls=':')
+    ax2.axvline(x=secondary_phasemax, color='k', ls=':')
+    ax2.ticklabel_format(useOffset=False)
+    # plot phases of RV observations on top? #NOPE, not now, would look too busy
+    #ax2.set_ylabel('Kepler Magnitude')
+    #ax2.set_xlabel('Orbital Phase')
+
+    # Full light curve
+    ax1 = plt.subplot2grid((14,2),(0,0), colspan=2, rowspan=4)
+    plt.axis([timemin, timemax, magdim, magbright])
+    plt.tick_params(axis='both', which='major')
+    plot_points(ax1, times, mags, color='#e34a33', marker='.', ls='None', ms=5, mew=0)
+    #ax1.set_ylabel('Kepler Magnitude')#, size=18)
+    ax1.set_xlabel('Time (BJD $-$ 2454833)', size=24)
+    ax1.spines['top'].set_visible(False)
+    ax1.spines['right'].set_visible(False)
+    ax1.xaxis.set_ticks_position('bottom')
+    ax1.yaxis.set_ticks_position('left')
+    ax1.ticklabel_format(useOffset=False)
+    #ax1.set_xticklabels([])
+
+    # Option to plot vertical lines at certain timestamps
+    # (to visually isolate one spacecraft orientation, for instance)
+    #plt.axvline(169)
+    #plt.axvline(257)
+    #plt.axvline(538)
+    #plt.axvline(628)
+    #plt.axvline(906)
+    #plt.axvline(999)
+    #plt.axvline(1273)
+    #plt.axvline(1370)
+
+    # Secondary eclipse zoom & offset (all the chunks in one go)
+    ax3 = plt.subplot2grid((14,2),(10,0), rowspan=5)
+    plt.subplots_adjust(wspace = 0.0001, hspace=0.0001)
+    plt.axis([secondary_phasemin, secondary_phasemax, magdimzoom, magbrightzoom])
+    #ax3.xaxis.set_major_locator(IndexLocator(0.01, 0.37))
+    ax3.xaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+    ax3.spines['top'].set_visible(False)
+    ax3.xaxis.set_ticks_position('bottom')
+    #ax3.yaxis.set_major_locator(IndexLocator(0.1, 9.8))
+    plt.plot(chunkphases, chunkmags, color=yel, marker='.', ls='None', ms=5, mew=0) ###
+    plt.gca().get_yaxis().get_major_formatter().set_useOffset(False)
+    # Little circles
+    #plt.scatter(secondary_phasemax-0.01, magdimzoom-0.17, s=settings['pristarcirclesize'], facecolors=red, edgecolors=red)
+    #plt.scatter(secondary_phasemax-0.01, magdimzoom-0.11, s=settings['secstarcirclesize'], facecolors=yel, edgecolors=yel)
+
+    # Primary eclipse zoom & offset (all the chunks in one go)
+    ax4 = plt.subplot2grid((14,2),(10,1), rowspan=5)
+    plt.axis([primary_phasemin, primary_phasemax, magdimzoom, magbrightzoom])
+    #ax4.xaxis.set_major_locator(IndexLocator(0.01, 0.98))
+    ax4.xaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+    ax4.spines['top'].set_visible(False)
+    ax4.xaxis.set_ticks_position('bottom')
+    #ax4.yaxis.set_major_locator(IndexLocator(0.1, 9.8))
+    plt.plot(np.concatenate((chunkphases, chunkphase2s)), np.concatenate((chunkmags, chunkmags)), color=red, marker='.', ls='None', ms=5, mew=0) ###
+    ax4.set_yticklabels([])
+    # Little circles
+    #plt.scatter(primary_phasemax-0.01, magdimzoom-0.17, s=settings['secstarcirclesize'], facecolors=yel, edgecolors=yel)
+    #plt.scatter(primary_phasemax-0.01, magdimzoom-0.11, s=settings['pristarcirclesize'], facecolors=red, edgecolors=red)
+
+
+    plt.figtext(0.5, 0.05, 'Orbital Phase', ha='center', va='center', size=28)
+    plt.figtext(0.04, 0.5, 'Kepler Magnitude', ha='center', va='center', rotation='vertical', size=28)
+    plt.figtext(0.135, 0.12, 'Secondary \n (offset)', size=24)
+    plt.figtext(0.525, 0.12, 'Primary \n (offset)', size=24)
+    plt.figtext(0.135, 0.40, 'Folded', size=24)
+    plt.figtext(0.135, 0.685, 'Unfolded', size=24)
+
+    if savefile is not None:
+        fig.savefig(savefile)
+        plt.close(fig)
+    else:
+        plt.show()
+
+# Batch worker: save one figure, and report (rather than raise) any problem
+def render_target(args):
+    kic, savefile, catalog = args
+    try:
+        plot_target(kic, savefile, catalog)
+    except Exception as e:
+        return kic, '{0}: {1}'.format(type(e).__name__, e)
+    return kic, None
+
+# Save figures for many targets at once, spread over a pool of processes
+# returns a list of (kic, error message) for any that didn't work
+def render_batch(kics, outdir='.', fmt='png', processes=None, catalog=catalog):
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    jobs = [(kic, os.path.join(outdir, 'KIC_{0}_lc.{1}'.format(kic, fmt)), catalog) for kic in kics]
+    if processes == 1 or len(jobs) == 1:
+        results = [render_target(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(render_target, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    failures = [(kic, error) for kic, error in results if error is not None]
+    for kic, error in failures:
+        print('KIC', kic, 'FAILED:', error)
+    print('Saved {0} of {1} figures in {2}'.format(len(jobs) - len(failures), len(jobs), outdir))
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Make paper figures of RGEB light curves.')
+    parser.add_argument('kics', nargs='*', help='KIC number(s) to plot (default: ' + KIC + ')')
+    parser.add_argument('--all', action='store_true', help='plot every target in the catalog')
+    parser.add_argument('--catalog', default=catalog, help='target catalog (default: targets.csv)')
+    parser.add_argument('--outdir', default=None,
+        help='save figures here instead of showing them (headless batch mode)')
+    parser.add_argument('--format', default='png', help='figure file format, e.g. png or pdf')
+    parser.add_argument('--processes', type=int, default=None,
+        help='number of worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+
+    kics = catalog_kics(args.catalog) if args.all else (args.kics or [KIC])
+    if args.outdir is None and len(kics) == 1:
+        plot_target(kics[0], catalog=args.catalog)
+        return 0
+    import matplotlib
+    matplotlib.use('Agg') # no windows needed
+    failures = render_batch(kics, args.outdir or '.', args.format, args.processes, args.catalog)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
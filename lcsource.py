@@ -0,0 +1,104 @@
+import os
+import re
+import json
+'''
+Where 'makelc.py' gets its Kepler light curve FITS files from.
+Every source has a files(kic, short_cadence=False) method that returns a list of
+LOCAL filenames for that star, sorted in time order (one per quarter for long
+cadence, one per month for short cadence).
+
+KplrSource: asks MAST through kplr (http://dan.iel.fm/kplr/) and downloads
+    anything that isn't in the kplr data directory (~/.kplr by default) yet.
+    This needs network access, even if every file is already downloaded.
+LocalSource: a directory (e.g., a mirror of ~/.kplr/data/lightcurves/ or of the
+    MAST archive) full of kplr*_llc.fits / kplr*_slc.fits files. It is scanned once
+    and the KIC -> files index is saved in the directory (lcsource_index.json), so
+    later runs start right away and never touch the network.
+    Use rescan=True (or delete the index) after adding files.
+
+get_source('kplr') or get_source('/path/to/mirror/') picks one for you.
+'''
+
+# Kepler light curve filenames look like kplr009246715-2009131105131_llc.fits
+LCNAME = re.compile(r'^kplr(\d{9})-(\d{13})_([ls])lc\.fits(\.gz)?$')
+
+class KplrSource(object):
+
+	def __init__(self, data_root=None):
+		self.data_root = data_root
+		self.client = None
+
+	def files(self, kic, short_cadence=False):
+		import kplr # only needed (and only imported) if we go through MAST
+		if self.client is None:
+			self.client = kplr.API(data_root=self.data_root)
+		star = self.client.star(kic)
+		lcs = star.get_light_curves(short_cadence=short_cadence, fetch=True)
+		# kplr can return both cadences; only keep the kind we asked for
+		suffix = '_slc.fits' if short_cadence else '_llc.fits'
+		return sorted([lc.filename for lc in lcs if lc.filename.endswith(suffix)],
+			key=os.path.basename)
+
+class LocalSource(object):
+
+	def __init__(self, directory, indexfile='lcsource_index.json', rescan=False):
+		self.directory = directory
+		self.indexfile = os.path.join(directory, indexfile)
+		if not rescan and os.path.exists(self.indexfile):
+			with open(self.indexfile) as f:
+				self.index = json.load(f)
+		else:
+			self.index = self.scan()
+			self.save_index()
+
+	# walk the whole directory tree once: {KIC: [paths relative to the directory]}
+	def scan(self):
+		index = {}
+		for root, dirs, names in os.walk(self.directory):
+			for name in names:
+				match = LCNAME.match(name)
+				if match:
+					kic = str(int(match.group(1)))
+					path = os.path.relpath(os.path.join(root, name), self.directory)
+					index.setdefault(kic, []).append(path)
+		for kic in index:
+			index[kic].sort(key=os.path.basename)
+		return index
+
+	def save_index(self):
+		try:
+			tmpfile = self.indexfile + '.tmp'
+			with open(tmpfile, 'w') as f:
+				json.dump(self.index, f)
+			os.rename(tmpfile, self.indexfile)
+		except (IOError, OSError):
+			print('Could not save the light curve index ' + self.indexfile + ' (read-only?)')
+
+	def kics(self):
+		return sorted(self.index, key=int)
+
+	def files(self, kic, short_cadence=False):
+		try:
+			paths = self.index[str(int(kic))]
+		except KeyError:
+			raise IOError('No light curves for KIC ' + str(kic) + ' in ' + self.directory)
+		cadence = 's' if short_cadence else 'l'
+		paths = [path for path in paths if LCNAME.match(os.path.basename(path)).group(3) == cadence]
+		if not paths:
+			raise IOError('No {0} cadence light curves for KIC {1} in {2}'.format(
+				'short' if short_cadence else 'long', kic, self.directory))
+		return [os.path.join(self.directory, path) for path in paths]
+
+# 'kplr' (or None) means MAST through kplr; anything else is a local directory
+# sources are kept around, so every target processed in this process shares one
+sources = {}
+def get_source(source='kplr', data_root=None):
+	if source is None:
+		source = 'kplr'
+	key = (source, data_root)
+	if key not in sources:
+		if source == 'kplr':
+			sources[key] = KplrSource(data_root)
+		else:
+			sources[key] = LocalSource(source)
+	return sources[key]
@@ -0,0 +1,176 @@
+import os
+import json
+import numpy as np
+'''
+A light curve 'store' that holds many KIC targets in one directory.
+Use this with 'makelc.py' (to add targets) and 'ELClcprep.py' / 'lcplotter.py'
+(to read them back).
+
+Each column (time, fluxes, mags, ...) lives in its own flat binary file that gets
+memory-mapped, so slicing out one target, one quarter, or a range of times does
+NOT load anything else into memory (and does not copy the data). A small JSON index
+keeps track of which rows belong to which KIC and quarter:
+    index['targets'][KIC] = {'start': row, 'stop': row, 'quarters': {Q: [start, stop]}}
+
+Example:
+    store = LCStore('lcstore/', mode='a')
+    store.append('9246715', [time, mag, merr], ['time', 'mag', 'merr'], quarters=qtrs)
+    time, mag = LCStore('lcstore/').get('9246715', ['time', 'mag'], tmin=100, tmax=300)
+
+Re-appending a KIC that is already in the store points the index at the new rows;
+the old rows are simply left behind on disk (there is no compaction).
+Only one process should append to a store at a time. If an append dies before the
+index is saved, the rows it wrote are cut off again by the next append.
+'''
+
+class LCStore(object):
+
+	def __init__(self, directory, mode='r'):
+		self.directory = directory
+		self.mode = mode
+		self.indexfile = os.path.join(directory, 'index.json')
+		if os.path.exists(self.indexfile):
+			with open(self.indexfile) as f:
+				self.index = json.load(f)
+		elif mode == 'r':
+			raise IOError('No light curve store found in ' + directory)
+		else:
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			self.index = {'columns': [], 'dtypes': {}, 'nrows': 0, 'targets': {}}
+		self.maps = {}
+
+	def __contains__(self, kic):
+		return normalize_kic(kic) in self.index['targets']
+
+	def __len__(self):
+		return len(self.index['targets'])
+
+	def kics(self):
+		return sorted(self.index['targets'], key=int)
+
+	def columns(self):
+		return list(self.index['columns'])
+
+	def quarters(self, kic):
+		target = self.target(kic)
+		return sorted(int(q) for q in target['quarters'])
+
+	def target(self, kic):
+		try:
+			return self.index['targets'][normalize_kic(kic)]
+		except KeyError:
+			raise KeyError('KIC ' + str(kic) + ' is not in the store ' + self.directory)
+
+	def colfile(self, name):
+		return os.path.join(self.directory, name + '.dat')
+
+	# add one target's light curve to the end of the store
+	# columns is a list of equal-length arrays with matching labels in names
+	# quarters (optional) gives the quarter number of every row; rows from the same
+	# quarter must be next to each other (as they are in 'makelc.py' output)
+	def append(self, kic, columns, names, quarters=None):
+		if self.mode == 'r':
+			raise IOError('Light curve store ' + self.directory + ' was opened read-only')
+		columns = [np.asarray(col) for col in columns]
+		names = list(names)[:len(columns)]
+		nrows = len(columns[0])
+		for col in columns:
+			if len(col) != nrows:
+				raise ValueError('All columns must be the same length')
+		if not self.index['columns']: # first target sets up the columns
+			self.index['columns'] = names
+			for name, col in zip(names, columns):
+				dtype = np.int64 if np.issubdtype(col.dtype, np.integer) else np.float64
+				self.index['dtypes'][name] = np.dtype(dtype).str
+		elif sorted(names) != sorted(self.index['columns']):
+			raise ValueError('Columns ' + str(names) + ' do not match the store columns '
+				+ str(self.index['columns']))
+		data = dict(zip(names, columns))
+		start = self.index['nrows']
+		qtrindex = {}
+		if quarters is not None:
+			quarters = np.asarray(quarters)
+			if len(quarters) != nrows:
+				raise ValueError('quarters must have one entry per row')
+			edges = np.concatenate(([0], np.nonzero(np.diff(quarters))[0] + 1, [nrows]))
+			for a, b in zip(edges[:-1], edges[1:]):
+				q = str(int(quarters[a]))
+				if q in qtrindex:
+					raise ValueError('Rows from quarter ' + q + ' are not contiguous')
+				qtrindex[q] = [start + int(a), start + int(b)]
+		for name in self.index['columns']:
+			self.trim(name, start)
+			with open(self.colfile(name), 'ab') as f:
+				np.ascontiguousarray(data[name], dtype=self.index['dtypes'][name]).tofile(f)
+		self.index['targets'][normalize_kic(kic)] = {'start': start, 'stop': start + nrows,
+			'quarters': qtrindex}
+		self.index['nrows'] = start + nrows
+		self.save_index()
+		self.maps = {} # the memory maps are now too short
+
+	# cut a column file back to nrows rows, dropping anything an append that never got
+	# as far as saving the index left behind (it would shift every later target)
+	def trim(self, name, nrows):
+		filename = self.colfile(name)
+		size = nrows * np.dtype(self.index['dtypes'][name]).itemsize
+		if not os.path.exists(filename):
+			if nrows:
+				raise IOError('Light curve store ' + self.directory + ' is missing ' + filename)
+			return
+		if os.path.getsize(filename) < size:
+			raise IOError(filename + ' is shorter than the index says; the store is damaged')
+		if os.path.getsize(filename) > size:
+			with open(filename, 'r+b') as f:
+				f.truncate(size)
+
+	def save_index(self):
+		# write a new index and swap it in, so readers never see half a file
+		tmpfile = self.indexfile + '.tmp'
+		with open(tmpfile, 'w') as f:
+			json.dump(self.index, f)
+		os.rename(tmpfile, self.indexfile)
+
+	# memory-mapped view of an entire column (all targets)
+	def column(self, name):
+		if name not in self.maps:
+			if name not in self.index['dtypes']:
+				raise KeyError('No column ' + str(name) + ' in the store ' + self.directory)
+			nrows = self.index['nrows']
+			dtype = np.dtype(self.index['dtypes'][name])
+			if nrows == 0:
+				self.maps[name] = np.zeros(0, dtype=dtype)
+			else:
+				self.maps[name] = np.memmap(self.colfile(name), dtype=dtype, mode='r', shape=(nrows,))
+		return self.maps[name]
+
+	# row range [start, stop) for a KIC, optionally just one quarter and/or time range
+	# the time range assumes the first column is time, sorted within each target
+	def rows(self, kic, quarter=None, tmin=None, tmax=None):
+		target = self.target(kic)
+		if quarter is None:
+			start, stop = target['start'], target['stop']
+		else:
+			try:
+				start, stop = target['quarters'][str(int(quarter))]
+			except KeyError:
+				raise KeyError('KIC ' + str(kic) + ' has no quarter ' + str(quarter) + ' in the store')
+		if tmin is not None or tmax is not None:
+			time = self.column(self.index['columns'][0])[start:stop]
+			lo = 0 if tmin is None else np.searchsorted(time, tmin, side='left')
+			hi = len(time) if tmax is None else np.searchsorted(time, tmax, side='right')
+			start, stop = start + lo, start + hi
+		return int(start), int(stop)
+
+	# zero-copy slices of the requested columns (names or indices) for one target
+	# returns a tuple of arrays, like np.loadtxt(unpack=True)
+	def get(self, kic, columns=None, quarter=None, tmin=None, tmax=None):
+		start, stop = self.rows(kic, quarter, tmin, tmax)
+		if columns is None:
+			columns = self.index['columns']
+		names = [self.index['columns'][col] if not isinstance(col, str) else col for col in columns]
+		return tuple(self.column(name)[start:stop] for name in names)
+
+# KICs are stored without leading zeros, e.g. '009246715' -> '9246715'
+def normalize_kic(kic):
+	return str(int(kic))
@@ -1,172 +1,596 @@
 from __future__ import print_function
+import os
+import sys
+import argparse
+import multiprocessing
 import numpy as np
-import matplotlib.pyplot as plt
-import kplr
 from lc_functions import *
-from astropy.io import fits
+from lcstore import LCStore
+from cbv import cotrend_lc, get_cbv_manager
+from lcsource import get_source
+from stagecache import StageCache, file_hash
+from decimate import plot_decimated
+from detrend import detrend
+from outliers import find_outliers
+from eclipsemask import eclipse_mask, read_mask, write_mask
+from quality import QUALITY_NAMES, quality_bitmask, quality_mask, quality_tally, format_tally
+from targets import catalog_kics, get_target, target_eclipses
+from stageprofile import StageProfile, aggregate_profiles, count_rows, format_profile, write_json
 '''
 Creates a friendly light curve from multiple quarters of Kepler data.
 Works for ANY valid KIC target your heart desires (no need to already have the data).
 by Meredith Rawls, with some functions originally by Jean McKeever
 July 2014
 
-First, the kepcotrend task is used to create a 'detrended' light curve in parallel with
-the 'raw' simple aperture photometry light curve. The following operations are then
+First, cotrending basis vectors are fit (with cbv.py, or the old PyKE kepcotrend task)
+to create a 'detrended' light curve in parallel with the 'raw' simple aperture
+photometry light curve. The following operations are then
 carried out on BOTH light curves:
 - NaN values are deleted
+- cadences with bad Kepler quality flags are deleted (or just flagged), see quality.py
 - each quarter is put on the same median flux level
 - the gaps between quarters are lined up nicely
-- the entire light curve is 'leveled out' via a 3rd-order polynomial
+- the entire light curve is 'leveled out' via a 3rd-order polynomial (eclipses masked)
+  (or per-quarter splines or a sliding median, see detrend.py)
+- leftover artifacts/blips are found with a sliding median filter and flagged (or
+  removed, with outlier_action = 'drop'), see outliers.py
 Note there is no interpolation---every original timestamp is preserved.
 
-You will get a nice plot and an outfile (.txt), which you can specify below.
+You will get a nice plot and an outfile (.txt, or binary .npz/.h5/.fits), which you can specify below.
 It will contain fluxes and magnitudes (normalized to the Kepler magnitude of the target).
 It will also contain error values for both flux and magnitude!!!
 
 TO USE THIS PROGRAM:
-(1) Be sure you have numpy, matplotlib, kplr, astropy, pyraf, and PyKE installed
+(1) Be sure you have numpy, matplotlib, kplr, and astropy installed
 --> if you don't, try 'pip install kplr' (for example)
+--> pyraf and PyKE are only needed if you set pyke = True below
 --> PyKE is a bit more complicated: see http://keplergo.arc.nasa.gov/PyKE.shtml
 --> you'll want to run 'mkiraf' in the working directory, too
-(2) Be sure you have 'lc_functions.py' saved in the same directory as this file
+(2) Be sure you have 'lc_functions.py', 'cbv.py', and 'lcstore.py' saved in the same
+directory as this file
 (3) Download ALL the basis vectors and save them in a subdirectory called 'basisvectors'
 --> get them here: https://archive.stsci.edu/kepler/cbv.html
 (4) Optional: make a mask (e.g., for eclipses) in real BJD units (Kepler time + 2454833)
 --> see mask_kepcotrend.txt for an example
 --> save the mask file in ~/.kplr/data/lightcurves/KICNUMBERHERE/.
+--> (or next to the light curve files, if you use a local source directory)
 --> if no mask file is found, the program will still work
-(5) Optional: tweak the parameters used in the kepcotrend task in 'lc_functions.py'.
+--> OR set 'eclipses' below to have the eclipses masked automatically (eclipsemask.py)
+(5) Optional: tweak the cotrending parameters (cotrend_lc below, or the kepcotrend
+task in 'lc_functions.py' if you use PyKE).
 --> for more info, see: http://keplergo.arc.nasa.gov/ContributedSoftwareKepcotrend.shtml
 (6) Change any settings below as necessary (KIC, home directory, etc.)
 (7) Type 'python makelc.py' and watch the magic happen
+
+BATCH MODE: to run a whole catalog, give KICs on the command line and/or a text file
+with one KIC per line, e.g.
+    python makelc.py --kic-file my_EBs.txt --processes 8 --outfile 'KIC_{kic}_makelc_out.npz'
+Targets are spread over a pool of processes, each one gets its own outfile ('{kic}' is
+replaced by the KIC number), and any target that fails is written to a failures file
+instead of stopping the batch. Plots are skipped in batch mode (or use --headless).
+Add --all to run every star in the target catalog (targets.csv, see targets.py), and
+--mask-eclipses to mask each star's eclipses from its catalog ephemeris and eclipse
+windows instead of reading mask files.
+Type 'python makelc.py --help' for all the options.
+From other code, use make_lightcurve(kic, ...) to process one target.
+
+PROFILING: every stage (download, cotrend, NaN deletion, quality flags, normalization,
+gap alignment, detrending, outliers, output) is timed, with its rows in and out, the
+memory in use, iterations, and whether it came from the cache (see stageprofile.py).
+It's in result['profile']; with --profile DIR (or profile = 'DIR/' below) each target's
+profile is written to DIR/profile_{kic}.json, and a batch also gets a per-stage summary
+of all the targets in DIR/profile_batch.json.
+
+SHORT CADENCE: set cadence = 'short' (or use --short-cadence) to use the 1-minute
+kplr*_slc.fits files instead. These come one per MONTH, so each month gets its own
+basis vectors (the _scbv.fits files) and its own normalization and gap alignment.
+Each month is read and cotrended on its own, and with binning = 30 (or --bin 30) it
+is binned to long cadence right away, so a full-resolution copy of the whole
+light curve is never kept around.
 '''
 
 ### SET KIC, HOME DIRECTORY, AND CBV FILE DIRECTORY HERE ###
 KIC = '9246715'
-homedir = '/Users/Meredith/'
+homedir = os.path.expanduser('~') + '/' # where kplr keeps its .kplr/ data directory
 cbvdir = 'basisvectors/'
-outfile = 'makelc_out.txt'
+outfile = 'makelc_out.txt' # or .npz/.h5/.fits for a (much faster) binary file
 maskfile = 'mask_kepcotrend.txt'
+eclipses = None # or mask the eclipses from an ephemeris instead of maskfile (see eclipsemask.py), e.g.
+# eclipses = dict(period=171.277967, BJD0=2455170.514777, windows=[(0.97, 1.03), (0.685, 0.745)])
+catalog = None # target catalog for --all and --mask-eclipses (None = targets.csv, see targets.py)
 plotaxes = [100, 1600, 9.6, 9.0]
+store = None # e.g. 'lcstore/' to ALSO add this target to a multi-target light curve store
+failfile = 'makelc_failures.txt' # batch mode: KICs that didn't work, and why
+pyke = False # True = use the old PyRAF kepcotrend task (and its cbv_*.fits files) instead of cbv.py
+fitpower = 1 # cbv.py fit: 1 = least absolute deviation (like kepcotrend's simplex fit), 2 = least squares
+source = 'kplr' # or a directory with a local copy of the kplr*_llc.fits files (no network needed)
+cachedir = None # e.g. 'makelc_cache/' to save every processing stage and only redo what changed
+cadence = 'long' # or 'short' for the 1-minute kplr*_slc.fits files (one per month)
+binning = None # short cadence only: e.g. 30 to bin every 30 short cadences into one long cadence
+quality_flags = 'default' # SAP_QUALITY bits to remove: 'default', 'none', an integer, or a list of names
+quality_action = 'drop' # 'drop' bad-quality cadences, or just 'flag' them (the 'flagged' result column)
+detrend_method = 'poly' # long-term trend: 'poly' (one polynomial), 'spline' (per quarter), or 'median'
+detrend_window = None # days: knot spacing ('spline') or median window ('median'); None = default
+outlier_sigma = 5.0 # outliers are this many robust sigmas from a sliding median (None = don't look)
+outlier_window = 0.5 # days, width of that sliding median
+outlier_action = 'flag' # just 'flag' the outliers (the 'outliers' result column), or 'drop' them
+profile = None # e.g. 'profiles/' to write the time, rows and memory of every stage (see stageprofile.py)
 
-# Read in Kepler light curve data from MAST
-# For more info, see http://dan.iel.fm/kplr/#
-client = kplr.API()
-star = client.star(KIC)
-lcs = star.get_light_curves(short_cadence=False)
-time, flux_cbv, model, flux_sap, ferr, quality, kepmag = [], [], [], [], [], [], []
-qtr = 0
-for lc in lcs:
-	# figure out the basis vector filename corresponding to each quarter (lc)
-	if qtr == 15: drnum = '-d20'
-	elif qtr == 16: drnum = '-d22'
-	elif qtr == 17: drnum = '-d23'
-	else: drnum = '-d21'
-	if qtr < 10: qtr = '0' + str(qtr)
-	else: qtr = str(qtr)
-	fullKIC = str(lc)[17:26] #e.g. 009246715
-	filenamechunk = str(lc)[27:40] #e.g. 2009131105131
-	cbvfile = cbvdir + 'kplr' + filenamechunk + '-q' + qtr + drnum + '_lcbv.fits'
-	lcin = homedir + '.kplr/data/lightcurves/' + fullKIC + '/kplr' + fullKIC + '-' + filenamechunk + '_llc.fits'
-	lcout = homedir + '.kplr/data/lightcurves/' + fullKIC + '/cbv_kplr' + fullKIC + '-' + filenamechunk + '_llc.fits'
-	# check if a maskfile exists. if yes, read it in. if no, don't use a mask.
-	try:
-		masktest = homedir + '.kplr/data/lightcurves/' + fullKIC + '/' + maskfile
-		fmask = open(masktest)
-		fullmaskfile = masktest
-		mstart, mend = np.loadtxt(fmask, delimiter=',', unpack=True)
-		mstart = mstart - 2454833
-		mend = mend - 2454833
-	except:
-		print('No mask file found.')
-		fullmaskfile = ''
-		mstart = []
-		mend = []
-	# check if the cbv_filename.fits files already exist. if they don't, run kepcotrend.
-	try:
-		f = fits.open(lcout)
-	except:
-		print('Running kepcotrend...')
-		kepcotrend(lcin, lcout, cbvfile, fullmaskfile)
-		f = fits.open(lcout)
+# Read (and cotrend) one quarter of data. Returns a dictionary of arrays.
+# (for short cadence, one file is one MONTH of a quarter; month picks the CBVs)
+# With pyke=True the PyRAF kepcotrend task does the cotrending; its cbv_*.fits output
+# is only reused if reuse_pyke=True (it can't tell if the mask or CBVs changed).
+def read_quarter(lcin, cbvs, mstart, mend, fullmaskfile='', pyke=pyke, nvec=2, sigmaclip=2.0,
+	reuse_pyke=True, month=None, fitpower=fitpower):
+	from astropy.io import fits
+	lcdir, lcname = os.path.split(lcin) #e.g. kplr009246715-2009131105131_llc.fits
+	lcout = os.path.join(lcdir, 'cbv_' + lcname)
+	if pyke:
+		# check if the cbv_filename.fits files already exist. if they don't, run kepcotrend.
+		try:
+			if not reuse_pyke: raise IOError('rerun kepcotrend')
+			f = fits.open(lcout)
+		except:
+			print('Running kepcotrend...')
+			header = fits.getheader(lcin)
+			lccadence = 'short' if header.get('obsmode', '').startswith('short') else 'long'
+			cbvfile = cbvs.find(header['quarter'], header.get('data_rel'), lccadence, month)
+			kepcotrend(lcin, lcout, cbvfile, fullmaskfile)
+			f = fits.open(lcout)
+		cbvsap_flux = f[1].data['cbvsap_flux']
+		cbvsap_modl = f[1].data['cbvsap_modl']
+	else:
+		# fit the basis vectors in memory (same settings as the kepcotrend task, which
+		# was run with method='simplex', fitpower=1)
+		f = fits.open(lcin)
+		cbvsap_flux, cbvsap_modl, coeffs = cotrend_lc(f, cbvs, mstart, mend,
+			nvec=nvec, month=month, sigmaclip=sigmaclip, iterate=True, fitpower=fitpower)
 	# read in light curve data
 	hdu_data = f[1].data #lc data is in the 1st FITS HDU
-	time.append(hdu_data['time'])
-	flux_sap.append(hdu_data['sap_flux'])
-	model.append(hdu_data['cbvsap_modl'])
-	flux_cbv.append(hdu_data['cbvsap_flux'])
-	ferr.append(hdu_data['sap_flux_err'])
-	quality.append(hdu_data['sap_quality'])
-	#kepmag.append(hdu_data['kepmag'])
-	kepmag.append(f[0].header['kepmag']) # kepler magnitude from header
-	qtr = int(qtr) + 1
-
-# Save the timestamp at the start of each quarter
-qtrstart = []
-for i in range(0,len(time)): qtrstart.append(time[i][0])
-
-# Get rid of any observation that has NaNs, because we hate NaNs
-for i in range(0,len(time)):
-	time[i], flux_sap[i], ferr[i], flux_cbv[i], model[i], quality[i]  = nan_delete(
-		time[i], flux_sap[i], ferr[i], flux_cbv[i], model[i], quality[i])
-
-# Put data from different quarters on the same median level
-flux_sap = normalize_qtr_med(flux_sap)
-flux_cbv = normalize_qtr_med(flux_cbv)
-
-# New time arrays for clearer accounting: one for the raw (SAP) flux and one for the
-# processed (CBV) flux. These arrays are IDENTICAL.
-time_cbv = time
-time_sap = time
-
-# Line up the gaps within each quarter
-time_cbv, flux_cbv = lineup_qtr_gaps(time_cbv, flux_cbv, mstart, mend)
-time_sap, flux_sap = lineup_qtr_gaps(time_sap, flux_sap, mstart, mend)
-
-# Stitch all the quarters together into a single light curve
-time_all_cbv = np.concatenate(time_cbv)
-time_all_sap = np.concatenate(time_sap)
-flux_all_cbv = np.concatenate(flux_cbv)
-flux_all_sap = np.concatenate(flux_sap)
-model_all = np.concatenate(model)
-ferr_all = np.concatenate(ferr)
-
-# Remove long-term trend ('level it out') with a 3rd-order polynomial
-time_all_cbv, flux_all_cbv = long_detrend(time_all_cbv, flux_all_cbv, order=3)
-time_all_sap, flux_all_sap = long_detrend(time_all_sap, flux_all_sap, order=3)
-
-# Put everything on a magnitude scale
-kepmag = np.mean(kepmag) # kepler magnitudes from file headers (should all be the same)
-mag_all_sap = -2.5*np.log10(flux_all_sap) + (kepmag - np.median(-2.5*np.log10(flux_all_sap)))
-merr_all_sap = 1.0857 * ferr_all / flux_all_sap
-mag_all_cbv = -2.5*np.log10(flux_all_cbv) + (kepmag - np.median(-2.5*np.log10(flux_all_cbv)))
-merr_all_cbv = 1.0857 * ferr_all / flux_all_cbv
-
-# TODO: SOMEHOW MANUALLY REMOVE THE REMAINING ARTIFACTS/BLIPS ??
-
-# Write out all light curve info to a file
-f2 = open(outfile, 'w')
-print('# Kepler time, SAP flux, flux err, SAP mag, mag err, CBV flux, CBV mag, CBV model', file=f2)
-for i in range(0,len(time_all_sap)):
-	print(time_all_sap[i], flux_all_sap[i], ferr_all[i], mag_all_sap[i], 
-		merr_all_sap[i], flux_all_cbv[i], mag_all_cbv[i], model_all[i], file=f2)
+	quarter = dict(time=hdu_data['time'], sap_flux=hdu_data['sap_flux'],
+		ferr=hdu_data['sap_flux_err'], cbv_flux=cbvsap_flux, model=cbvsap_modl,
+		quality=hdu_data['sap_quality'], cadenceno=hdu_data['cadenceno'],
+		#kepmag=hdu_data['kepmag'],
+		kepmag=f[0].header['kepmag'], # kepler magnitude from header
+		quarter=f[0].header['quarter'])
+	return quarter
+
+# Sort light curve files into (filename, quarter, month) in time order
+# long cadence files have one file per quarter (month is None); short cadence files
+# have up to three per quarter, and the month is the one whose monthly CBV file covers
+# the file's cadence numbers (see CBVManager.month), or else the month in the header,
+# or else 1, 2, 3 in time order
+def group_lcfiles(lcfiles, cbvs=None):
+	from astropy.io import fits
+	groups = []
+	months = {}
+	for lcin in sorted(lcfiles, key=os.path.basename):
+		with fits.open(lcin) as f:
+			header = f[0].header
+			quarter = int(header['quarter'])
+			month = None
+			if header.get('obsmode', '').startswith('short'):
+				months[quarter] = months.get(quarter, 0) + 1
+				if cbvs is not None:
+					month = cbvs.month(quarter, f[1].data['cadenceno'], header.get('data_rel'))
+				if month is None:
+					month = int(header.get('month', months[quarter]))
+		groups.append((lcin, quarter, month))
+	return groups
+
+# Read and cotrend one file, then (optionally) bin it down to fewer cadences right away,
+# so binned short cadence data is never all in memory at full resolution
+def read_segment(lcin, cbvs, mstart, mend, fullmaskfile='', pyke=pyke, nvec=2, sigmaclip=2.0,
+	reuse_pyke=True, month=None, binning=None, fitpower=fitpower):
+	segment = read_quarter(lcin, cbvs, mstart, mend, fullmaskfile, pyke, nvec, sigmaclip,
+		reuse_pyke, month, fitpower)
+	if binning:
+		cadenceno = segment.pop('cadenceno')
+		cadenceno, segment, npoints = bin_cadences(cadenceno, segment, binsize=binning)
+		segment['cadenceno'] = cadenceno
+	return segment
+
+# Process ONE target, start to finish. Returns a dictionary with the stitched light
+# curve columns (see LC_COLUMNS), plus 'qtrstart', 'quarters' (one per row), 'kepmag',
+# 'quality' and 'flagged' (SAP_QUALITY and whether it is bad, per row), 'outliers'
+# (True for the blips found after detrending; all False if they were dropped), and
+# 'quality_tally' (how many cadences had each quality bit, one row per file; see
+# quality.py) with 'qtrnumbers' (the quarter of each file).
+# If outfile is given, the light curve is written there, too.
+# eclipses: dict(period, BJD0, windows) to make the mask from an ephemeris (BJD0 in full
+# BJD, windows = list of (phasemin, phasemax)), instead of reading maskfile
+# If cachedir is given, the result of every stage is saved there (see stagecache.py),
+# and only the stages whose inputs or settings changed are run again next time.
+# cadence='short' uses the short cadence files instead; each MONTH is then cotrended,
+# normalized, and lined up on its own (everything below that says 'quarter' means
+# 'month'), and binning=30 bins each month to long cadence as soon as it is read.
+def make_lightcurve(kic, homedir=homedir, cbvdir=cbvdir, maskfile=maskfile, outfile=None, pyke=pyke,
+	source=source, cachedir=cachedir, nvec=2, sigmaclip=2.0, fitpower=fitpower, gap_threshold=100,
+	detrend_order=3, cadence=cadence, binning=binning, detrend_method=detrend_method,
+	detrend_window=detrend_window, quality_flags=quality_flags, quality_action=quality_action,
+	outlier_sigma=outlier_sigma, outlier_window=outlier_window, outlier_action=outlier_action,
+	eclipses=eclipses, profile=None):
+	for action in (quality_action, outlier_action):
+		if action not in ('drop', 'flag'):
+			raise ValueError("quality_action and outlier_action must be 'drop' or 'flag'")
+	cache = StageCache(cachedir)
+	bitmask = quality_bitmask(quality_flags)
+	if profile is None:
+		profile = StageProfile(kic)
+	# Find the Kepler light curve files, from MAST (downloaded to homedir/.kplr/) or a
+	# local directory. For more info on kplr, see http://dan.iel.fm/kplr/#
+	with profile.stage('download') as record:
+		lcfiles = get_source(source, data_root=homedir + '.kplr').files(kic,
+			short_cadence=(cadence == 'short'))
+		record['rows_out'] = len(lcfiles) # files, not cadences
+	# the basis vectors for each quarter are found from the light curve headers
+	cbvs = get_cbv_manager(cbvdir)
+	qtrdata, qtrkeys = [], []
+	# (reading and cotrending every quarter or month: 'iterations' counts them)
+	with profile.stage('cotrend') as record:
+		record['iterations'] = 0
+		for lcin, qtr, month in group_lcfiles(lcfiles, cbvs):
+			lcdir = os.path.dirname(lcin)
+			fullmaskfile = os.path.join(lcdir, maskfile)
+			if eclipses is not None:
+				# mask every eclipse from the ephemeris (in Kepler time)
+				mstart, mend = eclipse_mask(eclipses['period'], eclipses['BJD0'] - 2454833,
+					eclipses['windows'])
+				if pyke: # kepcotrend needs it in a file
+					fullmaskfile = os.path.join(lcdir, 'eclipse_' + maskfile)
+					write_mask(fullmaskfile, mstart, mend)
+			elif os.path.exists(fullmaskfile):
+				# a maskfile exists (next to the light curves), so read it in (in Kepler time)
+				mstart, mend = read_mask(fullmaskfile)
+			else: # don't use a mask
+				print('No mask file found.')
+				fullmaskfile = ''
+				mstart, mend = np.zeros(0), np.zeros(0)
+			# the cotrended quarter depends on the FITS file, the mask, and the CBV settings
+			quarter, qkey = cache.run('cotrend', [file_hash(lcin), np.asarray(mstart), np.asarray(mend),
+				pyke, nvec, sigmaclip, fitpower, sorted(cbvs.files.items()), month, binning],
+				profile.ran(record, lambda: read_segment(lcin, cbvs, mstart, mend, fullmaskfile, pyke,
+					nvec, sigmaclip, reuse_pyke=cachedir is None, month=month, binning=binning,
+					fitpower=fitpower)))
+			qtrdata.append(quarter)
+			qtrkeys.append(qkey)
+			record['iterations'] += 1
+		record['rows_out'] = sum(len(quarter['time']) for quarter in qtrdata)
+	kepmag = [quarter['kepmag'] for quarter in qtrdata]
+	quarters = [quarter['quarter'] for quarter in qtrdata]
+
+	# Save the timestamp at the start of each quarter (that has any data)
+	qtrstart = [quarter['time'][0] for quarter in qtrdata if len(quarter['time'])]
+
+	# Get rid of any observation that has NaNs, because we hate NaNs
+	def nan_stage():
+		time, flux_sap, ferr, flux_cbv, model, quality = [], [], [], [], [], []
+		for quarter in qtrdata:
+			columns = nan_delete(quarter['time'], quarter['sap_flux'], quarter['ferr'],
+				quarter['cbv_flux'], quarter['model'], quarter['quality'])
+			for biglist, col in zip((time, flux_sap, ferr, flux_cbv, model, quality), columns):
+				biglist.append(col)
+		return dict(time=time, flux_sap=flux_sap, ferr=ferr, flux_cbv=flux_cbv, model=model,
+			quality=quality)
+	with profile.stage('nandelete', rows_in=count_rows([quarter['time'] for quarter in qtrdata])) as record:
+		nonans, nankey = cache.run('nandelete', qtrkeys, profile.ran(record, nan_stage))
+		record['rows_out'] = count_rows(nonans['time'])
+
+	# Get rid of cadences with bad quality flags (or just flag them), and count how many
+	# cadences had each quality bit set in each quarter
+	def quality_stage():
+		clean = dict((name, list(columns)) for name, columns in nonans.items())
+		clean.update(flagged=[], tally=[])
+		for i, quality in enumerate(nonans['quality']):
+			bad = quality_mask(quality, bitmask)
+			clean['tally'].append(quality_tally(quality))
+			if quality_action == 'drop':
+				for name in ('time', 'flux_sap', 'ferr', 'flux_cbv', 'model', 'quality'):
+					clean[name][i] = nonans[name][i][~bad]
+				bad = bad[~bad]
+			clean['flagged'].append(bad)
+		clean['tally'] = np.array(clean['tally']).reshape(-1, len(QUALITY_NAMES))
+		return clean
+	with profile.stage('quality', rows_in=count_rows(nonans['time'])) as record:
+		clean, qualkey = cache.run('quality', [nankey, bitmask, quality_action],
+			profile.ran(record, quality_stage))
+		record['rows_out'] = count_rows(clean['time'])
+	time, ferr, model = clean['time'], clean['ferr'], clean['model']
+
+	# Put data from different quarters on the same median level
+	with profile.stage('normalize', rows_in=count_rows(time)) as record:
+		normed, normkey = cache.run('normalize', [qualkey], profile.ran(record, lambda: dict(
+			flux_sap=normalize_qtr_med(clean['flux_sap']),
+			flux_cbv=normalize_qtr_med(clean['flux_cbv']))))
+		record['rows_out'] = count_rows(normed['flux_cbv'])
+
+	# New time arrays for clearer accounting: one for the raw (SAP) flux and one for the
+	# processed (CBV) flux. These arrays are IDENTICAL.
+	time_cbv = time
+	time_sap = time
+
+	# Line up the gaps within each quarter
+	# (and count the shifts it took, for both light curves together)
+	def lineup_stage():
+		t, flux_cbv, iter_cbv = lineup_qtr_gaps(time_cbv, normed['flux_cbv'], mstart, mend,
+			threshold=gap_threshold, return_iterations=True)
+		t, flux_sap, iter_sap = lineup_qtr_gaps(time_sap, normed['flux_sap'], mstart, mend,
+			threshold=gap_threshold, return_iterations=True)
+		return dict(flux_cbv=flux_cbv, flux_sap=flux_sap, iterations=iter_cbv + iter_sap)
+	with profile.stage('lineup', rows_in=count_rows(time_cbv)) as record:
+		lined, linekey = cache.run('lineup', [normkey, np.asarray(mstart), np.asarray(mend),
+			gap_threshold], profile.ran(record, lineup_stage))
+		record.update(rows_out=count_rows(lined['flux_cbv']), iterations=int(lined['iterations']))
+
+	# Stitch all the quarters together into a single light curve
+	time_all_cbv = np.concatenate(time_cbv)
+	time_all_sap = np.concatenate(time_sap)
+	model_all = np.concatenate(model)
+	ferr_all = np.concatenate(ferr)
+	qtr_all = np.repeat(quarters, [len(t) for t in time_sap])
+
+	# Remove long-term trend ('level it out') with a 3rd-order polynomial (by default),
+	# SAP and CBV fluxes together, leaving the masked eclipses out of the fit
+	def detrend_stage():
+		flux_all_cbv, flux_all_sap = detrend(time_all_cbv, [np.concatenate(lined['flux_cbv']),
+			np.concatenate(lined['flux_sap'])], method=detrend_method, order=detrend_order,
+			window=detrend_window, breaks=[t[0] for t in time_cbv if len(t)], mstart=mstart, mend=mend)
+		return dict(flux_all_cbv=flux_all_cbv, flux_all_sap=flux_all_sap)
+	with profile.stage('detrend', rows_in=len(time_all_cbv)) as record:
+		leveled, levelkey = cache.run('detrend', [linekey, detrend_method, detrend_order, detrend_window,
+			np.asarray(mstart), np.asarray(mend)], profile.ran(record, detrend_stage))
+		record['rows_out'] = len(leveled['flux_all_cbv'])
+	flux_all_cbv, flux_all_sap = leveled['flux_all_cbv'], leveled['flux_all_sap']
+	quality_all = np.concatenate(clean['quality'])
+	flagged_all = np.concatenate(clean['flagged'])
+
+	# Find the remaining artifacts/blips: points far from a sliding median, in either
+	# flux, but never inside the mask (eclipses) and never long runs of them
+	with profile.stage('outliers', rows_in=len(time_all_sap)) as record:
+		outliers = np.zeros(len(time_all_sap), dtype=bool)
+		if outlier_sigma:
+			clipped, clipkey = cache.run('outliers', [levelkey, outlier_sigma, outlier_window,
+				np.asarray(mstart), np.asarray(mend)], profile.ran(record, lambda: dict(
+				outliers=find_outliers(time_all_cbv, [flux_all_cbv, flux_all_sap], window=outlier_window,
+				nsigma=outlier_sigma, breaks=[t[0] for t in time_cbv if len(t)], mstart=mstart, mend=mend))))
+			outliers = clipped['outliers']
+		if outlier_action == 'drop' and outliers.any():
+			keep = ~outliers
+			time_all_sap, time_all_cbv, flux_all_sap, flux_all_cbv, ferr_all, model_all, qtr_all, \
+				quality_all, flagged_all, outliers = [col[keep] for col in (time_all_sap, time_all_cbv,
+				flux_all_sap, flux_all_cbv, ferr_all, model_all, qtr_all, quality_all, flagged_all, outliers)]
+		record['rows_out'] = len(time_all_sap)
+
+	# Put everything on a magnitude scale
+	kepmag = np.mean(kepmag) # kepler magnitudes from file headers (should all be the same)
+	mag_all_sap = -2.5*np.log10(flux_all_sap) + (kepmag - np.median(-2.5*np.log10(flux_all_sap)))
+	merr_all_sap = 1.0857 * ferr_all / flux_all_sap
+	mag_all_cbv = -2.5*np.log10(flux_all_cbv) + (kepmag - np.median(-2.5*np.log10(flux_all_cbv)))
+	merr_all_cbv = 1.0857 * ferr_all / flux_all_cbv
+
+	columns = [time_all_sap, flux_all_sap, ferr_all, mag_all_sap,
+		merr_all_sap, flux_all_cbv, mag_all_cbv, model_all]
+	result = dict(zip(LC_COLUMNS, columns))
+	result.update(kic=str(kic), qtrstart=qtrstart, quarters=qtr_all, kepmag=kepmag,
+		quality=quality_all, flagged=flagged_all, outliers=outliers, quality_tally=clean['tally'],
+		qtrnumbers=quarters)
+
+	# Write out all light curve info to a file
+	# the format follows the outfile extension: .txt, .npz, .h5, or .fits
+	if outfile is not None:
+		with profile.stage('output', rows_in=len(time_all_sap)) as record:
+			write_lc(outfile, columns)
+			record['rows_out'] = len(time_all_sap)
+	result['profile'] = profile.to_dict()
+	return result
+
+# Add a light curve from make_lightcurve to the store, indexed by KIC and quarter
+def store_lightcurve(result, store):
+	LCStore(store, mode='a').append(result['kic'], [result[name] for name in LC_COLUMNS],
+		LC_COLUMNS, quarters=result['quarters'])
 
 # Make a plot!
-## normalizations if you want to plot fluxes & model on same scale
-#nrm1 = len(str(int(np.nanmax(flux_all_sap))))-1
-#flux_all_cbv_plot = flux_all_cbv / np.power(10, nrm1) - 0.5
-#flux_all_sap_plot = flux_all_sap / np.power(10, nrm1)
-#model_all_plot = model_all / np.median(model_all)
-#model_all_plot_mag = -2.5*np.log10(model_all+10) + (kepmag - np.median(-2.5*np.log10(model_all+10)))
-##
-# actually plot stuff already (in magnitudes)
-plt.axis(plotaxes)
-plt.plot(time_all_cbv, mag_all_cbv-0.2, color='k', linestyle='None', marker='.', label='CBV mag (offset)')
-plt.plot(time_all_sap, mag_all_sap, color='r', linestyle='None', marker='.', label='SAP mag') 
-#plt.plot(time_all_cbv, model_all_plot_mag-0.25, color='b', linestyle='None', marker='.', label='CBV model')
-plt.vlines(qtrstart, 0, 10, colors='k', linestyles='dotted')
-plt.xlabel('Time (BJD $-$ 2454833)')
-plt.ylabel('Kepler Magnitude')
-plt.legend(loc=3, numpoints=1)
-
-plt.show()
\ No newline at end of file
+def plot_lightcurve(result, plotaxes=plotaxes):
+	import matplotlib.pyplot as plt
+	## normalizations if you want to plot fluxes & model on same scale
+	#nrm1 = len(str(int(np.nanmax(result['sap_flux']))))-1
+	#flux_all_cbv_plot = result['cbv_flux'] / np.power(10, nrm1) - 0.5
+	#flux_all_sap_plot = result['sap_flux'] / np.power(10, nrm1)
+	#model_all_plot = result['cbv_model'] / np.median(result['cbv_model'])
+	#model_all_plot_mag = -2.5*np.log10(result['cbv_model']+10) + (result['kepmag'] - np.median(-2.5*np.log10(result['cbv_model']+10)))
+	##
+	# actually plot stuff already (in magnitudes)
+	plt.axis(plotaxes)
+	# (decimated to the screen resolution, see decimate.py; eclipse minima are kept exactly)
+	plot_decimated(plt.gca(), result['time'], result['cbv_mag']-0.2, color='k', linestyle='None', marker='.', label='CBV mag (offset)')
+	plot_decimated(plt.gca(), result['time'], result['sap_mag'], color='r', linestyle='None', marker='.', label='SAP mag') 
+	#plt.plot(result['time'], model_all_plot_mag-0.25, color='b', linestyle='None', marker='.', label='CBV model')
+	plt.vlines(result['qtrstart'], 0, 10, colors='k', linestyles='dotted')
+	plt.xlabel('Time (BJD $-$ 2454833)')
+	plt.ylabel('Kepler Magnitude')
+	plt.legend(loc=3, numpoints=1)
+	plt.show()
+
+# Batch worker: process one target, and never let an error escape
+# (a single bad KIC shouldn't take the whole batch down with it)
+# returns (kic, error message or None, light curve or None, stage profile)
+def run_target(args):
+	kic, options = args
+	profile = StageProfile(kic)
+	try:
+		result = make_lightcurve(kic, homedir=options['homedir'], cbvdir=options['cbvdir'],
+			maskfile=options['maskfile'], outfile=options['outfile'].format(kic=kic),
+			pyke=options['pyke'], source=options['source'], cachedir=options['cachedir'],
+			cadence=options['cadence'], binning=options['binning'],
+			detrend_method=options['detrend_method'], detrend_window=options['detrend_window'],
+			quality_flags=options['quality_flags'], quality_action=options['quality_action'],
+			outlier_sigma=options['outlier_sigma'], outlier_window=options['outlier_window'],
+			outlier_action=options['outlier_action'], eclipses=(options.get('eclipses') or {}).get(kic),
+			profile=profile)
+	except Exception as e:
+		return kic, '{0}: {1}'.format(type(e).__name__, e), None, profile.to_dict()
+	if options['store'] is None:
+		result = None # don't ship the arrays back to the main process for nothing
+	return kic, None, result, profile.to_dict()
+
+# Process many targets across a pool of 'processes' worker processes
+# outfile must contain '{kic}' so every target gets its own file
+# light curves are added to the store (if any) by this process only, one at a time
+# eclipses: a dictionary of make_lightcurve 'eclipses' settings keyed by KIC (a KIC
+# that isn't in it uses its mask file)
+# profile: a directory for each target's stage profile (profile_{kic}.json, even if it
+# failed partway) and the summary of the whole batch (profile_batch.json)
+# returns a list of (kic, error message) for the targets that failed
+def run_batch(kics, processes=None, outfile='makelc_out_{kic}.txt', store=None,
+	homedir=homedir, cbvdir=cbvdir, maskfile=maskfile, failfile=failfile, pyke=pyke,
+	source=source, cachedir=cachedir, cadence=cadence, binning=binning,
+	detrend_method=detrend_method, detrend_window=detrend_window, quality_flags=quality_flags,
+	quality_action=quality_action, outlier_sigma=outlier_sigma, outlier_window=outlier_window,
+	outlier_action=outlier_action, eclipses=None, profile=profile):
+	if '{kic}' not in outfile:
+		raise ValueError("outfile must contain '{kic}' in batch mode, or every target overwrites it")
+	options = dict(homedir=homedir, cbvdir=cbvdir, maskfile=maskfile, outfile=outfile, store=store,
+		pyke=pyke, source=source, cachedir=cachedir, cadence=cadence, binning=binning,
+		detrend_method=detrend_method, detrend_window=detrend_window, quality_flags=quality_flags,
+		quality_action=quality_action, outlier_sigma=outlier_sigma, outlier_window=outlier_window,
+		outlier_action=outlier_action, eclipses=eclipses)
+	jobs = [(kic, options) for kic in kics]
+	failures, profiles = [], []
+	if processes == 1:
+		results = map(run_target, jobs)
+		pool = None
+	else:
+		pool = multiprocessing.Pool(processes)
+		results = pool.imap_unordered(run_target, jobs)
+	try:
+		for ndone, (kic, error, result, stages) in enumerate(results):
+			profiles.append(stages)
+			if profile is not None:
+				write_json(os.path.join(profile, 'profile_{0}.json'.format(kic)), stages)
+			if error is None:
+				if store is not None:
+					store_lightcurve(result, store)
+				print('[{0}/{1}] KIC {2} done'.format(ndone+1, len(jobs), kic))
+			else:
+				failures.append((kic, error))
+				print('[{0}/{1}] KIC {2} FAILED ({3})'.format(ndone+1, len(jobs), kic, error))
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	if failures and failfile:
+		with open(failfile, 'w') as f:
+			for kic, error in failures:
+				print(kic, error, file=f)
+		print('{0} of {1} targets failed, see {2}'.format(len(failures), len(jobs), failfile))
+	if profile is not None and profiles:
+		summary = aggregate_profiles(profiles)
+		write_json(os.path.join(profile, 'profile_batch.json'), summary)
+		print(format_profile(summary))
+	return failures
+
+# Read KIC numbers from a text file, one per line ('#' starts a comment)
+def read_kic_list(filename):
+	kics = []
+	with open(filename) as f:
+		for line in f:
+			line = line.split('#')[0].strip()
+			if line:
+				kics.append(line.split()[0].split(',')[0])
+	return kics
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Make friendly light curves from Kepler data.')
+	parser.add_argument('kics', nargs='*', help='KIC number(s) to process (default: ' + KIC + ')')
+	parser.add_argument('--kic-file', help='text file with one KIC per line')
+	parser.add_argument('--all', action='store_true', help='process every target in the catalog')
+	parser.add_argument('--catalog', default=catalog, help='target catalog (default: targets.csv)')
+	parser.add_argument('--mask-eclipses', action='store_true',
+		help='mask the eclipses from the catalog ephemeris instead of mask files')
+	parser.add_argument('--processes', type=int, default=None,
+		help='number of worker processes for a batch (default: one per core)')
+	parser.add_argument('--outfile', default=None,
+		help="output file; in batch mode '{kic}' is replaced by the KIC (default: " + outfile + 
+		" for one target, makelc_out_{kic}.txt for a batch)")
+	parser.add_argument('--store', default=store, help='also add targets to this light curve store')
+	parser.add_argument('--homedir', default=homedir, help='directory that contains .kplr/')
+	parser.add_argument('--cbvdir', default=cbvdir, help='directory with the CBV files')
+	parser.add_argument('--maskfile', default=maskfile, help='mask filename in each target directory')
+	parser.add_argument('--failfile', default=failfile, help='where to list targets that failed')
+	parser.add_argument('--source', default=source,
+		help="'kplr' for MAST, or a directory of local kplr*_llc/slc.fits files (no network)")
+	parser.add_argument('--cache', dest='cachedir', default=cachedir,
+		help='directory to cache each processing stage in (only changed stages are rerun)')
+	parser.add_argument('--short-cadence', dest='cadence', action='store_const', const='short',
+		default=cadence, help='use the short cadence (1-minute) light curves')
+	parser.add_argument('--bin', dest='binning', type=int, default=binning,
+		help='bin this many cadences together (e.g. 30: short cadence -> long cadence)')
+	parser.add_argument('--detrend', dest='detrend_method', default=detrend_method,
+		choices=['poly', 'spline', 'median'], help='how to remove the long-term trend')
+	parser.add_argument('--detrend-window', type=float, default=detrend_window,
+		help="knot spacing ('spline') or window ('median') in days")
+	parser.add_argument('--quality', dest='quality_flags', default=quality_flags,
+		help="SAP_QUALITY bits to remove: 'default', 'none', an integer, or names like desat,cosmic")
+	parser.add_argument('--flag-only', dest='quality_action', action='store_const', const='flag',
+		default=quality_action, help="keep bad-quality cadences (only flag them)")
+	parser.add_argument('--outlier-sigma', type=float, default=outlier_sigma,
+		help="outliers are this many robust sigmas from a sliding median (0 = don't look)")
+	parser.add_argument('--outlier-window', type=float, default=outlier_window,
+		help='width of the outlier sliding median, in days')
+	parser.add_argument('--drop-outliers', dest='outlier_action', action='store_const',
+		const='drop', default=outlier_action, help='remove the outliers (instead of only flagging them)')
+	parser.add_argument('--flag-outliers', dest='outlier_action', action='store_const',
+		const='flag', help='keep the outliers and only flag them (the default)')
+	parser.add_argument('--pyke', action='store_true', default=pyke,
+		help='cotrend with the PyRAF kepcotrend task instead of cbv.py')
+	parser.add_argument('--profile', default=profile,
+		help='directory to write the time, rows and memory of every stage to (JSON)')
+	parser.add_argument('--headless', action='store_true', help="don't make a plot")
+	args = parser.parse_args(argv)
+
+	kics = list(args.kics)
+	if args.kic_file:
+		kics += read_kic_list(args.kic_file)
+	if args.all:
+		kics += [kic for kic in catalog_kics(args.catalog) if kic not in kics]
+	# eclipses from the catalog, for the targets that are in it
+	catalog_eclipses = {}
+	if args.mask_eclipses:
+		for kic in (kics or [KIC]):
+			try:
+				catalog_eclipses[kic] = target_eclipses(get_target(kic, args.catalog))
+			except KeyError:
+				print('KIC {0} is not in the catalog, so its mask file is used'.format(kic))
+	if len(kics) <= 1: # just one star, the classic way
+		kic = kics[0] if kics else KIC
+		result = make_lightcurve(kic, homedir=args.homedir, cbvdir=args.cbvdir,
+			maskfile=args.maskfile, outfile=(args.outfile or outfile).format(kic=kic), pyke=args.pyke,
+			source=args.source, cachedir=args.cachedir, cadence=args.cadence, binning=args.binning,
+			detrend_method=args.detrend_method, detrend_window=args.detrend_window,
+			quality_flags=args.quality_flags, quality_action=args.quality_action,
+			outlier_sigma=args.outlier_sigma, outlier_window=args.outlier_window,
+			outlier_action=args.outlier_action, eclipses=catalog_eclipses.get(kic))
+		print(format_tally(result['qtrnumbers'], result['quality_tally'],
+			quality_bitmask(args.quality_flags)))
+		if args.profile is not None:
+			write_json(os.path.join(args.profile, 'profile_{0}.json'.format(kic)), result['profile'])
+			print(format_profile(result['profile']))
+		if args.store is not None:
+			store_lightcurve(result, args.store)
+		if not args.headless:
+			plot_lightcurve(result)
+		return 0
+	if args.outfile is not None and '{kic}' not in args.outfile:
+		parser.error("--outfile must contain '{kic}' when processing more than one target")
+	failures = run_batch(kics, processes=args.processes,
+		outfile=args.outfile or 'makelc_out_{kic}.txt', store=args.store,
+		homedir=args.homedir, cbvdir=args.cbvdir, maskfile=args.maskfile, failfile=args.failfile,
+		pyke=args.pyke, source=args.source, cachedir=args.cachedir, cadence=args.cadence,
+		binning=args.binning, detrend_method=args.detrend_method, detrend_window=args.detrend_window,
+		quality_flags=args.quality_flags, quality_action=args.quality_action,
+		outlier_sigma=args.outlier_sigma, outlier_window=args.outlier_window,
+		outlier_action=args.outlier_action, eclipses=catalog_eclipses, profile=args.profile)
+	return 1 if failures else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,60 @@
+import numpy as np
+from lc_functions import in_mask
+from detrend import as_columns, segment_ranges, sliding_median, window_points
+'''
+Find the artifacts and blips that are left in a light curve after detrending.
+Use this with 'makelc.py' (it runs right after the long-term detrending).
+
+A point is an outlier if it is more than nsigma robust standard deviations away from
+a sliding median 'window' days wide. The robust standard deviation is 1.4826 times
+the sliding median absolute deviation (MAD) from that median, so a few blips can't
+inflate it the way they would a plain standard deviation. Both sliding medians are
+done with the two-heap window in detrend.py (O(n log w)), separately in
+each quarter, so a few million short cadence points take seconds.
+
+Real eclipses are never clipped:
+- masked times (e.g., the eclipses in mask_kepcotrend.txt) are left out of the
+  medians and are never outliers
+- runs of more than maxrun outliers in a row are kept, because a blip is one or two
+  cadences long and an eclipse isn't (this protects eclipses that aren't masked)
+
+find_outliers returns a boolean array (True = outlier) instead of copies of the data,
+so you can drop the points, flag them, or just look at them.
+'''
+
+# True for every point that is part of a run of more than maxrun True values in a row
+def long_runs(flags, maxrun):
+	edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+	starts = np.nonzero(edges == 1)[0]
+	stops = np.nonzero(edges == -1)[0]
+	runs = np.zeros(len(flags) + 1, dtype=np.int64)
+	toolong = stops - starts > maxrun
+	np.add.at(runs, starts[toolong], 1)
+	np.add.at(runs, stops[toolong], -1)
+	return np.cumsum(runs[:-1]) > 0
+
+# Find outliers in one flux array, or a list of them on the same time stamps (e.g.,
+# [flux_cbv, flux_sap]); a point is an outlier if it is one in ANY of them
+# times must be sorted; breaks are the times where a new quarter (or month) starts
+# window is in days; maxrun=None keeps nothing (every outlier counts)
+# returns a boolean array, True = outlier
+def find_outliers(t, fluxes, window=0.5, nsigma=5.0, breaks=None, mstart=[], mend=[], maxrun=3):
+	t = np.asarray(t, dtype=np.float64)
+	columns, unpack = as_columns(fluxes)
+	masked = in_mask(t, mstart, mend)
+	outliers = np.zeros(len(t), dtype=bool)
+	for start, stop in segment_ranges(t, breaks):
+		width = window_points(t[start:stop], window)
+		segmask = masked[start:stop]
+		if segmask.all():
+			continue
+		for j in range(0, columns.shape[1]):
+			y = columns[start:stop, j]
+			resid = y - sliding_median(y, width, segmask)
+			sigma = 1.4826 * sliding_median(np.abs(resid), width, segmask)
+			with np.errstate(invalid='ignore'):
+				outliers[start:stop] |= np.abs(resid) > nsigma * sigma
+	outliers &= ~masked
+	if maxrun is not None:
+		outliers &= ~long_runs(outliers, maxrun)
+	return outliers
@@ -0,0 +1,292 @@
+from __future__ import print_function
+import sys
+import argparse
+import multiprocessing
+import numpy as np
+from lc_functions import read_lc
+'''
+Find (or refine) the period and primary eclipse time BJD0 of an eclipsing binary,
+straight from the light curve that 'makelc.py' writes.
+
+This is a Box Least Squares (BLS) search: for every trial period the light curve is
+folded and binned in phase (one vectorized pass over the points), and the deepest
+box-shaped dip, over a range of eclipse durations, is found from running sums over
+the bins for a whole chunk of trial periods at once. Chunks are sized so they never
+use more than about 'maxelements' array elements, and are spread over a pool of
+processes. On one core, ~70,000 long cadence points take about 0.4 ms per trial
+period, so the number of trial periods is what matters: the search is done on a coarse
+grid first and only the best peaks get the full grid, and no eclipse is assumed to be
+shorter than a couple of cadences, which thins out the grid at short periods.
+The best period is zoomed in on with finer grids, and then sharpened with the primary
+eclipses themselves (a box can't tell where the middle of a V-shaped eclipse is): each
+one is timed against the folded eclipse, and a straight line through those times
+gives the period and BJD0.
+
+    python periodsearch.py makelc_out.txt --period 171.28 --bjd0 2455170.51
+refines a period and BJD0 you already have (e.g., from the settings in 'lcplotter.py'),
+by searching within +/- 1% of the period and then zooming in.
+    python periodsearch.py makelc_out.txt --pmin 1 --pmax 300 --processes 8
+searches blindly. If the primary and secondary eclipses look alike, BLS may find
+half the true period, so check the result!
+
+Times are in Kepler time (BJD - 2454833), like the 'makelc.py' output; BJD0 goes in
+and comes out as a full BJD.
+'''
+
+# Trial frequencies (1/days) for periods from pmin to pmax, close enough together that
+# an eclipse qmin (in phase) long can't drift more than 1/oversample of its own length
+# over the whole time span. No eclipse is shorter than 'mindur' days either (a couple of
+# cadences, say), so at short periods, where mindur is more than qmin of the period,
+# the grid gets coarser: evenly spaced in frequency up to f = qmin/mindur, and evenly
+# spaced in log(frequency) above that.
+def frequency_grid(tspan, pmin, pmax, qmin=0.005, oversample=3, mindur=0.0):
+	fmin, fmax = 1.0/pmax, 1.0/pmin
+	fbreak = qmin / mindur if mindur > 0 else fmax
+	df = qmin / (tspan * oversample)
+	nfreq = int(np.ceil((min(fbreak, fmax) - fmin) / df)) + 1
+	freqs = np.linspace(fmin, max(min(fbreak, fmax), fmin), max(nfreq, 2))
+	if fbreak < fmax:
+		ratio = 1 + mindur / (tspan * oversample)
+		nfreq = int(np.ceil(np.log(fmax / fbreak) / np.log(ratio))) + 1
+		freqs = np.concatenate((freqs[:-1], np.geomspace(fbreak, fmax, max(nfreq, 2))))
+	return freqs
+
+# The spacing of that grid at frequency f
+def frequency_step(f, tspan, qmin=0.005, oversample=3, mindur=0.0):
+	return max(qmin, mindur*f) / (tspan * oversample)
+
+# eclipse durations (in phase) to try: about 8 from qmin to qmax, spaced by factors of ~1.5
+def duration_grid(qmin=0.005, qmax=0.1):
+	return np.geomspace(qmin, qmax, max(int(np.ceil(np.log(qmax/qmin) / np.log(1.5))) + 1, 2))
+
+# The BLS search for one chunk of trial frequencies
+# t: times minus a reference time; y: relative flux minus its weighted mean (dips < 0)
+# w: weights that add up to 1; nbins: number of phase bins; dbins: box widths in bins
+# returns, for each frequency: power, depth, box start (phase), box width (phase)
+def bls_chunk(t, y, w, freqs, nbins, dbins):
+	nfreq = len(freqs)
+	# fold and bin: one pass over the points per frequency (times are positive, so
+	# the integer part of t*f*nbins, mod nbins, is the phase bin), then the boxes for
+	# every frequency in the chunk are searched all at once
+	# (folding a whole block of frequencies with one bincount isn't any faster: the
+	# bincounts are the work either way; 32-bit bins are, when they fit)
+	tbins = t * nbins
+	wy = w * y
+	itype = np.int32 if tbins.max() * freqs.max() < 2**31 - 1 else np.int64
+	sumw = np.empty((nfreq, nbins))
+	sumwy = np.empty((nfreq, nbins))
+	for i in range(0, nfreq):
+		bins = (tbins * freqs[i]).astype(itype)
+		bins %= nbins
+		sumw[i] = np.bincount(bins, w, minlength=nbins)
+		sumwy[i] = np.bincount(bins, wy, minlength=nbins)
+	# running sums, wrapped around in phase so boxes can straddle phase 0
+	dmax = max(dbins)
+	cumw = np.zeros((nfreq, nbins + dmax + 1))
+	cumwy = np.zeros((nfreq, nbins + dmax + 1))
+	np.cumsum(np.concatenate((sumw, sumw[:, :dmax]), axis=1), axis=1, out=cumw[:, 1:])
+	np.cumsum(np.concatenate((sumwy, sumwy[:, :dmax]), axis=1), axis=1, out=cumwy[:, 1:])
+	power = np.zeros(nfreq)
+	depth = np.zeros(nfreq)
+	start = np.zeros(nfreq)
+	width = np.zeros(nfreq)
+	rows = np.arange(nfreq)
+	for d in dbins:
+		r = cumw[:, d:d+nbins] - cumw[:, :nbins] # weight in each box
+		s = cumwy[:, d:d+nbins] - cumwy[:, :nbins] # weighted flux in each box
+		with np.errstate(divide='ignore', invalid='ignore'):
+			sr = np.where((s < 0) & (r > 0) & (r < 1), s*s / (r*(1 - r)), 0.0)
+		best = np.argmax(sr, axis=1)
+		better = sr[rows, best] > power
+		power[better] = sr[rows, best][better]
+		rb, sb = r[rows, best][better], s[rows, best][better]
+		depth[better] = -sb / (rb*(1 - rb))
+		start[better] = best[better] / float(nbins)
+		width[better] = d / float(nbins)
+	return power, depth, start, width
+
+# the light curve, shared with every worker process once instead of with every chunk
+shared = {}
+def init_worker(t, y, w):
+	shared.update(t=t, y=y, w=w)
+
+def bls_worker(args):
+	freqs, nbins, dbins = args
+	return bls_chunk(shared['t'], shared['y'], shared['w'], freqs, nbins, dbins)
+
+# relative flux (dips are negative), weights, and reference time, ready for bls_chunk
+# flux can also be magnitudes (mags=True)
+def prepare(t, flux, ferr=None, mags=False):
+	t = np.asarray(t, dtype=np.float64)
+	flux = np.asarray(flux, dtype=np.float64)
+	good = np.isfinite(t) & np.isfinite(flux)
+	if ferr is not None:
+		ferr = np.asarray(ferr, dtype=np.float64)
+		good &= np.isfinite(ferr) & (ferr > 0)
+	t, flux = t[good], flux[good]
+	if mags:
+		flux = 10**(-0.4*(flux - np.median(flux)))
+		if ferr is not None:
+			ferr = ferr[good] * flux / 1.0857
+	elif ferr is not None:
+		ferr = ferr[good]
+	y = flux / np.median(flux) - 1
+	w = np.ones(len(t)) if ferr is None else (np.median(flux) / ferr)**2
+	w /= w.sum()
+	y -= np.dot(w, y)
+	tref = t.min()
+	return t - tref, y, w, tref
+
+# BLS power for every trial frequency (1/days)
+# nbins: phase bins; durations: eclipse lengths to try, as fractions of the period
+# maxelements: rough memory limit per chunk (frequencies x phase bins, 8 bytes each)
+# processes: worker processes (None = one per core, 1 = don't start any)
+# returns a dictionary with freqs, periods, power, depth, and the phase start and width
+# of the best box at each frequency (phase 0 = the reference time tref)
+def bls_search(t, y, w, freqs, nbins=1000, durations=None, maxelements=1000000, processes=1):
+	if durations is None:
+		durations = duration_grid()
+	dbins = sorted(set(max(int(round(q * nbins)), 1) for q in durations))
+	chunksize = max(int(maxelements // nbins), 1)
+	jobs = [(freqs[i:i+chunksize], nbins, dbins) for i in range(0, len(freqs), chunksize)]
+	if processes == 1 or len(jobs) == 1:
+		init_worker(t, y, w)
+		results = [bls_worker(job) for job in jobs]
+	else:
+		pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(t, y, w))
+		try:
+			results = pool.map(bls_worker, jobs)
+		finally:
+			pool.close()
+			pool.join()
+	power, depth, start, width = [np.concatenate(col) for col in zip(*results)]
+	return dict(freqs=freqs, periods=1.0/freqs, power=power, depth=depth, start=start, width=width)
+
+# The best period in a search result, with the middle of its box as the primary eclipse
+# time (moved to the eclipse closest to 'near', in the same units as tref + t)
+def best_ephemeris(result, tref, near=None):
+	i = np.argmax(result['power'])
+	period = result['periods'][i]
+	T0 = tref + (result['start'][i] + 0.5*result['width'][i]) * period
+	if near is not None:
+		T0 += np.round((near - T0) / period) * period
+	return dict(period=period, T0=T0, duration=result['width'][i]*period,
+		depth=result['depth'][i], power=result['power'][i])
+
+# Sharpen a BLS period and T0 using only the points in and around the primary eclipses.
+# A box fits equally well anywhere inside a V-shaped eclipse, so the BLS answer can be
+# off by a fraction of the eclipse duration. Instead, every primary eclipse is timed
+# against the folded eclipse shape (template timing, see eclipsetiming.py) and a
+# straight line through the eclipse times gives the period and T0 together (with the
+# cycles counted from the middle of the light curve, so the two don't trade off).
+# The eclipses are then folded again with the new ephemeris, niter times.
+def polish(t, y, w, period, T0, duration, minpoints=10, niter=3):
+	# (eclipsetiming imports this module, so it can't be imported at the top)
+	from eclipsetiming import eclipse_points, select_eclipses, baseline_levels, time_eclipses
+	halfwidth = 1.5*duration
+	for k in range(0, niter):
+		cycles, offset, near = eclipse_points(t, period, T0, 0.0, halfwidth)
+		ecl, ids, npts, keep = select_eclipses(cycles, offset, minpoints)
+		if len(ecl) < 2:
+			break
+		level = baseline_levels(t, y, w, period, T0, 0.0, halfwidth, ecl)
+		shift, err, rms = time_eclipses(ids, len(ecl), offset[keep], y[near][keep], w[near][keep],
+			halfwidth, level=level)
+		good = np.isfinite(shift) & np.isfinite(err) & (err > 0)
+		if good.sum() < 2:
+			break
+		# weighted straight line through the eclipse times: T0 + n*period
+		n, times, weight = ecl[good], (T0 + ecl*period + shift)[good], 1 / err[good]**2
+		nmid = np.dot(weight, n) / weight.sum()
+		tmid = np.dot(weight, times) / weight.sum()
+		period = np.dot(weight, (n - nmid) * (times - tmid)) / np.dot(weight, (n - nmid)**2)
+		T0 = tmid - nmid*period
+	return period, T0
+
+# The 'npeaks' highest local maxima of a search result (indices, best first)
+def power_peaks(power, npeaks=5):
+	peak = np.ones(len(power), dtype=bool)
+	peak[1:] &= power[1:] >= power[:-1]
+	peak[:-1] &= power[:-1] >= power[1:]
+	index = np.nonzero(peak)[0]
+	return index[np.argsort(-power[index])][:npeaks]
+
+# Search periods from pmin to pmax (days): first on a coarse grid (oversample=1, where an
+# eclipse can drift by its own length between trial periods, which smears it but doesn't
+# hide it), then on the full grid around the 'npeaks' best peaks of that. Then zoom in on
+# the best one 'nzoom' times, each time searching a 10x narrower range with 2x more phase
+# bins, and finally sharpen the period and BJD0 with the eclipses themselves (see polish)
+# mindur: the shortest eclipse to look for, in days (None = two cadences)
+# times in Kepler time; returns dict(period, BJD0, duration (days), depth, power)
+def find_period(t, flux, ferr=None, pmin=1.0, pmax=300.0, mags=False, nbins=1000, qmin=0.005,
+	qmax=0.1, oversample=3, nzoom=3, npeaks=5, mindur=None, processes=None, maxelements=1000000,
+	BJD0=None):
+	t, y, w, tref = prepare(t, flux, ferr, mags)
+	tspan = t.max()
+	if mindur is None:
+		mindur = 2 * np.median(np.diff(np.sort(t)))
+	near = None if BJD0 is None else BJD0 - 2454833
+	durations = duration_grid(qmin, qmax)
+	coarse = frequency_grid(tspan, pmin, pmax, qmin, 1, mindur)
+	result = bls_search(t, y, w, coarse, nbins, durations, maxelements, processes)
+	fine = []
+	for i in power_peaks(result['power'], npeaks):
+		step = frequency_step(coarse[i], tspan, qmin, 1, mindur)
+		fine.append(np.linspace(coarse[i] - step, coarse[i] + step, 2*oversample + 1))
+	freqs = np.unique(np.concatenate(fine))
+	freqs = freqs[(freqs >= coarse[0]) & (freqs <= coarse[-1])]
+	result = bls_search(t, y, w, freqs, nbins, durations, maxelements, processes)
+	best = best_ephemeris(result, tref, near)
+	step = frequency_step(1.0 / best['period'], tspan, qmin, oversample, mindur)
+	for i in range(0, nzoom):
+		# +/- 5 grid steps around the best frequency, on a 10x finer grid
+		f0 = 1.0 / best['period']
+		freqs = np.linspace(f0 - 5*step, f0 + 5*step, 101)
+		step = freqs[1] - freqs[0]
+		nbins = min(2*nbins, 20000)
+		# only durations near the one we found are worth trying again
+		q = best['duration'] / best['period']
+		result = bls_search(t, y, w, freqs, nbins, [q/1.5, q, q*1.5], maxelements, processes)
+		best = best_ephemeris(result, tref, near)
+	period, T0 = polish(t, y, w, best['period'], best['T0'] - tref, best['duration'])
+	if near is not None:
+		T0 += np.round((near - tref - T0) / period) * period
+	best.update(period=period, BJD0=T0 + tref + 2454833)
+	del best['T0']
+	return best
+
+# Refine a period and BJD0 you already have: search within +/- window*period
+def refine_ephemeris(t, flux, period, BJD0, ferr=None, window=0.01, **kwargs):
+	return find_period(t, flux, ferr, pmin=period*(1 - window), pmax=period*(1 + window),
+		BJD0=BJD0, **kwargs)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Find or refine the period and BJD0 of an EB.')
+	parser.add_argument('infile', help="light curve file (or store directory) from 'makelc.py'")
+	parser.add_argument('--kic', help='KIC number (needed for a light curve store)')
+	parser.add_argument('--columns', type=int, nargs=3, default=[0, 5, 2], metavar=('TIME', 'FLUX', 'ERR'),
+		help="columns to use (default: time, CBV flux, flux err from 'makelc.py')")
+	parser.add_argument('--mags', action='store_true', help='the flux column is in magnitudes')
+	parser.add_argument('--period', type=float, help='period to refine (days)')
+	parser.add_argument('--bjd0', type=float, help='BJD of a primary eclipse to refine')
+	parser.add_argument('--window', type=float, default=0.01,
+		help='with --period, search within +/- this fraction of it')
+	parser.add_argument('--pmin', type=float, default=1.0, help='shortest period to search (days)')
+	parser.add_argument('--pmax', type=float, default=300.0, help='longest period to search (days)')
+	parser.add_argument('--processes', type=int, default=None,
+		help='number of worker processes (default: one per core)')
+	args = parser.parse_args(argv)
+
+	t, flux, ferr = read_lc(args.infile, usecols=tuple(args.columns), kic=args.kic)
+	if args.period is not None:
+		best = refine_ephemeris(t, flux, args.period, args.bjd0, ferr, window=args.window,
+			mags=args.mags, processes=args.processes)
+	else:
+		best = find_period(t, flux, ferr, args.pmin, args.pmax, mags=args.mags,
+			processes=args.processes, BJD0=args.bjd0)
+	print('period = {0:.6f}; BJD0 = {1:.6f} # duration {2:.3f} d, depth {3:.4f}'.format(
+		best['period'], best['BJD0'], best['duration'], best['depth']))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
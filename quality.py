@@ -0,0 +1,91 @@
+import numpy as np
+'''
+Kepler data quality flags (the SAP_QUALITY column), for 'makelc.py'.
+
+Every cadence has an integer of bit flags saying what was going on at the time
+(thruster firings, safe modes, cosmic rays, ...). A bitmask picks which bits you
+don't trust: any cadence with one of those bits set is 'bad'.
+    quality_bitmask('default')            -> the spacecraft events below (175)
+    quality_bitmask(['desat', 'cosmic'])  -> build one from names
+    quality_bitmask(0)                    -> keep everything
+quality_mask(quality, bitmask) says which cadences are bad, all at once, and
+quality_tally(quality) counts how many cadences have each bit set.
+
+The bits are described in the Kepler Archive Manual:
+https://archive.stsci.edu/kepler/manuals/archive_manual.pdf
+'''
+
+# (bit value, short name, what it means)
+QUALITY_FLAGS = [
+	(1, 'tweak', 'attitude tweak'),
+	(2, 'safemode', 'safe mode'),
+	(4, 'coarse', 'coarse point'),
+	(8, 'earth', 'earth point'),
+	(16, 'argabright', 'Argabrightening event'),
+	(32, 'desat', 'reaction wheel desaturation'),
+	(64, 'cosmic', 'cosmic ray in optimal aperture'),
+	(128, 'manual', 'manual exclude'),
+	(256, 'discontinuity', 'discontinuity'),
+	(512, 'impulsive', 'impulsive outlier'),
+	(1024, 'collateral', 'cosmic ray in collateral data'),
+	(2048, 'straylight', 'straylight'),
+	(4096, 'straylight2', 'straylight (2)'),
+	(8192, 'planetsearch', 'excluded from planet search'),
+	(16384, 'badcal', 'bad calibration'),
+	(32768, 'fewtargets', 'too few targets for error correction'),
+]
+QUALITY_BITS = np.array([bit for bit, name, description in QUALITY_FLAGS], dtype=np.int64)
+QUALITY_NAMES = [name for bit, name, description in QUALITY_FLAGS]
+
+# the bits that mean the spacecraft wasn't pointing (or calibrating) properly:
+# tweak, safemode, coarse, earth, desat, and manual
+DEFAULT_BITMASK = 1 | 2 | 4 | 8 | 32 | 128
+
+# Turn a bitmask setting into an integer
+# takes an integer, 'default', 'none', 'all', or a list of bit names / values
+def quality_bitmask(flags='default'):
+	if flags is None or flags == 'none':
+		return 0
+	if flags == 'default':
+		return DEFAULT_BITMASK
+	if flags == 'all':
+		return int(np.bitwise_or.reduce(QUALITY_BITS))
+	if isinstance(flags, str):
+		flags = flags.split(',')
+	if not isinstance(flags, (list, tuple)):
+		return int(flags)
+	bitmask = 0
+	for flag in flags:
+		flag = str(flag).strip()
+		if flag.isdigit():
+			bitmask |= int(flag)
+		elif flag in QUALITY_NAMES:
+			bitmask |= int(QUALITY_BITS[QUALITY_NAMES.index(flag)])
+		else:
+			raise ValueError('Unknown quality flag ' + repr(flag) + ' (try one of: ' +
+				', '.join(QUALITY_NAMES) + ')')
+	return bitmask
+
+# Which cadences have any of the bitmask bits set? (True = bad)
+def quality_mask(quality, bitmask=DEFAULT_BITMASK):
+	return (np.asarray(quality, dtype=np.int64) & int(bitmask)) != 0
+
+# How many cadences have each bit set (an array lined up with QUALITY_FLAGS)
+# the distinct flag values are found first, so this is fast even for short cadence
+def quality_tally(quality):
+	values, counts = np.unique(np.asarray(quality, dtype=np.int64), return_counts=True)
+	hasbit = (values[:, np.newaxis] & QUALITY_BITS) != 0
+	return np.dot(counts, hasbit)
+
+# A table of per-quarter tallies (one row per quarter, as from quality_tally)
+# only the bits that show up at all get a column; '*' marks the bits that were removed
+def format_tally(quarters, tallies, bitmask=DEFAULT_BITMASK):
+	tallies = np.atleast_2d(tallies)
+	used = np.nonzero(tallies.sum(axis=0))[0]
+	names = [QUALITY_NAMES[i] + ('*' if QUALITY_BITS[i] & bitmask else '') for i in used]
+	widths = [max(len(name), 6) for name in names]
+	lines = ['quarter ' + ' '.join(name.rjust(w) for name, w in zip(names, widths))]
+	for quarter, tally in zip(quarters, tallies):
+		lines.append(str(quarter).rjust(7) + ' ' +
+			' '.join(str(tally[i]).rjust(w) for i, w in zip(used, widths)))
+	return '\n'.join(lines)
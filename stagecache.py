@@ -0,0 +1,132 @@
+import os
+import hashlib
+import numpy as np
+'''
+A cache for the processing stages in 'makelc.py' (cotrending, NaN deletion, quarter
+normalization, gap alignment, long-term detrending).
+
+Every stage result is saved under a key that is a hash of EVERYTHING that went into
+it: the contents of the input FITS file, the mask, the stage parameters, and the key
+of the stage before it. So if you only change the polynomial order for long_detrend,
+only that stage runs again; if you edit the mask, everything that used the mask runs
+again; and nothing stale is ever reused just because an output file already exists.
+The key also includes the stage's entry in STAGE_VERSIONS, which has to go up by one
+every time the code of that stage changes what it returns (or how); otherwise results
+saved by the old code would still be found under the same key.
+
+Results are dictionaries of arrays (or lists of arrays, one per quarter), and are
+saved as .npz files in the cache directory, one per stage result. Old results are
+never deleted automatically---just delete the directory if it gets too big.
+
+StageCache(None) turns caching off (every stage simply runs).
+'''
+
+# version of every stage in 'makelc.py': bump a stage whenever its code changes
+# (a stage that isn't listed is version 1)
+#   cotrend 2: the cadence numbers are kept, and fitpower=1 fits run to convergence
+#   nandelete 2: SAP_QUALITY is carried through
+#   lineup 2: also returns how many shifts it took ('iterations')
+STAGE_VERSIONS = {
+	'cotrend': 2,
+	'nandelete': 2,
+	'quality': 1,
+	'normalize': 1,
+	'lineup': 2,
+	'detrend': 1,
+	'outliers': 1,
+}
+
+class StageCache(object):
+
+	def __init__(self, directory=None):
+		self.directory = directory
+		if directory is not None and not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	# hash for one stage; parts can be strings, numbers, arrays, lists of those,
+	# or the keys of earlier stages. returns None if caching is off.
+	# the stage's version (see STAGE_VERSIONS) always goes in, too
+	def key(self, stage, *parts):
+		if self.directory is None:
+			return None
+		sha = hashlib.sha1(stage.encode('utf-8'))
+		update_hash(sha, ('version', STAGE_VERSIONS.get(stage, 1)))
+		for part in parts:
+			update_hash(sha, part)
+		return stage + '_' + sha.hexdigest()
+
+	def filename(self, key):
+		return os.path.join(self.directory, key + '.npz')
+
+	# run func() and save what it returns, unless there is already a saved result
+	# returns (result, key); pass the key on to the next stage
+	def run(self, stage, parts, func):
+		key = self.key(stage, *parts)
+		if key is None:
+			return func(), None
+		if os.path.exists(self.filename(key)):
+			try:
+				return self.load(key), key
+			except Exception: # half-written or corrupted file, just redo it
+				pass
+		result = func()
+		self.save(key, result)
+		return result, key
+
+	def save(self, key, result):
+		arrays = {}
+		for name, value in result.items():
+			if isinstance(value, (list, tuple)): # e.g., one array per quarter
+				arrays['nlist__' + name] = np.array(len(value))
+				for i, arr in enumerate(value):
+					arrays['{0}__{1}'.format(name, i)] = np.asarray(arr)
+			else:
+				arrays[name] = np.asarray(value)
+		# write to a temporary file first so other processes never read half a file
+		tmpfile = self.filename(key) + '.{0}.tmp.npz'.format(os.getpid())
+		np.savez(tmpfile, **arrays)
+		os.rename(tmpfile, self.filename(key))
+
+	def load(self, key):
+		result = {}
+		with np.load(self.filename(key)) as f:
+			names = list(f.keys())
+			for name in names:
+				if name.startswith('nlist__'):
+					listname = name[len('nlist__'):]
+					result[listname] = [f['{0}__{1}'.format(listname, i)] for i in range(int(f[name]))]
+			for name in names:
+				if '__' not in name:
+					value = f[name]
+					result[name] = value[()] if value.ndim == 0 else value
+		return result
+
+# feed one key 'part' into a hashlib object
+def update_hash(sha, part):
+	if isinstance(part, np.ndarray):
+		part = np.ascontiguousarray(part)
+		sha.update(str((part.dtype.str, part.shape)).encode('utf-8'))
+		sha.update(part.tobytes())
+	elif isinstance(part, (list, tuple)):
+		sha.update(('list', len(part)).__repr__().encode('utf-8'))
+		for item in part:
+			update_hash(sha, item)
+	else:
+		sha.update(repr(part).encode('utf-8'))
+	sha.update(b'|')
+
+# content hash of a file (e.g., a light curve FITS file or the mask file)
+# remembered by (path, size, modification time) so each file is read only once
+filehashes = {}
+def file_hash(filename):
+	if not filename or not os.path.exists(filename):
+		return 'nofile'
+	stat = os.stat(filename)
+	memo = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+	if memo not in filehashes:
+		sha = hashlib.sha1()
+		with open(filename, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				sha.update(block)
+		filehashes[memo] = sha.hexdigest()
+	return filehashes[memo]
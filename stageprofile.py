@@ -0,0 +1,147 @@
+from __future__ import print_function
+import os
+import time
+import json
+from contextlib import contextmanager
+'''
+Where does the time go? Per-stage instrumentation for 'makelc.py'.
+
+make_lightcurve records every stage (finding/downloading the light curve files,
+cotrending, NaN deletion, quality flags, normalization, gap alignment, detrending,
+outlier removal, and writing the output) in a StageProfile:
+- wall time
+- rows (cadences) going in and coming out
+- memory: the resident set size (RSS) after the stage, and the peak RSS of the process
+  so far (batch workers handle many targets, so the peak is 'so far in this worker')
+- iterations, where it means something (e.g., lineup_qtr_gaps passes, for both the SAP
+  and CBV light curves together; cotrend segments)
+- runs: how many times the stage's work was actually done (0 = it all came out of the
+  stage cache; cotrending is done once per quarter or month)
+As JSON, one file per target:
+    python makelc.py 9246715 --profile profiles/
+and, for a batch, also profiles/profile_batch.json, with the totals, means and maxima
+of every stage over all the targets and the slowest targets (aggregate_profiles).
+'''
+
+# peak resident memory of this process so far, in MB (None if we can't tell)
+def peak_rss():
+	try:
+		import resource
+	except ImportError: # Windows
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return peak / (2.**20 if os.uname()[0] == 'Darwin' else 2.**10)
+
+# current resident memory of this process, in MB (None if we can't tell; Linux only)
+def current_rss():
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2.**20
+	except (IOError, OSError, ValueError, IndexError, AttributeError):
+		return None
+
+# number of rows in an array, or in a list of arrays (one per quarter)
+def count_rows(data):
+	if isinstance(data, (list, tuple)):
+		return int(sum(len(part) for part in data))
+	return int(len(data))
+
+class StageProfile(object):
+
+	def __init__(self, kic=None):
+		self.kic = None if kic is None else str(kic)
+		self.stages = []
+		self.start = time.time()
+
+	# Time one stage: 'with profile.stage('lineup', rows_in=n) as record:'
+	# fill in record['rows_out'] and record['iterations'] inside, and wrap the function
+	# a StageCache runs with profile.ran(record, func) to count the times it wasn't cached
+	@contextmanager
+	def stage(self, name, rows_in=None):
+		record = dict(stage=name, rows_in=rows_in, rows_out=None, iterations=None, runs=None)
+		start = time.time()
+		try:
+			yield record
+		finally:
+			record['time'] = time.time() - start
+			record['rss_mb'] = current_rss()
+			record['peak_rss_mb'] = peak_rss()
+			self.stages.append(record)
+
+	# func, but counting in record['runs'] how many times it is actually called
+	def ran(self, record, func):
+		if record['runs'] is None:
+			record['runs'] = 0
+		def wrapped():
+			record['runs'] += 1
+			return func()
+		return wrapped
+
+	def to_dict(self):
+		return dict(kic=self.kic, total=time.time() - self.start, peak_rss_mb=peak_rss(),
+			stages=list(self.stages))
+
+	def write(self, filename):
+		write_json(filename, self.to_dict())
+
+def write_json(filename, data):
+	directory = os.path.dirname(filename)
+	if directory and not os.path.isdir(directory):
+		os.makedirs(directory)
+	with open(filename, 'w') as f:
+		json.dump(data, f, indent=1, sort_keys=True)
+
+# Combine the profiles (as from StageProfile.to_dict) of a batch of targets:
+# for each stage, how many targets ran it (and how many came from the cache), the
+# total, mean and max time, the total rows in and out, the total and max iterations,
+# and the max peak RSS; plus the 'nslowest' slowest targets
+def aggregate_profiles(profiles, nslowest=10):
+	stages, order = {}, []
+	for profile in profiles:
+		for record in profile['stages']:
+			name = record['stage']
+			if name not in stages:
+				order.append(name)
+				stages[name] = dict(count=0, cached=0, time_total=0.0, time_max=0.0, rows_in=0,
+					rows_out=0, iterations_total=0, iterations_max=0, peak_rss_mb=None)
+			summary = stages[name]
+			summary['count'] += 1
+			summary['cached'] += 1 if record['runs'] == 0 else 0
+			summary['time_total'] += record['time']
+			summary['time_max'] = max(summary['time_max'], record['time'])
+			summary['rows_in'] += record['rows_in'] or 0
+			summary['rows_out'] += record['rows_out'] or 0
+			summary['iterations_total'] += record['iterations'] or 0
+			summary['iterations_max'] = max(summary['iterations_max'], record['iterations'] or 0)
+			if record['peak_rss_mb'] is not None:
+				summary['peak_rss_mb'] = max(summary['peak_rss_mb'] or 0, record['peak_rss_mb'])
+	for summary in stages.values():
+		summary['time_mean'] = summary['time_total'] / summary['count']
+	total = sum(profile['total'] for profile in profiles)
+	slowest = sorted(profiles, key=lambda profile: -profile['total'])[:nslowest]
+	return dict(ntargets=len(profiles), total=total, stage_order=order, stages=stages,
+		slowest=[(profile['kic'], profile['total']) for profile in slowest])
+
+# A table of one profile (from to_dict) or an aggregate (from aggregate_profiles)
+def format_profile(profile):
+	if 'stage_order' in profile:
+		lines = ['{0} targets, {1:.2f} s in all'.format(profile['ntargets'], profile['total']),
+			'stage          count cached   total s    mean s     max s   rows out  iterations  peak MB']
+		for name in profile['stage_order']:
+			s = profile['stages'][name]
+			lines.append('{0:14s} {1:5d} {2:6d} {3:9.3f} {4:9.3f} {5:9.3f} {6:10d} {7:11d} {8:8s}'.format(
+				name, s['count'], s['cached'], s['time_total'], s['time_mean'], s['time_max'],
+				s['rows_out'], s['iterations_total'],
+				'-' if s['peak_rss_mb'] is None else '{0:8.1f}'.format(s['peak_rss_mb'])))
+		return '\n'.join(lines)
+	lines = ['KIC {0}: {1:.3f} s'.format(profile['kic'], profile['total']),
+		'stage          time s    rows in   rows out  iterations  peak MB  cached']
+	for record in profile['stages']:
+		lines.append('{0:14s} {1:7.3f} {2:10s} {3:10s} {4:11s} {5:8s} {6}'.format(record['stage'],
+			record['time'], '-' if record['rows_in'] is None else str(record['rows_in']),
+			'-' if record['rows_out'] is None else str(record['rows_out']),
+			'-' if record['iterations'] is None else str(record['iterations']),
+			'-' if record['peak_rss_mb'] is None else '{0:8.1f}'.format(record['peak_rss_mb']),
+			'yes' if record['runs'] == 0 else ''))
+	return '\n'.join(lines)
@@ -0,0 +1,80 @@
+import numpy as np
+'''
+Synthetic Kepler-like light curves of an eclipsing binary, for trying things out and
+for 'benchmark.py' when there's no real data around (or you need to know the truth).
+
+synthetic_eb makes a multi-quarter light curve the way 'makelc.py' sees it right after
+reading the FITS files: one array per quarter (or month, for short cadence) of time,
+SAP-like flux, and error, with
+- the real Kepler quarter boundaries and long (29.4 min) or short (58.8 s) cadence
+- a different flux level in every quarter, and a slow polynomial drift in each one
+- NaN runs (some in the flux only, some in the time too), like the real files
+- primary and secondary eclipses from a period and BJD0, plus white noise
+    lc = synthetic_eb(quarters=range(1, 18), cadence='long', seed=1)
+    lc['time'][0], lc['flux'][0], lc['ferr'][0]   # quarter lc['quarter'][0]
+lc['mstart'] and lc['mend'] mask every eclipse (Kepler time), and the rest of the
+settings are passed back too.
+'''
+
+# Kepler cadences, in days
+LONG_CADENCE = 0.02043357
+SHORT_CADENCE = 0.00068112
+# (start, end) of each quarter Q0-Q17 in Kepler time (BJD - 2454833)
+QUARTERS = [(120.5, 130.3), (131.5, 165.0), (169.8, 258.5), (260.2, 349.5), (352.4, 442.2),
+	(443.5, 538.2), (539.5, 629.3), (630.2, 719.6), (735.4, 802.3), (808.5, 905.9),
+	(906.8, 1000.3), (1001.2, 1098.3), (1099.4, 1181.0), (1182.0, 1273.1), (1274.2, 1371.3),
+	(1373.3, 1471.1), (1472.1, 1557.9), (1559.2, 1591.0)]
+
+# Relative flux of a detached EB: V-ish eclipses (deepest in the middle) of the given
+# depths, 'duration' days long, with the secondary at phase 'secondary_phase'
+def eb_model(t, period, T0, depths=(0.1, 0.04), duration=0.4, secondary_phase=0.5):
+	flux = np.ones(len(t))
+	for depth, phase in zip(depths, (0.0, secondary_phase)):
+		offset = (((t - T0) / period - phase + 0.5) % 1 - 0.5) * period
+		flux -= depth * np.sqrt(np.clip(1 - np.abs(offset) / (0.5*duration), 0, 1))
+	return flux
+
+# A synthetic multi-quarter light curve (see the top of this file)
+# quarters: Kepler quarters to make; cadence: 'long' or 'short' (short cadence comes in
+# three months per quarter, like the real files)
+# period, BJD0 (full BJD), depths, duration, secondary_phase: the eclipses
+# noise: relative white noise; levels: relative scatter of the quarter flux levels;
+# trend: relative size of the drift within each quarter; nanfrac: fraction of NaNs
+# flux0: typical flux (e-/s); seed: random seed (same seed, same light curve)
+def synthetic_eb(quarters=range(1, 18), cadence='long', period=20.68639, BJD0=2454966.882,
+		depths=(0.1, 0.04), duration=0.4, secondary_phase=0.5, noise=3e-4, levels=0.01,
+		trend=0.002, nanfrac=0.01, flux0=1e5, seed=0):
+	rng = np.random.RandomState(seed)
+	step = LONG_CADENCE if cadence == 'long' else SHORT_CADENCE
+	T0 = BJD0 - 2454833.
+	times, fluxes, ferrs, numbers, months = [], [], [], [], []
+	for q in quarters:
+		start, end = QUARTERS[q]
+		if cadence == 'long':
+			edges = [(start, end, None)]
+		else: # three months, with a short downlink gap between them
+			cuts = np.linspace(start, end, 4)
+			edges = [(cuts[m], cuts[m+1] - 0.5, m + 1) for m in range(0, 3)]
+		level = flux0 * (1 + levels * rng.randn())
+		for mstart, mend, month in edges:
+			t = np.arange(mstart, mend, step)
+			x = (t - t.mean()) / (0.5 * (mend - mstart))
+			drift = 1 + trend * (rng.randn() * x + rng.randn() * x**2 + rng.randn() * x**3)
+			flux = level * drift * (eb_model(t, period, T0, depths, duration, secondary_phase) +
+				noise * rng.randn(len(t)))
+			ferr = np.zeros(len(t)) + level * noise
+			# NaN runs of 1-20 cadences; in a third of them the time is NaN too
+			nruns = rng.poisson(nanfrac * len(t) / 10.5)
+			for first, length in zip(rng.randint(0, len(t), nruns), rng.randint(1, 21, nruns)):
+				flux[first:first+length] = np.nan
+				ferr[first:first+length] = np.nan
+				if rng.rand() < 1/3.:
+					t[first:first+length] = np.nan
+			times.append(t); fluxes.append(flux); ferrs.append(ferr)
+			numbers.append(q); months.append(month)
+	# mask every primary and secondary eclipse, a little wider than the eclipse
+	cycles = np.arange(np.floor((QUARTERS[0][0] - T0) / period) - 1, np.ceil((QUARTERS[-1][1] - T0) / period) + 1)
+	middles = np.sort(np.concatenate((T0 + cycles*period, T0 + (cycles + secondary_phase)*period)))
+	return dict(time=times, flux=fluxes, ferr=ferrs, quarter=numbers, month=months,
+		mstart=middles - 0.75*duration, mend=middles + 0.75*duration, period=period, BJD0=BJD0,
+		depths=depths, duration=duration, secondary_phase=secondary_phase, cadence=cadence)
@@ -0,0 +1,93 @@
+from __future__ import print_function
+import os
+import csv
+'''
+The target catalog: everything we know about each star (period, BJD0, eclipse phase
+windows, plot limits, and file names), keyed by KIC, in one file that 'makelc.py',
+'ELClcprep.py', and 'lcplotter.py' all read, instead of settings pasted into each one.
+
+The catalog is targets.csv (next to this file) unless you say otherwise: one row per
+star, one column per setting, and an empty cell means 'not set' (the program's default
+is used). Numbers become floats; kic, file names, and notes stay strings. A TOML file
+works too (needs Python 3.11+ or the 'toml' package), one table per KIC:
+    [9246715]
+    period = 171.277967
+    BJD0 = 2455170.514777
+The columns 'lcplotter.py' and 'ELClcprep.py' use:
+    period, BJD0 (full BJD, middle of the primary eclipse)
+    primary_phasemin/max, secondary_phasemin/max (the eclipses, also used for masks)
+    phasemin, phasemax, magdim, magbright, magdimzoom, magbrightzoom, timemin, timemax,
+    zoommagspace, pristarcirclesize, secstarcirclesize (the figure)
+    elc_phasemin, elc_phasemax (the ELC chunk windows, default 0.6 to 1.6)
+    infile (light curve), instub (ELC chunk files), bigoutfile (full ELC light curve)
+A catalog is only read once per process, so a batch can look up as many stars as it
+likes.
+'''
+
+CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'targets.csv')
+
+# columns that are never turned into numbers
+TEXT_COLUMNS = ('kic', 'infile', 'instub', 'bigoutfile', 'notes')
+
+# catalogs that have been read already: filename -> (modification time, targets)
+loaded = {}
+
+# A catalog value as a float if it is a number (and isn't a text column), else as is
+def convert(name, value):
+	if name in TEXT_COLUMNS or not isinstance(value, str):
+		return value
+	try:
+		return float(value)
+	except ValueError:
+		return value
+
+def read_csv_catalog(filename):
+	targets = {}
+	with open(filename) as f:
+		for row in csv.DictReader(line for line in f if not line.startswith('#')):
+			kic = row.pop('kic').strip()
+			targets[kic] = dict((name.strip(), convert(name.strip(), value.strip()))
+				for name, value in row.items() if name and value and value.strip())
+	return targets
+
+def read_toml_catalog(filename):
+	try:
+		import tomllib
+		with open(filename, 'rb') as f:
+			tables = tomllib.load(f)
+	except ImportError:
+		import toml
+		tables = toml.load(filename)
+	return dict((str(kic), dict(settings)) for kic, settings in tables.items())
+
+# All the targets in a catalog: a dictionary of settings dictionaries, keyed by KIC
+# (a string). filename=None is targets.csv.
+def read_targets(filename=None):
+	filename = filename or CATALOG
+	mtime = os.path.getmtime(filename)
+	if filename not in loaded or loaded[filename][0] != mtime:
+		if filename.endswith('.toml'):
+			targets = read_toml_catalog(filename)
+		else:
+			targets = read_csv_catalog(filename)
+		loaded[filename] = (mtime, targets)
+	return loaded[filename][1]
+
+# The settings for one target (a copy, so go ahead and change it)
+def get_target(kic, filename=None):
+	targets = read_targets(filename)
+	if str(kic) not in targets:
+		raise KeyError('KIC {0} is not in the target catalog {1}'.format(kic, filename or CATALOG))
+	return dict(targets[str(kic)])
+
+# The KICs in a catalog, in numerical order
+def catalog_kics(filename=None):
+	return sorted(read_targets(filename), key=int)
+
+# The eclipses of a target, the way make_lightcurve in 'makelc.py' wants them
+# (None if the catalog doesn't have an ephemeris and a primary eclipse window)
+def target_eclipses(target):
+	if not all(name in target for name in ('period', 'BJD0', 'primary_phasemin', 'primary_phasemax')):
+		return None
+	from eclipsemask import target_windows
+	return dict(period=target['period'], BJD0=target['BJD0'], windows=target_windows(target))
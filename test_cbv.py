@@ -0,0 +1,138 @@
+import os
+import glob
+import numpy as np
+import pytest
+from cbv import fit_vectors, cotrend, check_cotrend, get_cbv_manager
+'''
+cbv.py against PyKE's kepcotrend, which 'makelc.py' used to run with method='simplex',
+fitpower=1 (a downhill simplex minimization of the summed absolute residuals).
+
+There's no kepcotrend output in the repository, so test_check_cotrend builds its
+'PyKE' file with an independent copy of kepcotrend's fit (scipy's downhill simplex
+inside a sigma-clipping loop, see simplex_cotrend), not with cbv.py.
+test_pyke_outputs compares with every real kepcotrend output (cbv_kplr*.fits, left
+next to the light curves by older versions of 'makelc.py') it can find: set
+KEPLER_PYKE_DIR to a directory with them (default: ~/.kplr/data/lightcurves) and
+KEPLER_CBV_DIR to the basis vector directory (default: basisvectors/).
+'''
+
+PYKE_DIR = os.environ.get('KEPLER_PYKE_DIR', os.path.expanduser('~/.kplr/data/lightcurves'))
+CBV_DIR = os.environ.get('KEPLER_CBV_DIR', 'basisvectors')
+# largest allowed difference from PyKE, as a fraction of the median SAP flux
+TOLERANCE = 5e-4
+
+# a quarter of fake SAP flux: two smooth basis vectors, noise, and (maybe) some
+# flares/cosmic rays bunched up in the first half
+def fake_quarter(seed=0, n=4000, outliers=True):
+	rng = np.random.RandomState(seed)
+	time = 350 + np.arange(n) * 0.0204
+	x = np.linspace(-1, 1, n)
+	vectors = np.array([x + 0.3*x**2, np.sin(3*x)]) * 0.01
+	flux = 1e5 * (1 + np.dot([1.5, -0.8], vectors) + 2e-4 * rng.randn(n))
+	if outliers:
+		flux[rng.randint(0, n//2, 40)] *= 1 + 0.2 * rng.rand(40)
+	return time, flux, vectors
+
+def test_l1_fit_matches_simplex():
+	optimize = pytest.importorskip('scipy.optimize')
+	time, flux, vectors = fake_quarter()
+	design, y = vectors.T, flux / np.median(flux) - 1
+	coeffs = fit_vectors(design, y, fitpower=1)
+	# what kepcotrend does: a downhill simplex on sum(|residuals|)
+	cost = lambda c: np.sum(np.abs(y - np.dot(design, c)))
+	simplex = optimize.fmin(cost, np.linalg.lstsq(design, y, rcond=None)[0], xtol=1e-10,
+		ftol=1e-12, maxiter=20000, maxfun=20000, disp=False)
+	assert cost(coeffs) <= cost(simplex) * (1 + 1e-6)
+	assert np.allclose(coeffs, simplex, rtol=0, atol=1e-4)
+
+def test_l1_is_not_least_squares():
+	# the outliers pull a least squares fit around, but not the kepcotrend-style one
+	time, flux, vectors = fake_quarter()
+	shift = {}
+	for fitpower in (1, 2):
+		coeffs = cotrend(time, flux, vectors, fitpower=fitpower, iterate=False)[2]
+		clean = cotrend(*fake_quarter(outliers=False), fitpower=fitpower, iterate=False)[2]
+		shift[fitpower] = np.abs(coeffs - clean).max()
+	assert shift[1] < 0.01
+	assert shift[2] > 10 * shift[1]
+
+# kepcotrend's method='simplex', fitpower=1, iterate='yes' written out the slow way,
+# without anything from cbv.py: normalize by the median, fit sum(|residuals|) with a
+# downhill simplex (starting from least squares), clip points more than sigmaclip*std
+# from the fit, and fit again until nothing else gets clipped
+def simplex_cotrend(time, flux, vectors, mstart=[], mend=[], nvec=2, sigmaclip=2.0):
+	optimize = pytest.importorskip('scipy.optimize')
+	design = vectors[:nvec].T
+	medflux = np.median(flux)
+	y = flux / medflux - 1
+	use = np.ones(len(time), dtype=bool)
+	for start, end in zip(mstart, mend):
+		use &= ~((time > start) & (time < end))
+	while True:
+		cost = lambda c: np.sum(np.abs(y[use] - np.dot(design[use], c)))
+		coeffs = optimize.fmin(cost, np.linalg.lstsq(design[use], y[use], rcond=None)[0],
+			xtol=1e-12, ftol=1e-14, maxiter=20000, maxfun=20000, disp=False)
+		resid = y - np.dot(design, coeffs)
+		keep = use & (np.abs(resid) <= sigmaclip * np.std(resid[use]))
+		if keep.sum() == use.sum():
+			break
+		use = keep
+	model = np.dot(design, coeffs) * medflux
+	return flux - model, model
+
+def test_check_cotrend(tmp_path):
+	fits = pytest.importorskip('astropy.io.fits')
+	time, flux, vectors = fake_quarter(1)
+	# an 'eclipse' that has to be masked out of the fit
+	flux[(time > 380) & (time < 381)] *= 0.9
+	mstart, mend = [379.9], [381.1]
+	cadenceno = np.arange(len(time)) + 11914
+	cbvfile = str(tmp_path / 'kplr2010078174524-q04-d25_lcbv.fits')
+	fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns([
+		fits.Column(name='CADENCENO', format='J', array=cadenceno),
+		fits.Column(name='VECTOR_1', format='D', array=vectors[0]),
+		fits.Column(name='VECTOR_2', format='D', array=vectors[1])], name='MODOUT_2_1')]).writeto(cbvfile)
+	# a 'PyKE' file, cotrended the kepcotrend way (but not with cbv.py)
+	cbvflux, cbvmodl = simplex_cotrend(time, flux, vectors, mstart, mend)
+	header = fits.Header([('QUARTER', 4), ('MODULE', 2), ('OUTPUT', 1), ('DATA_REL', 25)])
+	pykefile = str(tmp_path / 'cbv_kplr000000001-2010078095331_llc.fits')
+	fits.HDUList([fits.PrimaryHDU(header=header), fits.BinTableHDU.from_columns([
+		fits.Column(name=name, format='D', array=array) for name, array in
+		(('TIME', time), ('SAP_FLUX', flux), ('CBVSAP_FLUX', cbvflux), ('CBVSAP_MODL', cbvmodl))] +
+		[fits.Column(name='CADENCENO', format='J', array=cadenceno)])]).writeto(pykefile)
+	assert max(check_cotrend(pykefile, cbvfile, mstart, mend)) < 1e-8
+	assert max(check_cotrend(pykefile, get_cbv_manager(str(tmp_path)), mstart, mend)) < 1e-8
+	# a least squares fit doesn't match it, and neither does forgetting the mask
+	assert max(check_cotrend(pykefile, cbvfile, mstart, mend, fitpower=2)) > 1e-6
+	assert max(check_cotrend(pykefile, cbvfile)) > 1e-6
+
+def test_month_from_cadences(tmp_path):
+	fits = pytest.importorskip('astropy.io.fits')
+	# three monthly short cadence CBV files, named out of time order on purpose
+	starts = {1: 20000, 2: 65000, 3: 42000}
+	for month, start in starts.items():
+		cadenceno = np.arange(start, start + 20000)
+		fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns([
+			fits.Column(name='CADENCENO', format='J', array=cadenceno),
+			fits.Column(name='VECTOR_1', format='D', array=np.zeros(len(cadenceno)))],
+			name='MODOUT_2_1')]).writeto(str(tmp_path / 'kplr20100{0}0000000-q05-m{0}-d25_scbv.fits'.format(month)))
+	cbvs = get_cbv_manager(str(tmp_path))
+	for month, start in starts.items():
+		# a light curve that starts a bit late and runs a bit past the end of its month
+		assert cbvs.month(5, np.arange(start + 300, start + 20500)) == month
+	assert cbvs.month(5, np.arange(100, 200)) is None
+	assert cbvs.month(6, np.arange(20000, 30000)) is None
+
+def test_pyke_outputs():
+	pytest.importorskip('astropy.io.fits')
+	from eclipsemask import read_mask
+	pykefiles = sorted(glob.glob(os.path.join(PYKE_DIR, '*', 'cbv_kplr*.fits')))
+	if not pykefiles or not os.path.isdir(CBV_DIR):
+		pytest.skip('no kepcotrend outputs in {0} (or no CBVs in {1})'.format(PYKE_DIR, CBV_DIR))
+	cbvs = get_cbv_manager(CBV_DIR)
+	for pykefile in pykefiles:
+		# kepcotrend was given the target's mask file, if it had one
+		maskfile = os.path.join(os.path.dirname(pykefile), 'mask_kepcotrend.txt')
+		mstart, mend = read_mask(maskfile) if os.path.exists(maskfile) else ([], [])
+		fluxdiff, modldiff = check_cotrend(pykefile, cbvs, mstart, mend)
+		assert fluxdiff < TOLERANCE and modldiff < TOLERANCE, (pykefile, fluxdiff, modldiff)
@@ -0,0 +1,33 @@
+import numpy as np
+from detrend import sliding_median
+'''
+The sliding median in detrend.py (also used by outliers.py), against np.median over
+every window done the slow way.
+'''
+
+# np.median of every window of 'width' points, leaving out masked points
+def brute_median(y, width, mask=None):
+	half = width // 2
+	medians = np.empty(len(y))
+	for i in range(0, len(y)):
+		window = slice(max(i - half, 0), i + half + 1)
+		values = y[window] if mask is None else y[window][~mask[window]]
+		medians[i] = np.median(values) if len(values) else np.nan
+	return medians
+
+def test_sliding_median():
+	rng = np.random.RandomState(0)
+	for n, width in ((1, 5), (10, 1), (50, 7), (400, 31), (400, 30), (1500, 201), (100, 301)):
+		y = rng.randn(n)
+		y[rng.rand(n) < 0.2] = 0.5 # lots of ties
+		assert np.allclose(sliding_median(y, width), brute_median(y, width | 1))
+
+def test_sliding_median_masked():
+	rng = np.random.RandomState(1)
+	for n, width in ((50, 7), (400, 31), (1500, 201)):
+		y = rng.randn(n)
+		mask = rng.rand(n) < 0.3
+		mask[n//3:n//3 + width] = True # a masked stretch longer than the window
+		expected = brute_median(y, width, mask)
+		assert np.isnan(expected).any()
+		assert np.allclose(sliding_median(y, width, mask), expected, equal_nan=True)
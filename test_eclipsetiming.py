@@ -0,0 +1,73 @@
+import numpy as np
+from synthlc import synthetic_eb
+from eclipsetiming import eclipse_times
+'''
+Eclipse times from eclipsetiming.py on synthetic light curves, where the true O-C is zero.
+'''
+
+PERIOD = 20.68639
+BJD0 = 2454966.882
+WINDOWS = [(0.985, 1.015), (0.485, 0.515)]
+
+def light_curve(seed):
+	lc = synthetic_eb(period=PERIOD, BJD0=BJD0, trend=0.0, seed=seed)
+	return np.concatenate(lc['time']), np.concatenate(lc['flux']), np.concatenate(lc['ferr'])
+
+# robust rms of (O-C)/err: about 1 if the errors are right
+def pull_scatter(timing, eclipse):
+	pull = timing['oc'][timing['eclipse'] == eclipse] / timing['err'][timing['eclipse'] == eclipse]
+	return 1.4826 * np.median(np.abs(pull - np.median(pull)))
+
+def test_errors_match_scatter():
+	for seed in (1, 2):
+		t, flux, ferr = light_curve(seed)
+		for method in ('template', 'poly'):
+			timing = eclipse_times(t, flux, PERIOD, BJD0, WINDOWS, ferr, method=method)
+			for eclipse in (0, 1):
+				assert 0.6 < pull_scatter(timing, eclipse) < 1.6, (seed, method, eclipse)
+
+def test_errors_match_noise():
+	# calibrate_errors makes the O-C scatter match the errors by construction, so check
+	# against the truth instead: the O-C should be 0, so over many noise realizations
+	# the scatter of the O-C around 0 is the real error
+	for method in ('template', 'poly'):
+		oc, err, raw = [], [], []
+		for seed in range(0, 12):
+			t, flux, ferr = light_curve(seed)
+			timing = eclipse_times(t, flux, PERIOD, BJD0, WINDOWS, ferr, method=method)
+			oc.append(timing['oc'])
+			err.append(timing['err'])
+			raw.append(eclipse_times(t, flux, PERIOD, BJD0, WINDOWS, ferr, method=method,
+				calibrate=False)['err'])
+		oc, err, raw = np.concatenate(oc), np.concatenate(err), np.concatenate(raw)
+		# robust rms of O-C/err around the true O-C of zero
+		pull = 1.4826 * np.median(np.abs(oc / err))
+		assert 0.75 < pull < 1.35, (method, pull)
+		# no eclipse gets a (much) too small error
+		assert np.all(err > 0.2 * np.median(err)), method
+		# the errors straight from the fits are further off than the calibrated ones
+		rawpull = 1.4826 * np.median(np.abs(oc / raw))
+		assert abs(np.log(rawpull)) > abs(np.log(pull)), (method, pull, rawpull)
+
+def test_processes():
+	t, flux, ferr = light_curve(1)
+	for method in ('template', 'poly'):
+		one = eclipse_times(t, flux, PERIOD, BJD0, WINDOWS, ferr, method=method)
+		three = eclipse_times(t, flux, PERIOD, BJD0, WINDOWS, ferr, method=method, processes=3)
+		for name in one:
+			assert np.array_equal(one[name], three[name]), (method, name)
+
+def test_template_times():
+	t, flux, ferr = light_curve(1)
+	timing = eclipse_times(t, flux, PERIOD, BJD0 - 3.0/1440, WINDOWS, ferr)
+	assert len(timing['oc']) > 120
+	# every eclipse comes 3 minutes after the (wrong) ephemeris
+	assert abs(np.median(timing['oc']) - 3.0/1440) < 0.1/1440
+	assert np.std(timing['oc']) < 1.0/1440
+
+def test_windows_are_independent():
+	# the secondary is timed the same way with or without the primary
+	t, flux, ferr = light_curve(2)
+	both = eclipse_times(t, flux, PERIOD, BJD0, [(0.96, 1.04), WINDOWS[1]], ferr)
+	alone = eclipse_times(t, flux, PERIOD, BJD0, [WINDOWS[1]], ferr)
+	assert np.allclose(both['oc'][both['eclipse'] == 1], alone['oc'], rtol=0, atol=1e-8)
@@ -0,0 +1,217 @@
+import os
+import numpy as np
+import pytest
+from lc_functions import (elc_chunks, write_elc_chunks, read_elc_manifest, read_lc,
+	lineup_qtr_gaps, nan_delete, phasefold, phasecalc)
+'''
+NaN deletion, phase folding, light curve files, ELC chunks, and lining up quarters,
+from lc_functions.py.
+'''
+
+def test_elc_chunks_bad_window():
+	times = np.linspace(0, 100, 500)
+	for phasemin, phasemax in ((0.6, 0.6), (1.6, 0.6)):
+		with pytest.raises(ValueError):
+			elc_chunks(times, 10.0, 0.0, phasemin, phasemax)
+
+def test_rewrite_removes_stale_chunks(tmp_path):
+	outstub = str(tmp_path / 'lcchunk')
+	times = np.linspace(0, 100, 1000)
+	mags = np.zeros(len(times))
+	first = write_elc_chunks(outstub, times, mags, mags, 10.0, 0.0)[0]
+	assert len(first) == 11
+	# a shorter light curve has fewer chunks, and the extra old files are gone
+	second = write_elc_chunks(outstub, times[:300], mags[:300], mags[:300], 10.0, 0.0)[0]
+	assert len(second) == 4
+	assert [entry['file'] for entry in read_elc_manifest(outstub)] == [entry['file'] for entry in second]
+	assert sorted(os.listdir(str(tmp_path))) == sorted(['lcchunkmanifest.txt'] +
+		[os.path.basename(entry['file']) for entry in second])
+
+def test_read_lc_one_column_or_row(tmp_path):
+	onecol = str(tmp_path / 'onecol.txt')
+	np.savetxt(onecol, np.arange(5.0))
+	(time,) = read_lc(onecol)
+	assert np.array_equal(time, np.arange(5.0))
+	(flux,) = read_lc(onecol, usecols=[0])
+	assert len(flux) == 5
+	onerow = str(tmp_path / 'onerow.txt')
+	np.savetxt(onerow, [[1.0, 2.0, 3.0]])
+	time, mag, merr = read_lc(onerow)
+	assert list(time) == [1.0] and list(merr) == [3.0]
+
+# lineup_qtr_gaps as it was before it was rewritten (nested while loops over the mask,
+# every difference recomputed after every shift), with only a maxiter added and the
+# count returned; the new version has to give the same shifts
+def old_lineup_qtr_gaps(time, flux, maskstart, maskend, maxiter=None):
+	diffs = np.zeros(len(time) - 1)
+	for i in range(0,len(time) - 1): # loop through quarters
+	# calculate differences between flux points at quarter start/end
+		start = 0
+		end = -1
+		for idx, mask in enumerate(maskstart):
+			while (time[i][end] > maskstart[idx] and time[i][end] < maskend[idx]):
+				end -= 1
+			while (time[i+1][start] > maskstart[idx] and time[i+1][start] < maskend[idx]):
+				start += 1
+		diffs[i] = (flux[i][end] - flux[i+1][start])
+	# maxi will find the point with the largest change in flux
+	maxi = lambda z: np.where(max(abs(z)) == abs(z))[0][0]
+	cntr = 0 # counter
+	max_val = max(abs(diffs))
+	while max_val > 100 and (maxiter is None or cntr < maxiter):
+		ind = maxi(diffs)
+		diff = diffs[ind]
+		flux[ind] = flux[ind] - diff/2.0
+		flux[ind+1] = flux[ind+1] + diff/2.0
+		diffs = np.zeros(len(time) - 1)
+		for i in range(0, len(time) - 1):
+			start = 0
+			end = -1
+			for idx, mask in enumerate(maskstart):
+				while time[i][end] > maskstart[idx] and time[i][end] < maskend[idx]:
+					end -= 1
+				while time[i+1][start] > maskstart[idx] and time[i+1][start] < maskend[idx]:
+					start += 1
+			diffs[i] = (flux[i][end] - flux[i+1][start])
+		cntr += 1 # count how many times this while-loop happens
+		max_val = max(abs(diffs))
+	return time, flux, cntr
+
+# random quarters of flux with big jumps between them, and masks over some of the
+# quarter edges (an eclipse across a data gap) and inside the quarters
+def random_quarters(rng, nqtr):
+	time, flux, mstart, mend = [], [], [], []
+	for q in range(0, nqtr):
+		n = rng.randint(30, 200)
+		time.append(q*100.0 + np.arange(n)*0.02)
+		flux.append(1e4 + rng.normal(0, 2000) + 20*rng.randn(n))
+		middle = time[-1][n//2]
+		mstart.append(middle - 0.1)
+		mend.append(middle + 0.1)
+	for q in range(0, nqtr - 1):
+		if rng.rand() < 0.6:
+			mstart.append(time[q][-rng.randint(1, 6)] - 0.001)
+			mend.append(time[q+1][rng.randint(0, 5)] + 0.001)
+	return time, flux, np.array(mstart), np.array(mend)
+
+# the constant shift lineup_qtr_gaps gave each quarter
+def lineup_offsets(lineup, time, flux, mstart, mend, **kwargs):
+	result = lineup(time, [f.copy() for f in flux], mstart, mend, **kwargs)
+	return [np.mean(new - old) for new, old in zip(result[1], flux)], result[2]
+
+def test_lineup_matches_old_version():
+	rng = np.random.RandomState(3)
+	capped = 0
+	for trial in range(0, 20):
+		time, flux, mstart, mend = random_quarters(rng, rng.randint(2, 18))
+		expected, oldcount = lineup_offsets(old_lineup_qtr_gaps, time, flux, mstart, mend)
+		offsets, count = lineup_offsets(lineup_qtr_gaps, time, flux, mstart, mend,
+			return_iterations=True)
+		assert oldcount > 0 and count == oldcount
+		assert np.allclose(offsets, expected, rtol=0, atol=1e-6)
+		capped += count > 3
+		# stopping early stops at the same place, too
+		expected, oldcount = lineup_offsets(old_lineup_qtr_gaps, time, flux, mstart, mend, maxiter=3)
+		offsets, count = lineup_offsets(lineup_qtr_gaps, time, flux, mstart, mend, maxiter=3,
+			return_iterations=True)
+		assert count == oldcount <= 3
+		assert np.allclose(offsets, expected, rtol=0, atol=1e-6)
+	assert capped >= 10 # most of them really were cut short
+
+def test_lineup_masked_quarter():
+	# a quarter with every point masked uses its edges (the old version walked off the
+	# end of it), which is what the old version does without that quarter's mask
+	rng = np.random.RandomState(4)
+	time, flux, mstart, mend = random_quarters(rng, 6)
+	keep = (mend < time[2][0]) | (mstart > time[2][-1])
+	mstart, mend = mstart[keep], mend[keep]
+	expected, oldcount = lineup_offsets(old_lineup_qtr_gaps, time, flux, mstart, mend)
+	offsets, count = lineup_offsets(lineup_qtr_gaps, time, flux,
+		np.append(mstart, time[2][0] - 0.001), np.append(mend, time[2][-1] + 0.001),
+		return_iterations=True)
+	assert count == oldcount
+	assert np.allclose(offsets, expected, rtol=0, atol=1e-6)
+
+def test_lineup_one_quarter():
+	time, flux = [np.arange(10.0)], [np.arange(10.0) * 1e3]
+	newtime, newflux, count = lineup_qtr_gaps(time, list(flux), [], [], return_iterations=True)
+	assert count == 0 and np.array_equal(newflux[0], flux[0])
+	assert lineup_qtr_gaps([], [], [], [], return_iterations=True)[2] == 0
+
+def test_nan_delete_columns():
+	time = np.array([1.0, 2.0, np.nan, 4.0, 5.0])
+	flux = np.array([10, np.nan, 30, 40, 50], dtype=np.float32)
+	quality = np.array([0, 1, 2, 3, 4], dtype=np.int32)
+	vectors = np.arange(10.0).reshape(5, 2)
+	vectors[3, 1] = np.nan
+	newtime, newflux, newquality, newvectors, keep = nan_delete(time, flux, quality, vectors,
+		return_mask=True)
+	assert list(keep) == [True, False, False, False, True]
+	assert list(newtime) == [1.0, 5.0] and list(newquality) == [0, 4]
+	assert newflux.dtype == np.float32 and newquality.dtype == np.int32
+	assert newvectors.shape == (2, 2)
+	# one column still comes back as a tuple
+	assert len(nan_delete(time)) == 1
+	with pytest.raises(ValueError):
+		nan_delete(time, flux[:3])
+
+def test_nan_delete_record_array():
+	table = np.rec.fromarrays([np.array([1.0, 2.0, 3.0]), np.array([np.nan, 1.0, 2.0], dtype=np.float32),
+		np.array([5, 6, 7], dtype=np.int32)], names='time,sap_flux,sap_quality')
+	clean, keep = nan_delete(table, return_mask=True)
+	assert list(keep) == [False, True, True]
+	assert clean.dtype == table.dtype
+	assert list(clean['sap_quality']) == [6, 7] and list(clean.time) == [2.0, 3.0]
+
+# phasecalc as it was before phasefold, with the cycle numbers it worked out returned too
+def old_phasecalc(times, period=100, BJD0=2454833):
+	phases = []
+	cycles = []
+	for i in range(0, len(times)):
+		fracP = (times[i] - BJD0) / period
+		if fracP < 0:
+			phases.append(fracP % 1)
+			cycles.append(int(fracP))
+		else:
+			phases.append(fracP % 1)
+			cycles.append(int(fracP) + 1)
+	return phases, cycles
+
+def test_phasefold_matches_old_phasecalc():
+	rng = np.random.RandomState(5)
+	period, BJD0 = 20.68639, 2454966.882
+	times = BJD0 + rng.uniform(-300, 1500, 2000)
+	oldphases, oldcycles = old_phasecalc(times, period, BJD0)
+	phases, phase2s, cycles = phasefold(times, period, BJD0)
+	assert np.allclose(phases, oldphases, rtol=0, atol=1e-9)
+	assert np.array_equal(cycles, oldcycles)
+	assert np.array_equal(phase2s, phases + 1)
+	assert np.array_equal(phasecalc(times, period, BJD0), phases)
+
+def test_phasefold_many_periods():
+	times = np.linspace(0, 100, 50)
+	periods = np.array([3.0, 7.5, 10.0])
+	phases, phase2s, cycles = phasefold(times, periods, 1.0)
+	assert phases.shape == phase2s.shape == cycles.shape == (3, 50)
+	for i, period in enumerate(periods):
+		one = phasefold(times, period, 1.0)
+		assert np.array_equal(phases[i], one[0]) and np.array_equal(cycles[i], one[2])
+	# one epoch per period works too
+	phases = phasefold(times, periods, np.array([0.0, 1.0, 2.0]))[0]
+	assert np.array_equal(phases[2], phasefold(times, 10.0, 2.0)[0])
+
+def test_phasefold_wraps():
+	period, BJD0 = 3.0, 2454833.0
+	k = np.arange(-3, 4)
+	# right on an eclipse: phase 0 and the next cycle starts (also before BJD0, where
+	# the old loop's int() gave the cycle before)
+	phases, phase2s, cycles = phasefold(BJD0 + k*period, period, BJD0)
+	assert np.all(phases == 0) and np.array_equal(cycles, k + 1)
+	# just before one: the end of the cycle before
+	phases, phase2s, cycles = phasefold(BJD0 + k*period - 1e-6, period, BJD0)
+	assert np.all(phases > 0.999) and np.array_equal(cycles, k)
+	# round-off can't make a phase of exactly 1, and time = BJD0 + (cycle - 1 + phase)*period
+	times = BJD0 + np.arange(-1000, 1000) * 0.1
+	phases, phase2s, cycles = phasefold(times, 0.1, BJD0)
+	assert np.all((phases >= 0) & (phases < 1))
+	assert np.allclose(BJD0 + (cycles - 1 + phases) * 0.1, times, rtol=0, atol=1e-6)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from lcstore import LCStore
+'''
+The light curve store, in particular that a half-finished append can't shift the
+rows of the targets added after it.
+'''
+
+def test_append_after_crash(tmp_path):
+	store = LCStore(str(tmp_path), mode='a')
+	store.append('1', [np.arange(5.0), np.ones(5)], ['time', 'flux'], quarters=[1, 1, 1, 2, 2])
+	# an append that wrote some column data but died before saving the index
+	with open(store.colfile('time'), 'ab') as f:
+		np.arange(3.0).tofile(f)
+	store = LCStore(str(tmp_path), mode='a')
+	store.append('2', [np.arange(10.0, 14.0), np.zeros(4)], ['time', 'flux'])
+	store = LCStore(str(tmp_path))
+	time, flux = store.get('2')
+	assert np.array_equal(time, np.arange(10.0, 14.0))
+	assert np.array_equal(flux, np.zeros(4))
+	assert np.array_equal(store.get('1', ['time'], quarter=2)[0], [3.0, 4.0])
+
+def test_bad_quarters_write_nothing(tmp_path):
+	store = LCStore(str(tmp_path), mode='a')
+	store.append('1', [np.arange(3.0)], ['time'])
+	with pytest.raises(ValueError):
+		store.append('2', [np.arange(3.0)], ['time'], quarters=[1, 2, 1])
+	assert store.index['nrows'] == 3
+	assert len(np.fromfile(store.colfile('time'))) == 3
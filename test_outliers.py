@@ -0,0 +1,46 @@
+import numpy as np
+from outliers import find_outliers
+'''
+outliers.py: isolated blips are found, and nothing inside the mask (or an eclipse
+that isn't masked) ever is.
+'''
+
+# two quarters of flat, noisy flux with a quarter break at t = 50
+# (the tests use a 2 day window: with only ~25 points in the default 0.5 days, the MAD
+# is noisy enough that plain noise gets past 5 sigma a few times in 4500 points)
+def flat_lc(seed=0):
+	rng = np.random.RandomState(seed)
+	t = np.concatenate((np.arange(0, 45, 0.02), np.arange(50, 95, 0.02)))
+	return t, 1e5 * (1 + 1e-4 * rng.randn(len(t)))
+
+def test_isolated_spike():
+	t, flux = flat_lc()
+	spikes = [300, 1200, 3000]
+	flux[spikes] *= [1.005, 0.995, 1.003]
+	outliers = find_outliers(t, flux, window=2.0, breaks=[50])
+	assert list(np.nonzero(outliers)[0]) == spikes
+	# a spike in only one of two fluxes counts
+	outliers = find_outliers(t, [flat_lc(1)[1], flux], window=2.0, breaks=[50])
+	assert list(np.nonzero(outliers)[0]) == spikes
+
+def test_mask_is_never_clipped():
+	t, flux = flat_lc()
+	# an eclipse and some spikes, all inside the mask
+	flux *= 1 - 0.05 * np.clip(1 - np.abs(t - 20.0) / 0.2, 0, 1)
+	inside = [995, 1000, 1005]
+	flux[inside] *= 1.01
+	outliers = find_outliers(t, flux, window=2.0, breaks=[50], mstart=[19.7], mend=[20.3])
+	assert not outliers[(t > 19.7) & (t < 20.3)].any()
+	assert not outliers.any()
+	# a whole quarter masked
+	outliers = find_outliers(t, flux, window=2.0, breaks=[50], mstart=[-1, 19.7], mend=[46, 20.3])
+	assert not outliers[t < 50].any()
+
+def test_unmasked_eclipse_is_kept():
+	t, flux = flat_lc()
+	flux *= 1 - 0.05 * np.clip(1 - np.abs(t - 70.0) / 0.2, 0, 1)
+	flux[100] *= 1.005
+	outliers = find_outliers(t, flux, window=2.0, breaks=[50])
+	assert list(np.nonzero(outliers)[0]) == [100]
+	# with maxrun=None the eclipse bottom gets clipped
+	assert find_outliers(t, flux, window=2.0, breaks=[50], maxrun=None)[np.abs(t - 70.0) < 0.2].any()
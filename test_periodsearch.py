@@ -0,0 +1,38 @@
+import numpy as np
+from synthlc import synthetic_eb
+from periodsearch import refine_ephemeris, find_period
+'''
+Does periodsearch.py get back the period and BJD0 put into a synthetic light curve?
+'''
+
+PERIOD = 20.68639
+BJD0 = 2454966.882
+
+# the light curve (Kepler time and flux, all quarters together)
+def light_curve(**kwargs):
+	lc = synthetic_eb(period=PERIOD, BJD0=BJD0, **kwargs)
+	return np.concatenate(lc['time']), np.concatenate(lc['flux']), np.concatenate(lc['ferr'])
+
+# BJD0 minus the injected one, moved to the nearest primary eclipse (days)
+def bjd0_error(best):
+	dt = best['BJD0'] - BJD0
+	return dt - np.round(dt / PERIOD) * PERIOD
+
+def test_refine_noise_free():
+	t, flux, ferr = light_curve(noise=0.0, seed=0)
+	best = refine_ephemeris(t, flux, 20.6865, 2454966.88, processes=1)
+	assert abs(best['period'] - PERIOD) < 2e-6
+	assert abs(bjd0_error(best)) < 0.1 / 1440 # 0.1 min
+
+def test_refine_noisy():
+	for seed in (1, 2):
+		t, flux, ferr = light_curve(seed=seed)
+		best = refine_ephemeris(t, flux, 20.6865, 2454966.88, ferr, processes=1)
+		assert abs(best['period'] - PERIOD) < 5e-6
+		assert abs(bjd0_error(best)) < 0.5 / 1440
+
+def test_blind_search():
+	t, flux, ferr = light_curve(quarters=range(1, 6), seed=3)
+	best = find_period(t, flux, ferr, pmin=10, pmax=30, processes=1)
+	assert abs(best['period'] - PERIOD) < 2e-5
+	assert abs(bjd0_error(best)) < 1.0 / 1440
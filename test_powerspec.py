@@ -0,0 +1,49 @@
+import numpy as np
+from powerspec import lomb_scargle, power_density
+'''
+The fast Lomb-Scargle periodogram in powerspec.py, against the direct sums.
+'''
+
+# Lomb-Scargle power the slow way: every point for every frequency
+def direct_lomb_scargle(t, y, freq):
+	y = y - y.mean()
+	power = np.zeros(len(freq))
+	for k, f in enumerate(freq):
+		w = 2*np.pi*f
+		tau = np.arctan2(np.sum(np.sin(2*w*t)), np.sum(np.cos(2*w*t))) / (2*w) if f > 0 else 0.0
+		c, s = np.cos(w*(t - tau)), np.sin(w*(t - tau))
+		power[k] = np.sum(y*c)**2 / np.sum(c*c)
+		if np.sum(s*s) > 1e-12 * len(t): # at f = 0 the sine term is 0/0
+			power[k] += np.sum(y*s)**2 / np.sum(s*s)
+	return power / len(t)
+
+# uneven times with gaps, a sine wave, and noise
+def gappy_series(seed, n=500, span=50.0):
+	rng = np.random.RandomState(seed)
+	t = np.sort(rng.uniform(0, span, n))
+	t = t[(t % 10) < 8] # 2 day gaps every 10 days
+	return t, 0.3*np.sin(2*np.pi*1.7*t) + rng.randn(len(t))
+
+def test_matches_direct_sum():
+	# the whole range up to the Nyquist frequency, then a band that doesn't start at 0
+	for seed in (0, 1, 2):
+		t, y = gappy_series(seed)
+		df = 1.0 / (t[-1] - t[0])
+		N = int(0.5 / np.median(np.diff(t)) / df)
+		for k0 in (0, 37):
+			freq = (k0 + np.arange(N - k0)) * df
+			fast = lomb_scargle(t, y, df, len(freq), k0*df)
+			slow = direct_lomb_scargle(t, y, freq)
+			# relative error everywhere, even where the power is tiny
+			assert np.all(np.abs(fast[1:] - slow[1:]) <= 1e-4 * slow[1:]), (seed, k0)
+			assert abs(fast[0] - slow[0]) <= 1e-4 * slow.mean()
+
+def test_sine_power_and_parseval():
+	t = np.arange(0, 40, 0.02)
+	t = t[(t % 10) < 9]
+	flux = 1 + 1e-3*np.sin(2*np.pi*2.5*t)
+	freq, density = power_density(t, flux)
+	# the peak is at 2.5 per day, and the density adds up to the variance (ppm^2)
+	assert abs(freq[np.argmax(density)] - 2.5e6/86400) < freq[1] - freq[0]
+	ppm = 1e6 * (flux / np.median(flux) - 1)
+	assert abs(np.sum(density) * (freq[1] - freq[0]) / np.var(ppm) - 1) < 0.1
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from quality import (quality_bitmask, quality_mask, quality_tally, DEFAULT_BITMASK,
+	QUALITY_NAMES)
+'''
+Kepler SAP_QUALITY flags (quality.py), and dropping or flagging bad cadences in
+'makelc.py'.
+'''
+
+# a few cadences of SAP_QUALITY: nothing, one default bit, non-default bits, a mix
+QUALITY = np.array([0, 0, 1, 32, 64, 128, 1024, 64 | 4, 0, 2048 | 8192, 8, 0], dtype=np.int32)
+BAD = [False, False, True, True, False, True, False, True, False, False, True, False]
+
+def test_bitmask():
+	assert quality_bitmask('default') == DEFAULT_BITMASK == 175
+	assert quality_bitmask('none') == quality_bitmask(None) == quality_bitmask(0) == 0
+	assert quality_bitmask('all') == 65535
+	assert quality_bitmask('desat,cosmic') == quality_bitmask(['desat', 'cosmic']) == 96
+	assert quality_bitmask(' desat, 64 ') == quality_bitmask(['desat', 64]) == 96
+	assert quality_bitmask(175) == quality_bitmask('175') == 175
+	with pytest.raises(ValueError):
+		quality_bitmask('desat,nonsense')
+
+def test_mask_and_tally():
+	assert list(quality_mask(QUALITY)) == BAD
+	assert list(quality_mask(QUALITY, 0)) == [False] * len(QUALITY)
+	assert list(quality_mask(QUALITY, quality_bitmask('cosmic'))) == list((QUALITY & 64) != 0)
+	tally = dict(zip(QUALITY_NAMES, quality_tally(QUALITY)))
+	assert tally['tweak'] == 1 and tally['cosmic'] == 2 and tally['earth'] == 1
+	assert tally['planetsearch'] == 1 and tally['safemode'] == 0
+	assert sum(quality_tally(QUALITY)) == sum(bin(q).count('1') for q in QUALITY)
+
+# a tiny local archive for makelc.py: one target, two quarters, with QUALITY repeated
+# through every quarter, and the CBVs for them
+def fake_archive(directory, fits, kic=1234567, nrepeat=40):
+	lcdir, cbvdir = directory / 'lc', directory / 'cbv'
+	lcdir.mkdir()
+	cbvdir.mkdir()
+	rng = np.random.RandomState(0)
+	cadenceno = 1000
+	for quarter in (1, 2):
+		n = len(QUALITY) * nrepeat
+		cad = cadenceno + np.arange(n)
+		time = 131.5 + 100*(quarter - 1) + np.arange(n) * 0.0204
+		x = np.linspace(-1, 1, n)
+		vectors = np.array([x, x**2]) * 0.01
+		flux = 1e5 * (1 + np.dot([0.5, 0.3], vectors) + 1e-4 * rng.randn(n))
+		header = fits.Header([('QUARTER', quarter), ('MODULE', 2), ('OUTPUT', 1), ('DATA_REL', 25),
+			('OBSMODE', 'long cadence'), ('KEPMAG', 12.0)])
+		fits.HDUList([fits.PrimaryHDU(header=header), fits.BinTableHDU.from_columns([
+			fits.Column(name='TIME', format='D', array=time),
+			fits.Column(name='SAP_FLUX', format='E', array=flux),
+			fits.Column(name='SAP_FLUX_ERR', format='E', array=np.zeros(n) + 10),
+			fits.Column(name='SAP_QUALITY', format='J', array=np.tile(QUALITY, nrepeat)),
+			fits.Column(name='CADENCENO', format='J', array=cad)])]).writeto(
+			str(lcdir / 'kplr{0:09d}-20090000000{1:02d}_llc.fits'.format(kic, quarter)))
+		fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns([
+			fits.Column(name='CADENCENO', format='J', array=cad),
+			fits.Column(name='VECTOR_1', format='D', array=vectors[0]),
+			fits.Column(name='VECTOR_2', format='D', array=vectors[1])], name='MODOUT_2_1')]).writeto(
+			str(cbvdir / 'kplr2009000000{0:03d}-q{0:02d}-d25_lcbv.fits'.format(quarter)))
+		cadenceno += n + 100
+	return str(lcdir), str(cbvdir) + '/', str(kic)
+
+def test_drop_and_flag(tmp_path):
+	fits = pytest.importorskip('astropy.io.fits')
+	from makelc import make_lightcurve
+	source, cbvdir, kic = fake_archive(tmp_path, fits)
+	nrepeat = 40
+	settings = dict(source=source, cbvdir=cbvdir, maskfile='none.txt', outlier_sigma=None)
+	dropped = make_lightcurve(kic, quality_action='drop', **settings)
+	flagged = make_lightcurve(kic, quality_action='flag', **settings)
+	nbad = sum(BAD) * nrepeat # per quarter
+	# 'drop' loses exactly the default-bitmask cadences, 'flag' keeps every row
+	assert len(flagged['time']) == 2 * len(QUALITY) * nrepeat
+	assert len(dropped['time']) == len(flagged['time']) - 2*nbad
+	assert flagged['flagged'].sum() == 2*nbad and not dropped['flagged'].any()
+	assert np.array_equal(flagged['flagged'], quality_mask(flagged['quality']))
+	assert not quality_mask(dropped['quality']).any()
+	assert np.array_equal(dropped['time'], flagged['time'][~flagged['flagged']])
+	# the tally counts every cadence, dropped or not
+	assert np.array_equal(dropped['quality_tally'], flagged['quality_tally'])
+	assert np.array_equal(flagged['quality_tally'][0], quality_tally(np.tile(QUALITY, nrepeat)))
@@ -0,0 +1,25 @@
+import numpy as np
+import stagecache
+from stagecache import StageCache
+'''
+The makelc.py stage cache: results come back the way they went in, and a stage's
+version is part of its key.
+'''
+
+def test_round_trip(tmp_path):
+	cache = StageCache(str(tmp_path))
+	result = dict(time=[np.arange(3.0), np.arange(2.0)], iterations=4, name='lineup')
+	saved, key = cache.run('lineup', [np.arange(5), 100], lambda: result)
+	loaded, key2 = cache.run('lineup', [np.arange(5), 100], lambda: None)
+	assert key == key2
+	assert [list(t) for t in loaded['time']] == [[0.0, 1.0, 2.0], [0.0, 1.0]]
+	assert loaded['iterations'] == 4 and loaded['name'] == 'lineup'
+
+def test_version_changes_key(tmp_path, monkeypatch):
+	cache = StageCache(str(tmp_path))
+	old = cache.run('lineup', ['parts'], lambda: dict(flux=np.zeros(2)))[1]
+	monkeypatch.setitem(stagecache.STAGE_VERSIONS, 'lineup', stagecache.STAGE_VERSIONS['lineup'] + 1)
+	result, new = cache.run('lineup', ['parts'], lambda: dict(flux=np.ones(2), iterations=1))
+	assert new != old
+	assert list(result['flux']) == [1.0, 1.0]
+	assert StageCache(None).key('lineup', 'parts') is None
@@ -9,6 +9,7 @@ Makes a plot of two stars' oscillation spectra. Presumably the two stars are nea
 so you want to use the better-characterized one to inform an analysis of the noisy one.
 
 Input: two text files with two columns each (frequency and power)
+(make them from 'makelc.py' light curves with 'powerspec.py', e.g. --smooth 0.5)
 Output: pretty plot with one oscillation spectrum on top axis and one on bottom axis
 '''
 target_infile = '../../Rawls_etal_2015/seismicTwin/KIC9246715_smoothed_50.txt'